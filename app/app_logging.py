@@ -1,10 +1,185 @@
+"""
+Application logger.
+
+By default loguru writes formatted lines to stdout and to a rotating file
+from the calling thread. With LOG_ASYNC=true, records are handed to a
+bounded queue and a background thread formats and writes them, so file I/O,
+rotation and compression stay off the event loop. When that queue is full,
+records are dropped (LOG_OVERFLOW=drop, the default) or the caller waits
+(LOG_OVERFLOW=block). LOG_FORMAT=json emits one JSON object per line. Lines
+logged while serving a request carry its request_id. INFO records can be
+sampled per route template with LOG_INFO_SAMPLE_RATE and LOG_SAMPLE_RATES.
+"""
 from loguru import logger as app_logger
-import sys
+import atexit
+import contextlib
+import contextvars
+import json
+import logging.handlers
 import os
+import queue
+import random
+import sys
+import threading
+import traceback
+import zipfile
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "lms_backend.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # 'text' or 'json'
+LOG_ASYNC = os.getenv("LOG_ASYNC", "false").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_OVERFLOW = os.getenv("LOG_OVERFLOW", "drop")  # 'drop' or 'block'
+LOG_ROTATION_BYTES = int(os.getenv("LOG_ROTATION_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+# Fraction of INFO records kept, overridable per route template, e.g.
+# LOG_SAMPLE_RATES="/curriculum=0.01,/lessons/{lesson_id}=0.1"
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (item.rpartition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if item.strip())
+}
+
+TEXT_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+
+
+class _RequestSampling:
+    def __init__(self, scope):
+        self.scope = scope
+        self.keep_info = None
+
+
+_request_sampling = contextvars.ContextVar("request_sampling", default=None)
+
+
+@contextlib.contextmanager
+def request_logging(scope, request_id):
+    """Tag records with `request_id` and sample INFO records for this request."""
+    token = _request_sampling.set(_RequestSampling(scope))
+    try:
+        with app_logger.contextualize(request_id=request_id):
+            yield
+    finally:
+        _request_sampling.reset(token)
+
+
+def _sample(record):
+    if record["level"].name != "INFO":
+        return True
+    sampling = _request_sampling.get()
+    if sampling is None:
+        return True
+    if sampling.keep_info is None:
+        # Decided once per request, after routing, so a request logs all or none of its INFO lines
+        route = sampling.scope.get("route")
+        if route is None:
+            return True
+        rate = LOG_SAMPLE_RATES.get(route.path, LOG_INFO_SAMPLE_RATE)
+        sampling.keep_info = rate >= 1 or random.random() < rate
+    return sampling.keep_info
+
+
+def render_json(record):
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "message": record["message"],
+    }
+    entry.update({key: value for key, value in record["extra"].items() if not key.startswith("_")})
+    if record["exception"] is not None:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    return json.dumps(entry, default=str)
+
+
+def render_text(record):
+    line = f"{record['time']:%Y-%m-%d %H:%M:%S} | {record['level'].name} | {record['name']}:{record['function']}:{record['line']} - {record['message']}"
+    if record["exception"] is not None:
+        line += "\n" + "".join(traceback.format_exception(*record["exception"])).rstrip("\n")
+    return line
+
+
+def _json_format(record):
+    record["extra"]["_json"] = render_json(record)
+    return "{extra[_json]}\n"
+
+
+def _zip_rotator(source, dest):
+    with zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.write(source, os.path.basename(source))
+    os.remove(source)
+
+
+class QueueSink:
+    """Loguru sink that defers formatting and writing to a background thread."""
+
+    def __init__(self, path, render, maxsize=LOG_QUEUE_SIZE, overflow=LOG_OVERFLOW):
+        self.render = render
+        self.overflow = overflow
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._reported_drops = 0
+        self.file_handler = None
+        if path:
+            self.file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=LOG_ROTATION_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True
+            )
+            self.file_handler.namer = lambda name: name + ".zip"
+            self.file_handler.rotator = _zip_rotator
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        record = message.record
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _emit(self, line):
+        sys.stdout.write(line + "\n")
+        if self.file_handler is not None:
+            self.file_handler.emit(logging.makeLogRecord({"msg": line}))
+        self.written += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                if self.dropped != self._reported_drops:
+                    self._emit(f"{self.dropped - self._reported_drops} log records dropped: queue full")
+                    self._reported_drops = self.dropped
+                self._emit(self.render(record))
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+        sys.stdout.flush()
+        if self.file_handler is not None:
+            self.file_handler.close()
+
+    def stop(self, timeout=5):
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "dropped": self.dropped, "written": self.written}
+
+
+queue_sink = None
 
 app_logger.remove()
-app_logger.add(sys.stdout, level=LOG_LEVEL, format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
-app_logger.add(LOG_FILE, level=LOG_LEVEL, rotation="10 MB", retention="10 days", compression="zip") 
\ No newline at end of file
+if LOG_ASYNC:
+    queue_sink = QueueSink(LOG_FILE, render_json if LOG_FORMAT == "json" else render_text)
+    app_logger.add(queue_sink.write, level=LOG_LEVEL, format="{message}", filter=_sample)
+    atexit.register(queue_sink.stop)
+else:
+    log_format = _json_format if LOG_FORMAT == "json" else TEXT_FORMAT
+    app_logger.add(sys.stdout, level=LOG_LEVEL, format=log_format, filter=_sample)
+    app_logger.add(LOG_FILE, level=LOG_LEVEL, format=log_format, filter=_sample, rotation="10 MB", retention="10 days", compression="zip")
@@ -0,0 +1,80 @@
+"""
+Background upkeep for the `auth_codes` table (migration 0006).
+
+Every AUTH_CODE_SWEEP_SECONDS the sweeper makes sure day partitions exist
+AUTH_CODE_PARTITION_DAYS_AHEAD days ahead, drops partitions whose day has
+ended, and deletes used or expired codes from the live partitions in
+batches of AUTH_CODE_PURGE_BATCH rows, so no single delete holds locks for
+long.
+"""
+import asyncio
+import os
+
+from app.app_logging import app_logger as logger
+from app.db import db
+from app.queries import AUTH_CODE_DROP_PARTITIONS, AUTH_CODE_ENSURE_PARTITIONS, AUTH_CODE_PURGE
+
+AUTH_CODE_SWEEP_SECONDS = float(os.getenv("AUTH_CODE_SWEEP_SECONDS", "300"))
+AUTH_CODE_PURGE_BATCH = int(os.getenv("AUTH_CODE_PURGE_BATCH", "1000"))
+AUTH_CODE_PARTITION_DAYS_AHEAD = int(os.getenv("AUTH_CODE_PARTITION_DAYS_AHEAD", "2"))
+
+
+class AuthCodeSweeper:
+    def __init__(self):
+        self._task = None
+        self.purged = 0
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+
+    async def sweep(self):
+        """One pass; returns (partitions created, partitions dropped, rows purged)."""
+        async with db.pool.acquire() as conn:
+            created = await AUTH_CODE_ENSURE_PARTITIONS.fetchval(conn, AUTH_CODE_PARTITION_DAYS_AHEAD)
+            dropped = await AUTH_CODE_DROP_PARTITIONS.fetchval(conn)
+        purged = 0
+        while True:
+            # A fresh connection per batch lets other work interleave
+            async with db.pool.acquire() as conn:
+                batch = await AUTH_CODE_PURGE.fetchval(conn, AUTH_CODE_PURGE_BATCH)
+            purged += batch
+            if batch < AUTH_CODE_PURGE_BATCH:
+                break
+        self.partitions_created += created
+        self.partitions_dropped += dropped
+        self.purged += purged
+        if created or dropped or purged:
+            logger.info(f"Auth code sweep: {created} partitions created, {dropped} dropped, {purged} codes purged")
+        return created, dropped, purged
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.error(f"Auth code sweep failed: {error}")
+            await asyncio.sleep(AUTH_CODE_SWEEP_SECONDS)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Auth code sweeper started.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Auth code sweeper stopped.")
+
+    def stats(self):
+        return {
+            "purged": self.purged,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+        }
+
+sweeper = AuthCodeSweeper()
@@ -0,0 +1,140 @@
+"""
+Signed session tokens issued by /auth/verify_code.
+
+A token is `<payload>.<signature>`, both base64url without padding. The
+payload is compact JSON carrying the user id, role name, expiry (epoch
+seconds) and a random token id; the signature is HMAC-SHA256 over the
+encoded payload with AUTH_TOKEN_SECRET. Verifying one needs no database
+round trip, so a role check costs a hash and a dict lookup.
+
+Tokens stay valid until they expire unless revoked. Revoked token ids are
+kept in memory until the token would have expired anyway, and revocations
+travel to the other workers over the cache NOTIFY channel. Changing a
+user's role takes effect at their next login; rotate AUTH_TOKEN_SECRET
+(keeping the old one in AUTH_TOKEN_PREVIOUS_SECRET for a while if
+sessions should survive) to invalidate every token at once.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import NamedTuple, Optional
+
+from app.app_logging import app_logger as logger
+
+AUTH_TOKEN_SECRET = os.getenv("AUTH_TOKEN_SECRET", "")
+# Still accepted for verification, so a secret can be rotated without logging everyone out
+AUTH_TOKEN_PREVIOUS_SECRET = os.getenv("AUTH_TOKEN_PREVIOUS_SECRET", "")
+AUTH_TOKEN_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_TTL_SECONDS", str(12 * 3600)))
+# Cache invalidation prefix under which revocations are published
+REVOKED_PREFIX = "session-revoked"
+
+if not AUTH_TOKEN_SECRET:
+    # Tokens then only verify on this worker and die with it
+    logger.warning("AUTH_TOKEN_SECRET is not set; using a random per-process secret.")
+    AUTH_TOKEN_SECRET = secrets.token_urlsafe(32)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class Session(NamedTuple):
+    user_id: Optional[int]
+    role: Optional[str]
+    expires_at: int
+    token_id: str
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str, secret: str) -> str:
+    return _b64encode(hmac.new(secret.encode(), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+class TokenRevocations:
+    """Token ids revoked before expiry, each kept until its token expires."""
+
+    def __init__(self):
+        self._expiries = {}
+        self.revoked = 0
+
+    def add(self, token_id: str, expires_at: int, now=None):
+        now = time.time() if now is None else now
+        if expires_at <= now:
+            return
+        self._prune(now)
+        if token_id not in self._expiries:
+            self.revoked += 1
+        self._expiries[token_id] = expires_at
+
+    def _prune(self, now):
+        for token_id in [token_id for token_id, expires_at in self._expiries.items() if expires_at <= now]:
+            del self._expiries[token_id]
+
+    def __contains__(self, token_id):
+        return token_id in self._expiries
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def key(self, session: Session) -> str:
+        """Cache invalidation key that revokes `session` on every worker."""
+        return f"{REVOKED_PREFIX}:{session.token_id}:{session.expires_at}"
+
+    def on_invalidate(self, suffix: str):
+        token_id, _, expires_at = suffix.rpartition(":")
+        try:
+            self.add(token_id, int(expires_at))
+        except ValueError:
+            logger.warning(f"Ignoring malformed token revocation {suffix!r}")
+
+    def clear(self):
+        self._expiries.clear()
+
+
+revocations = TokenRevocations()
+
+
+def issue_token(user_id: Optional[int], role: Optional[str], ttl_seconds: int = AUTH_TOKEN_TTL_SECONDS, now=None):
+    """Returns (token, Session)."""
+    now = time.time() if now is None else now
+    session = Session(user_id, role, int(now) + ttl_seconds, secrets.token_urlsafe(9))
+    claims = {"uid": session.user_id, "role": session.role, "exp": session.expires_at, "jti": session.token_id}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload, AUTH_TOKEN_SECRET)}", session
+
+
+def verify_token(token: str, now=None) -> Session:
+    """Check the signature, expiry and revocation list; raises InvalidToken."""
+    payload, _, signature = token.partition(".")
+    if not payload or not signature:
+        raise InvalidToken("Malformed token.")
+    try:
+        payload.encode("ascii")
+    except UnicodeEncodeError:
+        raise InvalidToken("Malformed token.")
+    if not any(
+        hmac.compare_digest(signature, _sign(payload, secret))
+        for secret in (AUTH_TOKEN_SECRET, AUTH_TOKEN_PREVIOUS_SECRET) if secret
+    ):
+        raise InvalidToken("Bad signature.")
+    try:
+        claims = json.loads(_b64decode(payload))
+        session = Session(claims["uid"], claims["role"], int(claims["exp"]), str(claims["jti"]))
+    except (ValueError, KeyError, TypeError):
+        raise InvalidToken("Malformed token.")
+    if session.expires_at <= (time.time() if now is None else now):
+        raise InvalidToken("Token expired.")
+    if session.token_id in revocations:
+        raise InvalidToken("Token revoked.")
+    return session
@@ -0,0 +1,166 @@
+"""
+Helpers for bulk endpoints that load JSON or CSV bodies through COPY.
+
+`parse_bulk_body` validates a fully buffered body and stops at the first bad
+row. `stream_bulk_records` reads CSV or NDJSON from the request stream as it
+arrives and yields validated records for `copy_records_to_table`, collecting
+per-row errors instead of failing.
+"""
+import codecs
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+
+
+class BulkBodyError(ValueError):
+    pass
+
+
+def _body_items(body: bytes, content_type: str):
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError as error:
+        raise BulkBodyError(f"Body is not valid UTF-8: {error}")
+    if content_type.startswith("text/csv"):
+        try:
+            return list(csv.DictReader(io.StringIO(text)))
+        except csv.Error as error:
+            raise BulkBodyError(f"Invalid CSV body: {error}")
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError as error:
+        raise BulkBodyError(f"Invalid JSON body: {error}")
+    if not isinstance(items, list):
+        raise BulkBodyError("Expected a JSON array of objects.")
+    return items
+
+
+def parse_bulk_body(body: bytes, content_type: str, model):
+    """Validate every item of a JSON array or CSV body against `model`.
+
+    Returns a list of tuples in `model` field order, ready for
+    `copy_records_to_table`. Raises BulkBodyError on the first bad row.
+    """
+    fields = list(model.model_fields)
+    records = []
+    for index, item in enumerate(_body_items(body, content_type), start=1):
+        try:
+            row = model.model_validate(item)
+        except ValidationError as error:
+            first = error.errors()[0]
+            location = ".".join(str(part) for part in first["loc"]) or "row"
+            raise BulkBodyError(f"Row {index}: {location}: {first['msg']}")
+        records.append(tuple(getattr(row, field) for field in fields))
+    return records
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+
+
+async def _lines(chunks):
+    """Decode a byte stream as UTF-8 and yield complete lines (without newlines)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError as error:
+            raise BulkBodyError(f"Body is not valid UTF-8: {error}")
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+
+async def _csv_items(lines):
+    # A record ends at a newline outside quotes; quotes inside fields are
+    # doubled, so an odd count means the record continues on the next line.
+    header = None
+    record = []
+    async for line in lines:
+        record.append(line)
+        text = "\n".join(record)
+        if text.count('"') % 2:
+            continue
+        record = []
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as error:
+            if header is None:
+                raise BulkBodyError(f"Invalid CSV header: {error}")
+            yield error
+            continue
+        if header is None:
+            header = values
+            continue
+        yield dict(zip(header, values)) if len(values) == len(header) else ValueError(
+            f"expected {len(header)} columns, got {len(values)}"
+        )
+    if record:
+        yield ValueError("unterminated quoted field")
+
+
+async def _ndjson_items(lines):
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            yield error
+
+
+class BulkImport:
+    """Per-row outcome of a streamed bulk body; only the first `max_errors` errors are kept."""
+
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.received = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, row, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "error": message})
+
+
+def stream_bulk_records(chunks, content_type: str, model, result: BulkImport):
+    """Return an async iterator of `(row, *fields)` tuples from a CSV or NDJSON byte stream.
+
+    `row` is the 1-based data row number, so merge errors can be reported
+    against the input. Rows that fail validation are recorded on `result`
+    and skipped. An unsupported content type raises BulkBodyError up front;
+    a body that is not UTF-8 raises it while iterating.
+    """
+    if content_type.startswith("text/csv"):
+        items = _csv_items(_lines(chunks))
+    elif content_type.startswith(NDJSON_CONTENT_TYPES):
+        items = _ndjson_items(_lines(chunks))
+    else:
+        raise BulkBodyError("Send text/csv or application/x-ndjson.")
+    return _validated(items, model, result)
+
+
+async def _validated(items, model, result):
+    fields = list(model.model_fields)
+    async for item in items:
+        result.received += 1
+        row = result.received
+        if isinstance(item, Exception):
+            result.reject(row, str(item))
+            continue
+        try:
+            validated = model.model_validate(item)
+        except ValidationError as error:
+            first = error.errors()[0]
+            location = ".".join(str(part) for part in first["loc"]) or "row"
+            result.reject(row, f"{location}: {first['msg']}")
+            continue
+        yield (row, *(getattr(validated, field) for field in fields))
@@ -0,0 +1,168 @@
+"""
+In-process read-through cache for curriculum, lesson and assignment lookups.
+
+Entries are bounded by count (LRU eviction) and by age. Writes invalidate by
+key prefix locally and publish the same prefixes on a Postgres NOTIFY channel
+so every uvicorn worker drops its copy too. Other modules can subscribe to a
+prefix to hear about invalidations under it, which lets them use the same
+channel for their own cross-worker signals.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import asyncpg
+
+from app.app_logging import app_logger as logger
+from app.db import DATABASE_URL
+from app.queries import CACHE_NOTIFY
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_NOTIFY_CHANNEL = os.getenv("CACHE_NOTIFY_CHANNEL", "lms_cache_invalidate")
+CACHE_LISTEN_RETRY_SECONDS = float(os.getenv("CACHE_LISTEN_RETRY_SECONDS", "5"))
+
+_MISSING = object()
+
+
+class ContentCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        # Bumped on every invalidation so a load that raced a write is not stored.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._listener_conn = None
+        self._listener_task = None
+        self._subscribers = []
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            self.misses += 1
+            return _MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        """Whether `key` holds a live entry; unlike get(), not counted as a hit or miss."""
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for `key`, loading it on a miss. A None key bypasses the cache."""
+        if key is None:
+            return await loader()
+        value = self.get(key)
+        if value is not _MISSING:
+            return value
+        generation = self._generation
+        value = await loader()
+        if value is not None and generation == self._generation:
+            self.set(key, value)
+        return value
+
+    def subscribe(self, prefix, callback):
+        """Call `callback(rest)` whenever `prefix:rest` is invalidated, locally or by another worker."""
+        self._subscribers.append((prefix + ":", callback))
+
+    def invalidate(self, *prefixes):
+        """Drop every entry whose key equals a prefix or starts with `prefix:`."""
+        for subscribed, callback in self._subscribers:
+            for prefix in prefixes:
+                if prefix.startswith(subscribed):
+                    callback(prefix[len(subscribed):])
+        self._generation += 1
+        for key in list(self._entries):
+            if any(key == prefix or key.startswith(prefix + ":") for prefix in prefixes):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    async def publish(self, conn, *prefixes):
+        """Invalidate locally, then tell the other workers over NOTIFY."""
+        self.invalidate(*prefixes)
+        await CACHE_NOTIFY.execute(conn, CACHE_NOTIFY_CHANNEL, ",".join(prefixes))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "listening": self._listener_conn is not None and not self._listener_conn.is_closed(),
+        }
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.invalidate(*payload.split(","))
+
+    def _on_listener_lost(self, conn):
+        # Notifications may have been missed while disconnected; start cold.
+        logger.warning("Cache invalidation listener lost its connection; clearing cache.")
+        self.clear()
+        self._listener_conn = None
+        self._listener_task = asyncio.ensure_future(self._listen_forever())
+
+    async def _listen_forever(self):
+        while True:
+            try:
+                conn = await asyncpg.connect(DATABASE_URL)
+                await conn.add_listener(CACHE_NOTIFY_CHANNEL, self._on_notify)
+                conn.add_termination_listener(self._on_listener_lost)
+                self._listener_conn = conn
+                # Entries cached before now may have missed invalidations
+                self.clear()
+                logger.info(f"Cache invalidation listener started on channel {CACHE_NOTIFY_CHANNEL}")
+                return
+            except Exception as error:
+                logger.error(f"Failed to start cache invalidation listener: {error}")
+                await asyncio.sleep(CACHE_LISTEN_RETRY_SECONDS)
+
+    async def start(self):
+        # In the background, so startup neither waits for nor fails on the
+        # listener; it retries every CACHE_LISTEN_RETRY_SECONDS until it connects.
+        self.clear()
+        self._listener_task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._listener_task and not self._listener_task.done():
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+        self._listener_task = None
+        if self._listener_conn:
+            conn, self._listener_conn = self._listener_conn, None
+            conn.remove_termination_listener(self._on_listener_lost)
+            await conn.close()
+            logger.info("Cache invalidation listener stopped.")
+        self.clear()
+
+cache = ContentCache()
@@ -0,0 +1,95 @@
+"""
+iCalendar (RFC 5545) feed of a cohort's events.
+
+Calendar clients poll feeds every few minutes, so the feed is built to make
+the unchanged case cheap: a one-row version query (EVENT_FEED_VERSION) gives
+the ETag, and a matching If-None-Match is answered with 304 before any event
+is read. A changed feed is reassembled from per-event VEVENT blocks cached by
+(id, updated_at), so only events edited since the last build are rendered.
+"""
+import datetime
+import os
+
+from app.cache import ContentCache
+from app.queries import EVENT_FEED_VERSION, EVENT_LIST_BY_COHORT
+
+ICS_UID_DOMAIN = os.getenv("ICS_UID_DOMAIN", "lms.local")
+ICS_EVENT_CACHE_SIZE = int(os.getenv("ICS_EVENT_CACHE_SIZE", "10000"))
+ICS_FEED_CACHE_SIZE = int(os.getenv("ICS_FEED_CACHE_SIZE", "256"))
+# Entries are keyed by content version, so they never go stale; age only frees memory.
+ICS_CACHE_TTL_SECONDS = float(os.getenv("ICS_CACHE_TTL_SECONDS", "86400"))
+
+vevent_cache = ContentCache(max_entries=ICS_EVENT_CACHE_SIZE, ttl_seconds=ICS_CACHE_TTL_SECONDS)
+feed_cache = ContentCache(max_entries=ICS_FEED_CACHE_SIZE, ttl_seconds=ICS_CACHE_TTL_SECONDS)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line):
+    """Split a content line into 75-octet pieces without breaking a UTF-8 sequence."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    pieces = []
+    start, limit = 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        pieces.append(encoded[start:end].decode())
+        start, limit = end, 74  # continuation lines start with a space
+    return "\r\n ".join(pieces)
+
+
+def _utc(value: datetime.datetime):
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_vevent(event):
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:event-{event['id']}@{ICS_UID_DOMAIN}",
+        f"DTSTAMP:{_utc(event['updated_at'])}",
+        f"LAST-MODIFIED:{_utc(event['updated_at'])}",
+        f"DTSTART:{_utc(event['start_time'])}",
+        f"DTEND:{_utc(event['end_time'])}",
+        f"SUMMARY:{_escape(event['title'])}",
+    ]
+    if event["description"]:
+        lines.append(f"DESCRIPTION:{_escape(event['description'])}")
+    if event["location"]:
+        lines.append(f"LOCATION:{_escape(event['location'])}")
+    if event["event_type"]:
+        lines.append(f"CATEGORIES:{_escape(event['event_type'])}")
+    lines.append("END:VEVENT")
+    return "".join(_fold(line) + "\r\n" for line in lines)
+
+
+async def feed_version(conn, cohort_id: int):
+    """(ETag, cohort name) for the cohort's feed, or None if the cohort does not exist."""
+    row = await EVENT_FEED_VERSION.fetchrow(conn, cohort_id)
+    if row is None:
+        return None
+    return f'"ics-{cohort_id}-{row["version"]}"', row["name"]
+
+
+async def build_feed(conn, cohort_id: int, etag: str, name: str) -> bytes:
+    """The feed body for `etag`, rebuilt from cached VEVENTs if this version has not been seen."""
+    async def load():
+        events = await EVENT_LIST_BY_COHORT.fetch(conn, cohort_id, datetime.datetime.min, datetime.datetime.max)
+        parts = [
+            "BEGIN:VCALENDAR\r\n",
+            "VERSION:2.0\r\n",
+            "PRODID:-//LMS Backend//Cohort Calendar//EN\r\n",
+            "CALSCALE:GREGORIAN\r\n",
+            _fold(f"X-WR-CALNAME:{_escape(name)}") + "\r\n",
+        ]
+        for event in events:
+            async def render(event=event):
+                return render_vevent(event.model_dump())
+            parts.append(await vevent_cache.get_or_load(f"{event.id}:{event.updated_at.isoformat()}", render))
+        parts.append("END:VCALENDAR\r\n")
+        return "".join(parts).encode()
+    return await feed_cache.get_or_load(f"{cohort_id}:{etag}", load)
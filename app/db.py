@@ -1,29 +1,340 @@
+"""
+Connection pools: one against the primary and, optionally, one per read replica.
+
+Writes and anything that must see them use `db.pool`. Read-only handlers use
+`db.read()`, which picks a healthy replica round-robin and falls back to the
+primary when none is healthy, when acquiring from the chosen replica fails, or
+when the request is pinned to the primary (see `pin_primary`) because its
+session wrote recently. A background task checks every replica's health and
+replication lag.
+"""
+import asyncio
+import contextvars
+import itertools
 import asyncpg
 import os
+import time
 from app.app_logging import app_logger as logger
+from app.metrics import Histogram, record_acquire
+from app.queries import REPLICA_LAG, registry
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres@localhost/lms")
+# Comma-separated read replica URLs; empty sends every read to the primary.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Behind pgbouncer in transaction mode, server-side prepared statements break;
+# turn off asyncpg's statement cache.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+# asyncpg's default of 100 cached statements per connection; never fewer than
+# the registry holds, so named queries are not evicted by each other.
+DB_STATEMENT_CACHE_SIZE = max(int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")), len(registry.queries) * 2)
+# Prepare the registry's hot statements when a connection opens, so the first
+# requests on a new or replaced connection skip parse and plan.
+DB_PREPARE_HOT = os.getenv("DB_PREPARE_HOT", "true").lower() == "true"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "10"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Seconds a request waits for a free connection before getting a 503.
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+# Idle connections are closed after this many seconds; 0 keeps them forever.
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+# Connections are replaced after serving this many queries.
+DB_MAX_QUERIES = int(os.getenv("DB_MAX_QUERIES", "50000"))
+# Client-side timeout per query in seconds; unset means none.
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT")) if os.getenv("DB_COMMAND_TIMEOUT") else None
+# Server-side statement_timeout in milliseconds; 0 disables it.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "lms-backend")
+# Optional SQL run once on every new connection, e.g. "SET work_mem = '16MB'".
+DB_SESSION_SETUP = os.getenv("DB_SESSION_SETUP")
+DB_REPLICA_POOL_MIN_SIZE = int(os.getenv("DB_REPLICA_POOL_MIN_SIZE", str(DB_POOL_MIN_SIZE)))
+DB_REPLICA_POOL_MAX_SIZE = int(os.getenv("DB_REPLICA_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+# A busy replica should fail over quickly rather than hold the request.
+DB_REPLICA_ACQUIRE_TIMEOUT = float(os.getenv("DB_REPLICA_ACQUIRE_TIMEOUT", "1"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
+# Replicas further behind than this are skipped until they catch up.
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "10"))
+# After a write, the session reads from the primary for this long, so it
+# never sees a replica that has not replayed its write yet.
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", str(DB_REPLICA_MAX_LAG_SECONDS)))
+
+# True while serving a request that must read from the primary
+pin_primary = contextvars.ContextVar("pin_primary", default=False)
+
+
+class PoolAcquireTimeout(Exception):
+    """No pool connection became free within the acquire timeout."""
+
+
+class _PoolAcquire:
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire(self.timeout)
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        conn, self.conn = self.conn, None
+        await self.pool.release(conn)
+
+    def __await__(self):
+        return self.pool._acquire(self.timeout).__await__()
+
+
+class InstrumentedPool:
+    """Wraps an asyncpg pool to bound and measure the wait for a connection."""
+
+    def __init__(self, pool, acquire_timeout=DB_ACQUIRE_TIMEOUT):
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.wait_times = Histogram()
+        self.acquires = 0
+        self.timeouts = 0
+        self.waiting = 0
+
+    def acquire(self, timeout=None):
+        return _PoolAcquire(self, timeout if timeout is not None else self.acquire_timeout)
+
+    async def _acquire(self, timeout):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self._pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Timed out after {timeout}s waiting for a database connection")
+            raise PoolAcquireTimeout(f"No database connection available within {timeout}s") from None
+        finally:
+            self.waiting -= 1
+            waited = time.perf_counter() - started
+            self.wait_times.observe(waited)
+            record_acquire(waited)
+        self.acquires += 1
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+async def _session_setup(conn):
+    if DB_SESSION_SETUP:
+        await conn.execute(DB_SESSION_SETUP)
+    if DB_PREPARE_HOT and not DB_PGBOUNCER:
+        await registry.prepare_hot(conn)
+
+
+class _ReadAcquire:
+    def __init__(self, database):
+        self.database = database
+        self.pool = None
+        self.conn = None
+
+    async def __aenter__(self):
+        replica = self.database._pick_replica()
+        if replica is not None:
+            try:
+                self.conn = await replica.pool._acquire(DB_REPLICA_ACQUIRE_TIMEOUT)
+                self.pool = replica.pool
+                return self.conn
+            except (PoolAcquireTimeout, OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as error:
+                replica.mark_down(error)
+                replica.failovers += 1
+        self.conn = await self.database.pool._acquire(self.database.pool.acquire_timeout)
+        self.pool = self.database.pool
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        conn, self.conn = self.conn, None
+        await self.pool.release(conn)
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.pool = None
+        self.healthy = False
+        self.lag_seconds = None
+        self.failovers = 0
+        self.last_error = None
+
+    @property
+    def host(self):
+        # For logs and stats; never the credentials
+        return self.url.rpartition("@")[2]
+
+    async def connect(self, database):
+        try:
+            pool = await asyncpg.create_pool(
+                self.url,
+                min_size=DB_REPLICA_POOL_MIN_SIZE,
+                max_size=DB_REPLICA_POOL_MAX_SIZE,
+                max_queries=DB_MAX_QUERIES,
+                max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                statement_cache_size=0 if DB_PGBOUNCER else DB_STATEMENT_CACHE_SIZE,
+                server_settings=database._server_settings(),
+                init=_session_setup,
+            )
+        except (OSError, asyncpg.PostgresError) as error:
+            self.mark_down(error)
+            return
+        self.pool = InstrumentedPool(pool, acquire_timeout=DB_REPLICA_ACQUIRE_TIMEOUT)
+        await self.check()
+
+    async def check(self):
+        if self.pool is None:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                lag = await REPLICA_LAG.fetchval(conn)
+        except (PoolAcquireTimeout, OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as error:
+            self.mark_down(error)
+            return
+        self.lag_seconds = lag
+        healthy = lag <= DB_REPLICA_MAX_LAG_SECONDS
+        if healthy and not self.healthy:
+            logger.info(f"Replica {self.host} is serving reads (lag {lag:.1f}s)")
+        elif not healthy and self.healthy:
+            logger.warning(f"Replica {self.host} is {lag:.1f}s behind; sending its reads to the primary")
+        self.healthy = healthy
+        self.last_error = None if healthy else f"lag {lag:.1f}s"
+
+    def mark_down(self, error):
+        if self.healthy:
+            logger.warning(f"Replica {self.host} marked down: {error}")
+        self.healthy = False
+        self.last_error = str(error)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        self.healthy = False
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "failovers": self.failovers,
+            "last_error": self.last_error,
+            "size": self.pool.get_size() if self.pool else 0,
+            "idle": self.pool.get_idle_size() if self.pool else 0,
+            "acquires": self.pool.acquires if self.pool else 0,
+        }
+
 
 class Database:
-    def __init__(self):
+    def __init__(self, replica_urls=DATABASE_REPLICA_URLS):
         self.pool = None
+        self.connections_opened = 0
+        self._connections_at_start = 0
+        self.replica_urls = list(replica_urls)
+        self.replicas = []
+        self._next_replica = itertools.count()
+        self._health_task = None
+
+    async def _init_connection(self, conn):
+        self.connections_opened += 1
+        await _session_setup(conn)
+
+    def _server_settings(self):
+        server_settings = {"application_name": DB_APPLICATION_NAME}
+        if DB_STATEMENT_TIMEOUT_MS:
+            server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+        return server_settings
 
     async def connect(self):
         try:
-            self.pool = await asyncpg.create_pool(DATABASE_URL)
-            logger.info("Database connection pool created.")
+            statement_cache_size = 0 if DB_PGBOUNCER else DB_STATEMENT_CACHE_SIZE
+            server_settings = self._server_settings()
+            self.connections_opened = 0
+            pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                max_queries=DB_MAX_QUERIES,
+                max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                statement_cache_size=statement_cache_size,
+                server_settings=server_settings,
+                init=self._init_connection,
+            )
+            self._connections_at_start = self.connections_opened
+            self.pool = InstrumentedPool(pool)
+            logger.info(f"Database connection pool created ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections).")
         except Exception as error:
             logger.error(f"Failed to create database pool: {error}")
             raise
+        # An unreachable replica is not fatal; reads go to the primary until it recovers
+        self.replicas = [Replica(url) for url in self.replica_urls]
+        for replica in self.replicas:
+            await replica.connect(self)
+        if self.replicas:
+            self._health_task = asyncio.ensure_future(self._check_replicas_forever())
+            logger.info(f"{sum(r.healthy for r in self.replicas)} of {len(self.replicas)} read replicas healthy.")
+
+    async def _check_replicas_forever(self):
+        while True:
+            await asyncio.sleep(DB_REPLICA_CHECK_SECONDS)
+            for replica in self.replicas:
+                if replica.pool is None:
+                    await replica.connect(self)
+                else:
+                    await replica.check()
 
     async def disconnect(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self.replicas:
+            await replica.close()
+        self.replicas = []
         if self.pool:
             await self.pool.close()
             logger.info("Database connection pool closed.")
 
+    def _pick_replica(self):
+        if pin_primary.get():
+            return None
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next_replica) % len(healthy)]
+
+    def read(self):
+        """Acquire a connection for read-only work: a healthy replica, else the primary."""
+        if not self.pool:
+            raise RuntimeError("Database pool is not initialized.")
+        return _ReadAcquire(self)
+
     async def get_conn(self):
         if not self.pool:
             raise RuntimeError("Database pool is not initialized.")
         return await self.pool.acquire()
 
-db = Database() 
\ No newline at end of file
+    def stats(self):
+        if not self.pool:
+            return {"connected": False}
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            "connected": True,
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiting": self.pool.waiting,
+            "acquires": self.pool.acquires,
+            "acquire_timeouts": self.pool.timeouts,
+            "acquire_wait": self.pool.wait_times.snapshot(),
+            "connections_opened": self.connections_opened,
+            # Connections opened after startup to replace expired or broken ones
+            # (or to grow from min_size towards max_size).
+            "reconnects": self.connections_opened - self._connections_at_start,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+db = Database()
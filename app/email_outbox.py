@@ -0,0 +1,217 @@
+"""
+Durable outbound email queue.
+
+Handlers only insert into the `email_outbox` table. A background dispatcher
+leases pending rows in batches (FOR UPDATE SKIP LOCKED, so several workers can
+share the table), hands them to the configured transport off the event loop,
+and reschedules failures with exponential backoff. A row's body is cleared
+once it is sent or given up on, so login codes do not outlive delivery.
+"""
+import asyncio
+import os
+import random
+import smtplib
+from email.message import EmailMessage
+
+from app.app_logging import app_logger as logger
+from app.db import db
+from app.queries import (
+    EMAIL_OUTBOX_INSERT,
+    EMAIL_OUTBOX_LEASE,
+    EMAIL_OUTBOX_MARK_FAILED,
+    EMAIL_OUTBOX_MARK_SENT,
+)
+
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT")  # 'sendgrid', 'smtp', 'fake' or 'log'
+EMAIL_FROM = os.getenv("EMAIL_FROM") or os.getenv("SENDGRID_FROM_EMAIL")
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "2"))
+EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", "60"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "5"))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv("EMAIL_RETRY_MAX_SECONDS", "3600"))
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+
+
+class EmailTransport:
+    """Sends a batch of outbox rows; returns one error string (or None) per row."""
+
+    async def send_batch(self, messages):
+        results = await asyncio.gather(*(self.send(message) for message in messages), return_exceptions=True)
+        return [str(result) if isinstance(result, Exception) else None for result in results]
+
+    async def send(self, message):
+        raise NotImplementedError
+
+
+class SendGridTransport(EmailTransport):
+    def __init__(self, api_key, from_email):
+        from sendgrid import SendGridAPIClient
+        self.client = SendGridAPIClient(api_key)
+        self.from_email = from_email
+
+    async def send(self, message):
+        from sendgrid.helpers.mail import Mail
+        mail = Mail(
+            from_email=self.from_email,
+            to_emails=message["to_email"],
+            subject=message["subject"],
+            html_content=message["html_content"]
+        )
+        # The SendGrid client is synchronous; keep it off the event loop.
+        await asyncio.to_thread(self.client.send, mail)
+
+
+class SMTPTransport(EmailTransport):
+    """Plain SMTP, e.g. a local MailHog/Mailpit sink on port 1025."""
+
+    def __init__(self, host, port, from_email, username=None, password=None, starttls=False):
+        self.host = host
+        self.port = port
+        self.from_email = from_email
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def _send_all(self, messages):
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                email = EmailMessage()
+                email["From"] = self.from_email
+                email["To"] = message["to_email"]
+                email["Subject"] = message["subject"]
+                email.set_content(message["html_content"], subtype="html")
+                try:
+                    smtp.send_message(email)
+                    errors.append(None)
+                except smtplib.SMTPException as error:
+                    errors.append(str(error))
+        return errors
+
+    async def send_batch(self, messages):
+        # One SMTP session per batch, run on the default thread pool.
+        return await asyncio.to_thread(self._send_all, messages)
+
+
+class FakeTransport(EmailTransport):
+    """Keeps messages in memory; set `fail_next` to simulate provider errors."""
+
+    def __init__(self):
+        self.sent = []
+        self.fail_next = 0
+
+    async def send(self, message):
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            raise RuntimeError("Simulated transport failure")
+        self.sent.append(dict(message))
+
+
+class LogTransport(EmailTransport):
+    async def send(self, message):
+        logger.warning(f"Email transport not configured; email to {message['to_email']} not sent.")
+
+
+def build_transport(name=EMAIL_TRANSPORT):
+    sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
+    if name is None:
+        name = "sendgrid" if sendgrid_api_key and EMAIL_FROM else "log"
+    if name == "sendgrid":
+        return SendGridTransport(sendgrid_api_key, EMAIL_FROM)
+    if name == "smtp":
+        return SMTPTransport(SMTP_HOST, SMTP_PORT, EMAIL_FROM, SMTP_USERNAME, SMTP_PASSWORD, SMTP_STARTTLS)
+    if name == "fake":
+        return FakeTransport()
+    if name == "log":
+        return LogTransport()
+    raise ValueError(f"Unknown EMAIL_TRANSPORT: {name}")
+
+
+def retry_delay(attempts):
+    delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class EmailOutbox:
+    def __init__(self, transport=None):
+        self.transport = transport or build_transport()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def enqueue(self, conn, to_email, subject, html_content):
+        """Insert a message on `conn`; call wake() once the transaction has committed."""
+        await EMAIL_OUTBOX_INSERT.execute(conn, to_email, subject, html_content)
+
+    def wake(self):
+        """Start a dispatch now instead of at the next poll."""
+        self._wake.set()
+
+    async def dispatch_batch(self):
+        """Lease, send and settle one batch. Returns the number of rows leased."""
+        async with db.pool.acquire() as conn:
+            messages = await EMAIL_OUTBOX_LEASE.fetch(conn, EMAIL_BATCH_SIZE, EMAIL_LEASE_SECONDS)
+        if not messages:
+            return 0
+        try:
+            errors = await self.transport.send_batch(messages)
+        except Exception as error:
+            errors = [str(error)] * len(messages)
+        sent = [message["id"] for message, error in zip(messages, errors) if error is None]
+        failed = [
+            (message["id"], error, retry_delay(message["attempts"]), message["attempts"] >= EMAIL_MAX_ATTEMPTS)
+            for message, error in zip(messages, errors) if error is not None
+        ]
+        async with db.pool.acquire() as conn:
+            if sent:
+                await EMAIL_OUTBOX_MARK_SENT.execute(conn, sent)
+            if failed:
+                await EMAIL_OUTBOX_MARK_FAILED.executemany(conn, failed)
+        logger.info(f"Email batch dispatched: {len(sent)} sent, {len(failed)} failed")
+        for message_id, error, _, gave_up in failed:
+            if gave_up:
+                logger.error(f"Giving up on email {message_id}: {error}")
+            else:
+                logger.warning(f"Email {message_id} failed, will retry: {error}")
+        return len(messages)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                leased = await self.dispatch_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.error(f"Email dispatcher error: {error}")
+                leased = 0
+            if leased < EMAIL_BATCH_SIZE:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Email dispatcher started with {type(self.transport).__name__}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Email dispatcher stopped.")
+
+outbox = EmailOutbox()
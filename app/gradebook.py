@@ -0,0 +1,55 @@
+"""
+Streamed cohort gradebook export.
+
+The assignment columns are read first, then one row per enrolled student is
+read from a server-side cursor, both inside one read-only repeatable-read
+transaction so they describe the same snapshot. Rows are written out in
+batches of STREAM_PREFETCH, so memory does not grow with the cohort.
+"""
+import csv
+import io
+import json
+
+from app.pagination import STREAM_PREFETCH, connection_stream
+from app.queries import GRADEBOOK_ASSIGNMENTS, GRADEBOOK_ROWS
+
+GRADEBOOK_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def _ndjson_line(row, assignments):
+    scores = {str(assignment["id"]): score for assignment, score in zip(assignments, row["scores"])}
+    return json.dumps({"user_id": row["user_id"], "email": row["email"], "full_name": row["full_name"], "scores": scores}) + "\n"
+
+
+async def stream_gradebook(cohort_id: int, fmt: str = "csv"):
+    """Stream a cohort's gradebook as CSV (one column per assignment) or NDJSON.
+
+    Scores are the latest grade for the student's submission; a blank CSV
+    cell or a null NDJSON score means no graded submission.
+    """
+    async def body(conn):
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            assignments = await GRADEBOOK_ASSIGNMENTS.fetch(conn, cohort_id)
+            if fmt == "csv":
+                yield _csv_line(["user_id", "email", "full_name"] + [a["title"] for a in assignments]).encode()
+            chunk = []
+            async for row in GRADEBOOK_ROWS.cursor(conn, cohort_id, prefetch=STREAM_PREFETCH):
+                if fmt == "csv":
+                    scores = ["" if score is None else score for score in row["scores"]]
+                    chunk.append(_csv_line([row["user_id"], row["email"], row["full_name"]] + scores))
+                else:
+                    chunk.append(_ndjson_line(row, assignments))
+                if len(chunk) >= STREAM_PREFETCH:
+                    yield "".join(chunk).encode()
+                    chunk = []
+            if chunk:
+                yield "".join(chunk).encode()
+
+    headers = {"Content-Disposition": f'attachment; filename="cohort-{cohort_id}-gradebook.{fmt}"'}
+    return await connection_stream(body, media_type=GRADEBOOK_FORMATS[fmt], headers=headers)
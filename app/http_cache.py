@@ -0,0 +1,128 @@
+"""
+Conditional GET helpers: ETag and Last-Modified validators and 304 replies.
+
+Timestamps from the database are naive and taken to be UTC. Rows with an
+`updated_at` column get a weak ETag from their id and `updated_at`; a list of
+such rows gets one from an md5 over every row's pair, which the `*_version`
+queries compute the same way in SQL (see queries.VERSION_HASH), so a poll
+can be answered with 304 before any row is read.
+"""
+import datetime
+import email.utils
+import hashlib
+
+from fastapi import Request, Response
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _micros(value: datetime.datetime) -> int:
+    if value is None:
+        return 0
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def row_etag(row_id: int, updated_at: datetime.datetime) -> str:
+    return f'W/"{row_id}-{_micros(updated_at)}"'
+
+
+def version_etag(version: str) -> str:
+    """ETag for an md5 list version computed in SQL."""
+    return f'W/"{version}"'
+
+
+def rows_etag(rows) -> str:
+    """The ETag `version_etag` gives for the same rows' SQL version."""
+    ordered = sorted(rows, key=lambda row: row.id)
+    digest = hashlib.md5(",".join(f"{row.id}@{_micros(row.updated_at)}" for row in ordered).encode())
+    return version_etag(digest.hexdigest())
+
+
+def has_validators(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def http_date(value: datetime.datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return email.utils.format_datetime(value.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def _parse_http_date(value):
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def not_modified(request: Request, etag: str, last_modified=None) -> bool:
+    """True when the client's validators still match; If-None-Match wins over If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as GET allows
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        since = _parse_http_date(if_modified_since)
+        if since is None:
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validator_headers(etag: str, last_modified=None, cache_control="no-cache") -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag: str, last_modified=None, cache_control="no-cache") -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified, cache_control))
+
+
+def conditional_response(request: Request, body: bytes, etag=None, last_modified=None,
+                         media_type="application/json", cache_control="no-cache"):
+    """`body` with validators attached, or an empty 304 when the client's copy is current."""
+    etag = etag or etag_for(body)
+    if not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified, cache_control)
+    return Response(content=body, media_type=media_type, headers=validator_headers(etag, last_modified, cache_control))
+
+
+def preferred_encoding(request: Request, available=("br", "gzip")) -> str:
+    """The first of `available` the client accepts with a nonzero q, else "identity"."""
+    accepted = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for coding in available:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
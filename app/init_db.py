@@ -1,6 +1,7 @@
 import asyncio
 from app.db import db
 from app.models import USER_TABLE_DDL  # Includes curriculum, lessons, and assignments tables
+from app.migrate import migrate
 from app.app_logging import app_logger as logger
 
 async def init_db():
@@ -9,10 +10,12 @@ async def init_db():
         try:
             await conn.execute(USER_TABLE_DDL)
             logger.info("Database schema initialized.")
+            applied = await migrate(conn)
+            logger.info(f"Applied migrations: {applied}" if applied else "No pending migrations.")
         except Exception as error:
             logger.error(f"Failed to initialize schema: {error}")
             raise
     await db.disconnect()
 
 if __name__ == "__main__":
-    asyncio.run(init_db()) 
\ No newline at end of file
+    asyncio.run(init_db())
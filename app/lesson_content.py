@@ -0,0 +1,186 @@
+"""
+Rendered lesson content (migration 0007).
+
+When a lesson is written, its markdown is rendered to sanitized HTML and
+compressed with gzip and brotli in a process pool of LESSON_RENDER_WORKERS
+processes, keeping that CPU work off the event loop. The result is stored
+once per content hash in `lesson_renders`; a write whose markdown already
+has a render reuses it without rendering. With LESSON_RENDER_WORKERS=0,
+rendering runs in the default thread pool instead.
+
+In the background the renderer renders lessons that have no render by the
+current RENDERER_VERSION (rows written before the migration, or after a
+renderer change), and every LESSON_RENDER_PRUNE_SECONDS deletes renders
+that no lesson uses any more. An advisory lock keeps that backfill to one
+process at a time, and a lesson's updated_at only moves if its HTML did.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app.app_logging import app_logger as logger
+from app.cache import cache
+from app.db import db
+from app.markdown_render import RENDERER_VERSION, content_hash, render
+from app.queries import (
+    LESSON_RENDER_ATTACH,
+    LESSON_RENDER_BACKFILL_LOCK,
+    LESSON_RENDER_BACKFILL_UNLOCK,
+    LESSON_RENDER_HTML,
+    LESSON_RENDER_HTML_MANY,
+    LESSON_RENDER_INSERT,
+    LESSON_RENDER_PENDING,
+    LESSON_RENDER_PRUNE,
+)
+
+LESSON_RENDER_WORKERS = int(os.getenv("LESSON_RENDER_WORKERS", str(min(2, os.cpu_count() or 1))))
+LESSON_RENDER_BACKFILL_BATCH = int(os.getenv("LESSON_RENDER_BACKFILL_BATCH", "50"))
+LESSON_RENDER_PRUNE_SECONDS = float(os.getenv("LESSON_RENDER_PRUNE_SECONDS", "3600"))
+# Unreferenced renders younger than this are kept; see LESSON_RENDER_PRUNE
+LESSON_RENDER_GRACE_SECONDS = float(os.getenv("LESSON_RENDER_GRACE_SECONDS", "3600"))
+
+
+class LessonRenderer:
+    def __init__(self, workers=LESSON_RENDER_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._task = None
+        self.rendered = 0
+        self.reused = 0
+        self.backfilled = 0
+        self.pruned = 0
+
+    async def _render(self, markdown):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render, markdown)
+
+    async def prepare(self, markdown):
+        """(content_hash, html) for a lesson write, rendering only if this content has no render yet."""
+        if markdown is None:
+            return None, None
+        digest = content_hash(markdown)
+        async with db.pool.acquire() as conn:
+            html = await LESSON_RENDER_HTML.fetchval(conn, digest)
+        if html is not None:
+            self.reused += 1
+            return digest, html
+        # No connection is held while rendering
+        html, html_gzip, html_br = await self._render(markdown)
+        async with db.pool.acquire() as conn:
+            await LESSON_RENDER_INSERT.execute(conn, digest, RENDERER_VERSION, html, html_gzip, html_br)
+        self.rendered += 1
+        return digest, html
+
+    async def prepare_many(self, markdowns):
+        """`prepare` for a batch: one lookup, distinct new contents rendered concurrently, one insert."""
+        digests = [content_hash(markdown) if markdown is not None else None for markdown in markdowns]
+        wanted = {digest: markdown for digest, markdown in zip(digests, markdowns) if digest is not None}
+        async with db.pool.acquire() as conn:
+            known = {row["content_hash"]: row["html"] for row in await LESSON_RENDER_HTML_MANY.fetch(conn, list(wanted))}
+        missing = [digest for digest in wanted if digest not in known]
+        if missing:
+            outputs = await asyncio.gather(*(self._render(wanted[digest]) for digest in missing))
+            async with db.pool.acquire() as conn:
+                await LESSON_RENDER_INSERT.executemany(
+                    conn, [(digest, RENDERER_VERSION, *output) for digest, output in zip(missing, outputs)]
+                )
+            known.update((digest, output[0]) for digest, output in zip(missing, outputs))
+        self.rendered += len(missing)
+        self.reused += sum(1 for digest in digests if digest is not None) - len(missing)
+        return [(digest, known[digest]) if digest is not None else (None, None) for digest in digests]
+
+    async def backfill(self):
+        """Render every lesson without a current render; returns how many lessons were updated.
+
+        Returns 0 at once if another process is already backfilling.
+        """
+        async with db.pool.acquire() as conn:
+            if not await LESSON_RENDER_BACKFILL_LOCK.fetchval(conn):
+                logger.info("Lesson render backfill is running in another process; skipping.")
+                return 0
+            try:
+                return await self._backfill()
+            finally:
+                await LESSON_RENDER_BACKFILL_UNLOCK.fetchval(conn)
+
+    async def _backfill(self):
+        updated = 0
+        after = 0
+        while True:
+            async with db.pool.acquire() as conn:
+                rows = await LESSON_RENDER_PENDING.fetch(conn, RENDERER_VERSION, after, LESSON_RENDER_BACKFILL_BATCH)
+            for row in rows:
+                digest, html = await self.prepare(row["content_markdown"])
+                async with db.pool.acquire() as conn:
+                    if await LESSON_RENDER_ATTACH.execute(conn, row["id"], digest, html, row["content_markdown"]) != "UPDATE 0":
+                        updated += 1
+            if rows:
+                after = rows[-1]["id"]
+            if len(rows) < LESSON_RENDER_BACKFILL_BATCH:
+                break
+        if updated:
+            async with db.pool.acquire() as conn:
+                await cache.publish(conn, "lessons", "tree")
+            logger.info(f"Lesson render backfill: {updated} lessons rendered")
+        self.backfilled += updated
+        return updated
+
+    async def prune(self):
+        async with db.pool.acquire() as conn:
+            result = await LESSON_RENDER_PRUNE.execute(conn, LESSON_RENDER_GRACE_SECONDS)
+        pruned = int(result.split()[-1])
+        self.pruned += pruned
+        if pruned:
+            logger.info(f"Lesson render prune: {pruned} unused renders deleted")
+        return pruned
+
+    async def _run(self):
+        try:
+            await self.backfill()
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.error(f"Lesson render backfill failed: {error}")
+        while True:
+            await asyncio.sleep(LESSON_RENDER_PRUNE_SECONDS)
+            try:
+                await self.prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.error(f"Lesson render prune failed: {error}")
+
+    async def start(self, background=True):
+        """Start the worker pool and, with `background`, the backfill and prune task."""
+        if self.workers > 0:
+            # spawn, not fork: the app has threads (log writer, pool) that a fork would copy mid-state
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        if background:
+            self._task = asyncio.create_task(self._run())
+        logger.info(f"Lesson renderer started with {self.workers} worker processes.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor:
+            # Joining the worker processes blocks, so do it off the event loop
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+        logger.info("Lesson renderer stopped.")
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "rendered": self.rendered,
+            "reused": self.reused,
+            "backfilled": self.backfilled,
+            "pruned": self.pruned,
+        }
+
+renderer = LessonRenderer()
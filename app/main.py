@@ -1,71 +1,283 @@
-from fastapi import FastAPI, Request, HTTPException, status, Depends
-from pydantic import BaseModel, EmailStr
-import random, string, datetime
-from app.app_logging import app_logger as logger
-from app.db import db
+from fastapi import FastAPI, Request, Response, HTTPException, status, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+import random, string, datetime, html, math, time, uuid
+from app.app_logging import app_logger as logger, queue_sink, request_logging
+from app.db import db, pin_primary, PoolAcquireTimeout, DB_READ_YOUR_WRITES_SECONDS
+from app.cache import cache
+from app.pagination import MAX_PAGE_SIZE, PageParams, json_response, stream_json
+from app.rate_limit import TokenBucketLimiter
+from app.bulk import BulkBodyError, BulkImport, parse_bulk_body, stream_bulk_records
+from app.auth_codes import sweeper
+from app.auth_tokens import REVOKED_PREFIX, InvalidToken, issue_token, revocations, verify_token
+from app.email_outbox import outbox
+from app.calendar_feed import build_feed, feed_version
+from app.gradebook import stream_gradebook
+from app.lesson_content import renderer
+from app.vault_sync import VAULT_DIR, sync_vault
+from app.http_cache import (
+    conditional_response,
+    etag_for,
+    has_validators,
+    not_modified,
+    not_modified_response,
+    preferred_encoding,
+    row_etag,
+    rows_etag,
+    validator_headers,
+    version_etag,
+)
+from app.metrics import PrometheusText, RequestTiming, current_request, route_metrics
+from app.queries import (
+    registry,
+    ASSIGNMENT_DELETE,
+    ASSIGNMENT_GET,
+    ASSIGNMENT_INSERT,
+    ASSIGNMENT_LIST,
+    ASSIGNMENT_LIST_JSON,
+    ASSIGNMENT_LIST_VERSION,
+    ASSIGNMENT_UPDATE,
+    ASSIGNMENT_UPDATED_AT,
+    AUTH_CODE_INSERT,
+    AUTH_CODE_MARK_USED,
+    AUTH_CODE_VERIFY,
+    COHORT_DELETE,
+    COHORT_GET,
+    COHORT_INSERT,
+    COHORT_LIST,
+    COHORT_LIST_JSON,
+    COHORT_UPDATE,
+    CURRICULUM_DELETE,
+    CURRICULUM_GET,
+    CURRICULUM_INSERT,
+    CURRICULUM_LIST,
+    CURRICULUM_LIST_JSON,
+    CURRICULUM_LIST_VERSION,
+    CURRICULUM_TREE,
+    CURRICULUM_UPDATE,
+    CURRICULUM_UPDATED_AT,
+    ENROLLMENT_DELETE,
+    ENROLLMENT_INSERT,
+    ENROLLMENT_LIST_BY_COHORT,
+    ENROLLMENT_LIST_BY_COHORT_JSON,
+    ENROLLMENT_STAGING_CREATE,
+    ENROLLMENT_STAGING_MERGE,
+    EVENT_DELETE,
+    EVENT_INSERT,
+    EVENT_LIST_BY_COHORT,
+    EVENT_LIST_BY_COHORT_VERSION,
+    EVENT_UPDATE,
+    GRADED_SUBMISSIONS_BY_GRADER,
+    GRADE_LIST_BY_SUBMISSION,
+    GRADE_LOCK_SUBMISSION,
+    GRADE_STAGING_CREATE,
+    GRADE_STAGING_DISCARD,
+    GRADE_STAGING_LOCK,
+    GRADE_STAGING_MERGE,
+    GRADE_STAGING_REJECTED,
+    GRADE_INSERT_IF_UNGRADED,
+    GRADE_UPSERT,
+    GRADING_CLAIM,
+    GRADING_CLAIM_CONSUME,
+    GRADING_CLAIM_RELEASE,
+    GRADING_QUEUE,
+    LESSON_DELETE,
+    LESSON_GET,
+    LESSON_INSERT,
+    LESSON_LIST,
+    LESSON_LIST_JSON,
+    LESSON_CONTENT,
+    SEARCH,
+    SEARCH_BY_COHORT,
+    LESSON_LIST_VERSION,
+    LESSON_UPDATE,
+    LESSON_UPDATED_AT,
+    SUBMISSION_LIST_BY_ASSIGNMENT,
+    SUBMISSION_LIST_BY_ASSIGNMENT_JSON,
+    SUBMISSION_LIST_BY_USER,
+    STUDENT_DASHBOARD,
+    SUBMISSION_UPSERT,
+    USER_ROLE,
+    USER_SESSION,
+)
 from app.models import USER_TABLE_DDL
-from typing import List, Optional
+from app.schemas import (
+    LoginRequest,
+    VerifyCodeRequest,
+    CurriculumCreate,
+    CurriculumUpdate,
+    CurriculumOut,
+    CurriculumTree,
+    LessonCreate,
+    LessonUpdate,
+    LessonOut,
+    AssignmentCreate,
+    AssignmentUpdate,
+    AssignmentOut,
+    CohortCreate,
+    CohortUpdate,
+    CohortOut,
+    EnrollmentBase,
+    EnrollmentOut,
+    BulkEnrollmentResult,
+    EventCreate,
+    EventUpdate,
+    EventOut,
+    SubmissionCreate,
+    SubmissionOut,
+    GradeCreate,
+    GradeOut,
+    BulkGradeResult,
+    SearchResult,
+    VaultSyncRequest,
+    VaultSyncResult,
+    GradingQueueItem,
+    GradingClaimRequest,
+    GradingClaim,
+    ClaimedGrade,
+    DashboardCounts,
+    StudentDashboard,
+    naive_utc,
+)
+from typing import List, Literal, Optional
 import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
+import asyncpg
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = FastAPI()
 
+# Requests slower than this are logged with their per-query breakdown
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+REQUEST_ID_HEADER = "X-Request-ID"
+# Set after a successful write; while it holds a future timestamp, reads skip the replicas
+READ_PRIMARY_COOKIE = "lms_read_primary"
+# How long a grader holds claimed submissions before others may take them
+GRADING_LEASE_SECONDS = float(os.getenv("GRADING_LEASE_SECONDS", "900"))
+# Row errors listed in a bulk import response; the rest are only counted
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "100"))
+# Full-text search
+SEARCH_KINDS = ("curriculum", "lesson", "assignment")
+# Matches of each kind that are ranked; see queries.SEARCH
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+# Matches are marked with control characters by ts_headline, then swapped
+# for <mark> after escaping, so content can never inject markup
+SEARCH_HEADLINE_OPTIONS = 'StartSel=\x02, StopSel=\x03, MinWords=15, MaxWords=35, MaxFragments=2, FragmentDelimiter=" … "'
+# Login code requests: a burst, then a steady rate, per email and per client IP
+AUTH_CODE_EMAIL_BURST = int(os.getenv("AUTH_CODE_EMAIL_BURST", "3"))
+AUTH_CODE_EMAIL_PER_MINUTE = float(os.getenv("AUTH_CODE_EMAIL_PER_MINUTE", "1"))
+AUTH_CODE_IP_BURST = int(os.getenv("AUTH_CODE_IP_BURST", "20"))
+AUTH_CODE_IP_PER_MINUTE = float(os.getenv("AUTH_CODE_IP_PER_MINUTE", "10"))
+# Accept the legacy X-User-Email header (one role lookup per request) when no bearer token is sent
+AUTH_ALLOW_EMAIL_HEADER = os.getenv("AUTH_ALLOW_EMAIL_HEADER", "false").lower() == "true"
+
+email_code_limiter = TokenBucketLimiter(AUTH_CODE_EMAIL_PER_MINUTE, AUTH_CODE_EMAIL_BURST)
+ip_code_limiter = TokenBucketLimiter(AUTH_CODE_IP_PER_MINUTE, AUTH_CODE_IP_BURST)
+# Logouts on other workers arrive over the cache invalidation channel
+cache.subscribe(REVOKED_PREFIX, revocations.on_invalidate)
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    timing = RequestTiming()
+    token = current_request.set(timing)
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        with request_logging(request.scope, request_id):
+            response = await call_next(request)
+        status_code = response.status_code
+        response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        current_request.reset(token)
+        route = request.scope.get("route")
+        # Label by route template, never the raw path, to keep cardinality bounded
+        template = route.path if route is not None else "unmatched"
+        route_metrics.observe(request.method, template, status_code, elapsed, timing)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.bind(request_id=request_id).warning(
+                f"Slow request {request.method} {template} {status_code}: {elapsed * 1000:.1f}ms total, "
+                f"{timing.db_seconds * 1000:.1f}ms in {len(timing.queries)} queries, "
+                f"{timing.acquire_seconds * 1000:.1f}ms waiting for a connection"
+                + (f" [{timing.breakdown()}]" if timing.queries else "")
+            )
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    try:
+        pinned = float(request.cookies.get(READ_PRIMARY_COOKIE, "0")) > time.time()
+    except ValueError:
+        pinned = False
+    token = pin_primary.set(pinned)
+    try:
+        response = await call_next(request)
+    finally:
+        pin_primary.reset(token)
+    if db.replicas and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE, f"{time.time() + DB_READ_YOUR_WRITES_SECONDS:.0f}",
+            max_age=int(DB_READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite="lax",
+        )
+    return response
+
+@app.exception_handler(PoolAcquireTimeout)
+async def pool_acquire_timeout_handler(request: Request, exc: PoolAcquireTimeout):
+    # Shed load quickly rather than letting requests pile up behind the pool
+    return JSONResponse(status_code=503, content={"detail": "Database busy, retry shortly."}, headers={"Retry-After": "1"})
+
 @app.on_event("startup")
 async def startup_event():
     await db.connect()
+    await cache.start()
+    await outbox.start()
+    await sweeper.start()
+    await renderer.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await renderer.stop()
+    await sweeper.stop()
+    await outbox.stop()
+    await cache.stop()
     await db.disconnect()
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
-class LoginRequest(BaseModel):
-    email: EmailStr
-
-class VerifyCodeRequest(BaseModel):
-    email: EmailStr
-    code: str
-
 def generate_auth_code(length=6):
     return ''.join(random.choices(string.digits, k=length))
 
 @app.post("/auth/request_code")
-async def request_login_code(payload: LoginRequest):
+async def request_login_code(payload: LoginRequest, request: Request):
+    # Checked before touching the database, so a storm costs no inserts
+    client_ip = request.client.host if request.client else "unknown"
+    for limiter, key in ((ip_code_limiter, client_ip), (email_code_limiter, payload.email.lower())):
+        wait = limiter.acquire(key)
+        if wait:
+            logger.warning(f"Login code request throttled for {payload.email} from {client_ip}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login code requests; try again later.",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
     code = generate_auth_code()
     expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
     async with db.pool.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO auth_codes (email, code, expires_at)
-            VALUES ($1, $2, $3)
-            """, payload.email, code, expires_at
-        )
-        logger.info(f"Auth code generated for {payload.email}")
-    # Send code via SendGrid
-    sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
-    sendgrid_from_email = os.getenv("SENDGRID_FROM_EMAIL")
-    if sendgrid_api_key and sendgrid_from_email:
-        message = Mail(
-            from_email=sendgrid_from_email,
-            to_emails=payload.email,
-            subject="Your Magic Login Code",
-            html_content=f"<p>Your login code is: <b>{code}</b></p>"
-        )
-        try:
-            sg = SendGridAPIClient(sendgrid_api_key)
-            sg.send(message)
-            logger.info(f"Magic link sent to {payload.email} via SendGrid")
-        except Exception as e:
-            logger.error(f"Failed to send magic link email: {e}")
-    else:
-        logger.warning("SendGrid not configured; email not sent.")
+        async with conn.transaction():
+            await AUTH_CODE_INSERT.execute(conn, payload.email, code, expires_at)
+            # Delivery happens in the background dispatcher; see app/email_outbox.py
+            await outbox.enqueue(
+                conn,
+                payload.email,
+                "Your Magic Login Code",
+                f"<p>Your login code is: <b>{code}</b></p>"
+            )
+        # Only after commit, so the dispatcher can see the new row
+        outbox.wake()
+        logger.info(f"Auth code generated and queued for {payload.email}")
     # Only return code in response if not in production
     if os.getenv("ENV") != "production":
         return {"message": "Auth code sent", "code": code}
@@ -74,208 +286,370 @@ async def request_login_code(payload: LoginRequest):
 @app.post("/auth/verify_code")
 async def verify_login_code(payload: VerifyCodeRequest):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT * FROM auth_codes WHERE email=$1 AND code=$2 AND used=FALSE AND expires_at > NOW()
-            """, payload.email, payload.code
-        )
+        row = await AUTH_CODE_VERIFY.fetchrow(conn, payload.email, payload.code)
         if not row:
             logger.warning(f"Failed login attempt for {payload.email}")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired code.")
-        await conn.execute(
-            "UPDATE auth_codes SET used=TRUE WHERE id=$1", row["id"]
-        )
-        logger.info(f"Successful login for {payload.email}")
-        # Issue a dummy session token (to be replaced with JWT or session logic)
-        return {"message": "Login successful", "email": payload.email}
+        await AUTH_CODE_MARK_USED.execute(conn, row["id"], row["expires_at"])
+        user = await USER_SESSION.fetchrow(conn, payload.email)
+    if user is None:
+        # Codes can be requested for any address; only users get a session
+        logger.warning(f"Login code verified for unknown user {payload.email}")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired code.")
+    token, session = issue_token(user["id"], user["role"])
+    logger.info(f"Successful login for {payload.email}")
+    return {
+        "message": "Login successful",
+        "email": payload.email,
+        "token": token,
+        "token_type": "bearer",
+        "expires_at": datetime.datetime.utcfromtimestamp(session.expires_at).isoformat() + "Z",
+    }
+
+def bearer_session(request: Request):
+    """The verified session for a request's bearer token, or None when it sends none."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    try:
+        return verify_token(token.strip())
+    except InvalidToken as error:
+        logger.warning(f"Rejected session token: {error}")
+        raise HTTPException(status_code=401, detail=f"Invalid session token: {error}", headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/auth/logout")
+async def logout(request: Request):
+    session = bearer_session(request)
+    if session is None:
+        raise HTTPException(status_code=401, detail="Missing session token.", headers={"WWW-Authenticate": "Bearer"})
+    async with db.pool.acquire() as conn:
+        await cache.publish(conn, revocations.key(session))
+    logger.info(f"Session revoked for user {session.user_id}")
+    return {"message": "Logged out"}
 
 async def get_user_role(email: str):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT r.name FROM users u JOIN roles r ON u.role_id = r.id WHERE u.email = $1
-            """, email
-        )
-        if row:
-            return row["name"]
-        return None
+        return await USER_ROLE.fetchval(conn, email)
 
 def role_required(required_role: str):
     async def dependency(request: Request):
-        email = request.headers.get("X-User-Email")
-        if not email:
-            logger.warning("Missing X-User-Email header for role check")
-            raise HTTPException(status_code=401, detail="Missing user email header.")
-        user_role = await get_user_role(email)
+        # Bearer tokens are checked in memory; only the legacy header costs a query
+        session = bearer_session(request)
+        if session is not None:
+            who, user_role = f"user {session.user_id}", session.role
+        elif AUTH_ALLOW_EMAIL_HEADER and request.headers.get("X-User-Email"):
+            who = request.headers["X-User-Email"]
+            user_role = await get_user_role(who)
+        else:
+            logger.warning("Missing credentials for role check")
+            raise HTTPException(status_code=401, detail="Missing session token.", headers={"WWW-Authenticate": "Bearer"})
         if user_role != required_role:
-            logger.warning(f"Unauthorized access attempt by {email} (role: {user_role}), required: {required_role}")
+            logger.warning(f"Unauthorized access attempt by {who} (role: {user_role}), required: {required_role}")
             raise HTTPException(status_code=403, detail="Insufficient role.")
-        logger.info(f"Role check passed for {email} as {user_role}")
+        logger.info(f"Role check passed for {who} as {user_role}")
     return Depends(dependency)
 
+# Conditional GETs for content that carries updated_at. A client revalidating
+# something not in the content cache is checked against a version query, so
+# an unchanged resource costs one small query and no row bodies.
+async def revalidate_row(request: Request, cache_key: str, updated_at_query, row_id: int):
+    if not has_validators(request) or cache_key in cache:
+        return None
+    async with db.read() as conn:
+        updated_at = await updated_at_query.fetchval(conn, row_id)
+    if updated_at is None:
+        return None
+    etag = row_etag(row_id, updated_at)
+    return not_modified_response(etag, updated_at) if not_modified(request, etag, updated_at) else None
+
+async def revalidate_list(request: Request, cache_key, version_query, *args):
+    if not has_validators(request) or cache_key in cache:
+        return None
+    async with db.read() as conn:
+        etag = version_etag(await version_query.fetchval(conn, *args))
+    return not_modified_response(etag) if not_modified(request, etag) else None
+
+def conditional_row(request: Request, response: Response, row):
+    """`row` with ETag and Last-Modified set from its updated_at, or a 304."""
+    etag = row_etag(row.id, row.updated_at)
+    if not_modified(request, etag, row.updated_at):
+        return not_modified_response(etag, row.updated_at)
+    response.headers.update(validator_headers(etag, row.updated_at))
+    return row
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
+@app.get("/db/pool/stats")
+async def pool_stats():
+    return db.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    metrics = PrometheusText()
+    for (method, route, status_code), histogram in route_metrics.latency.items():
+        labels = {"method": method, "route": route, "status": status_code}
+        metrics.histogram("lms_http_request_duration_seconds", "HTTP request latency.", histogram, **labels)
+        metrics.histogram("lms_http_request_db_seconds", "Database time per HTTP request.", route_metrics.db_time[(method, route, status_code)], **labels)
+        metrics.counter("lms_http_request_db_queries_total", "Database queries issued by HTTP requests.", route_metrics.db_queries[(method, route, status_code)], **labels)
+    for name, query_stats in registry.stats().items():
+        metrics.counter("lms_db_query_calls_total", "Calls per named query.", query_stats["calls"], query=name)
+        metrics.counter("lms_db_query_errors_total", "Failed calls per named query.", query_stats["errors"], query=name)
+        metrics.counter("lms_db_query_seconds_total", "Time spent per named query.", query_stats["total_ms"] / 1000, query=name)
+    pool = db.stats()
+    if pool["connected"]:
+        metrics.gauge("lms_db_pool_connections", "Pool connections by state.", pool["in_use"], state="in_use")
+        metrics.gauge("lms_db_pool_connections", "Pool connections by state.", pool["idle"], state="idle")
+        metrics.gauge("lms_db_pool_waiting", "Requests waiting for a pool connection.", pool["waiting"])
+        metrics.gauge("lms_db_pool_max_size", "Configured pool maximum.", pool["max_size"])
+        metrics.counter("lms_db_pool_acquire_timeouts_total", "Pool acquires that timed out.", pool["acquire_timeouts"])
+        metrics.counter("lms_db_pool_reconnects_total", "Connections opened after startup.", pool["reconnects"])
+        metrics.histogram("lms_db_pool_acquire_wait_seconds", "Time spent waiting for a pool connection.", db.pool.wait_times)
+    cache_stats = cache.stats()
+    metrics.counter("lms_cache_hits_total", "Content cache hits.", cache_stats["hits"])
+    metrics.counter("lms_cache_misses_total", "Content cache misses.", cache_stats["misses"])
+    metrics.gauge("lms_cache_entries", "Content cache entries.", cache_stats["entries"])
+    for scope, limiter in (("email", email_code_limiter), ("ip", ip_code_limiter)):
+        metrics.counter("lms_auth_code_requests_throttled_total", "Login code requests refused by the rate limiter.", limiter.rejected, scope=scope)
+    metrics.gauge("lms_auth_tokens_revoked", "Unexpired session tokens on the revocation list.", len(revocations))
+    metrics.counter("lms_lesson_renders_total", "Lesson contents rendered and compressed.", renderer.rendered)
+    metrics.counter("lms_lesson_render_reuses_total", "Lesson writes that reused a stored render.", renderer.reused)
+    metrics.counter("lms_auth_codes_purged_total", "Used or expired login codes deleted by the sweeper.", sweeper.purged)
+    metrics.counter("lms_auth_code_partitions_dropped_total", "Expired auth_codes partitions dropped.", sweeper.partitions_dropped)
+    if queue_sink is not None:
+        log_stats = queue_sink.stats()
+        metrics.gauge("lms_log_queue_depth", "Log records waiting for the writer thread.", log_stats["queued"])
+        metrics.counter("lms_log_records_dropped_total", "Log records dropped because the queue was full.", log_stats["dropped"])
+    return metrics.render()
+
+@app.get("/queries/stats")
+async def query_stats():
+    return registry.stats()
+
 @app.get("/admin/protected")
 async def admin_protected_endpoint(dep=role_required("admin")):
     return {"message": "You have admin access."}
 
-class CurriculumBase(BaseModel):
-    title: str
-    description: Optional[str] = None
-    cohort_id: Optional[int] = None
-    published: Optional[bool] = False
-
-class CurriculumCreate(CurriculumBase):
-    pass
-
-class CurriculumUpdate(CurriculumBase):
-    pass
-
-class CurriculumOut(CurriculumBase):
-    id: int
-    created_at: datetime.datetime
-    updated_at: datetime.datetime
-
-class LessonBase(BaseModel):
-    curriculum_id: int
-    title: str
-    content_markdown: Optional[str] = None
-    order_index: Optional[int] = None
-
-class LessonCreate(LessonBase):
-    pass
-
-class LessonUpdate(LessonBase):
-    pass
-
-class LessonOut(LessonBase):
-    id: int
-    created_at: datetime.datetime
-    updated_at: datetime.datetime
-
-class AssignmentBase(BaseModel):
-    lesson_id: int
-    title: str
-    description: Optional[str] = None
-    due_date: Optional[datetime.datetime] = None
-    max_score: Optional[int] = None
-
-class AssignmentCreate(AssignmentBase):
-    pass
-
-class AssignmentUpdate(AssignmentBase):
-    pass
-
-class AssignmentOut(AssignmentBase):
-    id: int
-    created_at: datetime.datetime
-    updated_at: datetime.datetime
-
 # Curriculum Endpoints
 @app.post("/curriculum", response_model=CurriculumOut, dependencies=[role_required("admin")])
 async def create_curriculum(curriculum: CurriculumCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO curriculum (title, description, cohort_id, published)
-            VALUES ($1, $2, $3, $4)
-            RETURNING *
-            """,
-            curriculum.title, curriculum.description, curriculum.cohort_id, curriculum.published
-        )
-        logger.info(f"Curriculum created: {row['id']}")
-        return dict(row)
+        row = await CURRICULUM_INSERT.fetchrow(conn, curriculum.title, curriculum.description, curriculum.cohort_id, curriculum.published)
+        await cache.publish(conn, "curriculum", "tree")
+        logger.info(f"Curriculum created: {row.id}")
+        return row
 
 @app.get("/curriculum", response_model=List[CurriculumOut])
-async def list_curricula():
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM curriculum")
+async def list_curricula(request: Request, response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info("Curriculum list streamed")
+        return await stream_json(CURRICULUM_LIST, page.after, page.limit, model=CurriculumOut)
+    cache_key = page.cache_key("curriculum")
+    unchanged = await revalidate_list(request, cache_key, CURRICULUM_LIST_VERSION, page.after, page.fetch_limit)
+    if unchanged:
+        logger.info("Curriculum list not modified")
+        return unchanged
+    if page.fast:
+        async def load_json():
+            async with db.pool.acquire() as conn:
+                return await CURRICULUM_LIST_JSON.fetchrow(conn, page.after, page.fetch_limit)
+        row = await cache.get_or_load(cache_key, load_json)
+        etag = version_etag(row["version"])
+        if not_modified(request, etag):
+            logger.info("Curriculum list not modified")
+            return not_modified_response(etag)
         logger.info("Curriculum list retrieved")
-        return [dict(row) for row in rows]
+        return json_response(row, etag)
+    async def load():
+        async with db.pool.acquire() as conn:
+            rows = await CURRICULUM_LIST.fetch(conn, page.after, page.fetch_limit)
+            return rows
+    rows = await cache.get_or_load(cache_key, load)
+    etag = rows_etag(rows)
+    if not_modified(request, etag):
+        logger.info("Curriculum list not modified")
+        return not_modified_response(etag)
+    response.headers.update(validator_headers(etag))
+    logger.info("Curriculum list retrieved")
+    return page.apply(rows, response)
 
 @app.get("/curriculum/{curriculum_id}", response_model=CurriculumOut)
-async def get_curriculum(curriculum_id: int):
+async def get_curriculum(curriculum_id: int, request: Request, response: Response):
+    cache_key = f"curriculum:{curriculum_id}"
+    unchanged = await revalidate_row(request, cache_key, CURRICULUM_UPDATED_AT, curriculum_id)
+    if unchanged:
+        logger.info(f"Curriculum not modified: {curriculum_id}")
+        return unchanged
+    async def load():
+        async with db.pool.acquire() as conn:
+            row = await CURRICULUM_GET.fetchrow(conn, curriculum_id)
+            return row
+    row = await cache.get_or_load(cache_key, load)
+    if not row:
+        logger.warning(f"Curriculum not found: {curriculum_id}")
+        raise HTTPException(status_code=404, detail="Curriculum not found")
+    logger.info(f"Curriculum retrieved: {curriculum_id}")
+    return conditional_row(request, response, row)
+
+@app.post("/curriculum/{curriculum_id}/sync", response_model=VaultSyncResult, dependencies=[role_required("admin")])
+async def sync_curriculum_vault(curriculum_id: int, payload: VaultSyncRequest):
+    root = os.path.realpath(VAULT_DIR)
+    directory = os.path.realpath(os.path.join(root, payload.path or ""))
+    if os.path.commonpath([root, directory]) != root:
+        raise HTTPException(status_code=400, detail="Path must be inside the vault directory.")
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM curriculum WHERE id=$1", curriculum_id)
-        if not row:
-            logger.warning(f"Curriculum not found: {curriculum_id}")
+        if not await CURRICULUM_GET.fetchrow(conn, curriculum_id):
+            logger.warning(f"Curriculum not found for vault sync: {curriculum_id}")
             raise HTTPException(status_code=404, detail="Curriculum not found")
-        logger.info(f"Curriculum retrieved: {curriculum_id}")
-        return dict(row)
+    try:
+        return await sync_vault(curriculum_id, directory, dry_run=payload.dry_run)
+    except FileNotFoundError:
+        logger.warning(f"Vault directory not found: {directory}")
+        raise HTTPException(status_code=404, detail="Vault directory not found")
+    except UnicodeDecodeError as error:
+        logger.warning(f"Vault sync rejected a page that is not UTF-8: {error}")
+        raise HTTPException(status_code=422, detail="Vault pages must be UTF-8 text.")
+
+@app.get("/curriculum/{curriculum_id}/tree", response_model=CurriculumTree)
+async def get_curriculum_tree(curriculum_id: int, request: Request):
+    async def load():
+        async with db.pool.acquire() as conn:
+            row = await CURRICULUM_TREE.fetchrow(conn, curriculum_id)
+        if not row:
+            return None
+        body = row["body"].encode()
+        return {"body": body, "etag": etag_for(body), "last_modified": row["last_modified"]}
+    tree = await cache.get_or_load(f"tree:{curriculum_id}", load)
+    if not tree:
+        logger.warning(f"Curriculum not found: {curriculum_id}")
+        raise HTTPException(status_code=404, detail="Curriculum not found")
+    logger.info(f"Curriculum tree retrieved: {curriculum_id}")
+    return conditional_response(request, tree["body"], etag=tree["etag"], last_modified=tree["last_modified"])
 
 @app.put("/curriculum/{curriculum_id}", response_model=CurriculumOut, dependencies=[role_required("admin")])
 async def update_curriculum(curriculum_id: int, curriculum: CurriculumUpdate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE curriculum SET title=$1, description=$2, cohort_id=$3, published=$4, updated_at=NOW()
-            WHERE id=$5 RETURNING *
-            """,
-            curriculum.title, curriculum.description, curriculum.cohort_id, curriculum.published, curriculum_id
-        )
+        row = await CURRICULUM_UPDATE.fetchrow(conn, curriculum.title, curriculum.description, curriculum.cohort_id, curriculum.published, curriculum_id)
         if not row:
             logger.warning(f"Curriculum not found for update: {curriculum_id}")
             raise HTTPException(status_code=404, detail="Curriculum not found")
+        await cache.publish(conn, "curriculum", "tree")
         logger.info(f"Curriculum updated: {curriculum_id}")
-        return dict(row)
+        return row
 
 @app.delete("/curriculum/{curriculum_id}", dependencies=[role_required("admin")])
 async def delete_curriculum(curriculum_id: int):
     async with db.pool.acquire() as conn:
-        result = await conn.execute("DELETE FROM curriculum WHERE id=$1", curriculum_id)
+        result = await CURRICULUM_DELETE.execute(conn, curriculum_id)
+        await cache.publish(conn, "curriculum", "tree")
         logger.info(f"Curriculum deleted: {curriculum_id}")
         return {"message": "Curriculum deleted"}
 
 # Lessons Endpoints
 @app.post("/lessons", response_model=LessonOut, dependencies=[role_required("admin")])
 async def create_lesson(lesson: LessonCreate):
+    content_hash, content_html = await renderer.prepare(lesson.content_markdown)
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO lessons (curriculum_id, title, content_markdown, order_index)
-            VALUES ($1, $2, $3, $4)
-            RETURNING *
-            """,
-            lesson.curriculum_id, lesson.title, lesson.content_markdown, lesson.order_index
-        )
-        logger.info(f"Lesson created: {row['id']}")
-        return dict(row)
+        row = await LESSON_INSERT.fetchrow(conn, lesson.curriculum_id, lesson.title, lesson.content_markdown, lesson.order_index, content_hash, content_html)
+        await cache.publish(conn, "lessons", "tree")
+        logger.info(f"Lesson created: {row.id}")
+        return row
 
 @app.get("/lessons", response_model=List[LessonOut])
-async def list_lessons():
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM lessons")
+async def list_lessons(request: Request, response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info("Lessons list streamed")
+        return await stream_json(LESSON_LIST, page.after, page.limit, model=LessonOut)
+    cache_key = page.cache_key("lessons")
+    unchanged = await revalidate_list(request, cache_key, LESSON_LIST_VERSION, page.after, page.fetch_limit)
+    if unchanged:
+        logger.info("Lessons list not modified")
+        return unchanged
+    if page.fast:
+        async def load_json():
+            async with db.pool.acquire() as conn:
+                return await LESSON_LIST_JSON.fetchrow(conn, page.after, page.fetch_limit)
+        row = await cache.get_or_load(cache_key, load_json)
+        etag = version_etag(row["version"])
+        if not_modified(request, etag):
+            logger.info("Lessons list not modified")
+            return not_modified_response(etag)
         logger.info("Lessons list retrieved")
-        return [dict(row) for row in rows]
+        return json_response(row, etag)
+    async def load():
+        async with db.pool.acquire() as conn:
+            rows = await LESSON_LIST.fetch(conn, page.after, page.fetch_limit)
+            return rows
+    rows = await cache.get_or_load(cache_key, load)
+    etag = rows_etag(rows)
+    if not_modified(request, etag):
+        logger.info("Lessons list not modified")
+        return not_modified_response(etag)
+    response.headers.update(validator_headers(etag))
+    logger.info("Lessons list retrieved")
+    return page.apply(rows, response)
 
 @app.get("/lessons/{lesson_id}", response_model=LessonOut)
-async def get_lesson(lesson_id: int):
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM lessons WHERE id=$1", lesson_id)
-        if not row:
-            logger.warning(f"Lesson not found: {lesson_id}")
-            raise HTTPException(status_code=404, detail="Lesson not found")
-        logger.info(f"Lesson retrieved: {lesson_id}")
-        return dict(row)
+async def get_lesson(lesson_id: int, request: Request, response: Response):
+    cache_key = f"lessons:{lesson_id}"
+    unchanged = await revalidate_row(request, cache_key, LESSON_UPDATED_AT, lesson_id)
+    if unchanged:
+        logger.info(f"Lesson not modified: {lesson_id}")
+        return unchanged
+    async def load():
+        async with db.pool.acquire() as conn:
+            row = await LESSON_GET.fetchrow(conn, lesson_id)
+            return row
+    row = await cache.get_or_load(cache_key, load)
+    if not row:
+        logger.warning(f"Lesson not found: {lesson_id}")
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    logger.info(f"Lesson retrieved: {lesson_id}")
+    return conditional_row(request, response, row)
+
+@app.get("/lessons/{lesson_id}/content")
+async def get_lesson_content(lesson_id: int, request: Request):
+    # Sent as stored: the variant was compressed once, when the content was first written
+    encoding = preferred_encoding(request)
+    async def load():
+        async with db.pool.acquire() as conn:
+            return await LESSON_CONTENT.fetchrow(conn, lesson_id, encoding)
+    row = await cache.get_or_load(f"lessons:{lesson_id}:content:{encoding}", load)
+    if not row:
+        logger.warning(f"Lesson not found: {lesson_id}")
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    body, sent_encoding = row["encoded"], encoding
+    if body is None:
+        # No stored variant (no content, or its render was pruned); send the lesson's copy as is
+        body, sent_encoding = (row["content_html"] or "").encode(), "identity"
+    response = conditional_response(
+        request, body, etag=f'W/"{row["content_hash"]}"' if row["content_hash"] else None,
+        media_type="text/html; charset=utf-8",
+    )
+    response.headers["Vary"] = "Accept-Encoding"
+    if sent_encoding != "identity" and response.status_code == 200:
+        response.headers["Content-Encoding"] = sent_encoding
+    logger.info(f"Lesson content retrieved: {lesson_id} ({sent_encoding})")
+    return response
 
 @app.put("/lessons/{lesson_id}", response_model=LessonOut, dependencies=[role_required("admin")])
 async def update_lesson(lesson_id: int, lesson: LessonUpdate):
+    content_hash, content_html = await renderer.prepare(lesson.content_markdown)
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE lessons SET curriculum_id=$1, title=$2, content_markdown=$3, order_index=$4, updated_at=NOW()
-            WHERE id=$5 RETURNING *
-            """,
-            lesson.curriculum_id, lesson.title, lesson.content_markdown, lesson.order_index, lesson_id
-        )
+        row = await LESSON_UPDATE.fetchrow(conn, lesson.curriculum_id, lesson.title, lesson.content_markdown, lesson.order_index, lesson_id, content_hash, content_html)
         if not row:
             logger.warning(f"Lesson not found for update: {lesson_id}")
             raise HTTPException(status_code=404, detail="Lesson not found")
+        await cache.publish(conn, "lessons", "tree")
         logger.info(f"Lesson updated: {lesson_id}")
-        return dict(row)
+        return row
 
 @app.delete("/lessons/{lesson_id}", dependencies=[role_required("admin")])
 async def delete_lesson(lesson_id: int):
     async with db.pool.acquire() as conn:
-        result = await conn.execute("DELETE FROM lessons WHERE id=$1", lesson_id)
+        result = await LESSON_DELETE.execute(conn, lesson_id)
+        await cache.publish(conn, "lessons", "tree")
         logger.info(f"Lesson deleted: {lesson_id}")
         return {"message": "Lesson deleted"}
 
@@ -283,150 +657,171 @@ async def delete_lesson(lesson_id: int):
 @app.post("/assignments", response_model=AssignmentOut, dependencies=[role_required("admin")])
 async def create_assignment(assignment: AssignmentCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO assignments (lesson_id, title, description, due_date, max_score)
-            VALUES ($1, $2, $3, $4, $5)
-            RETURNING *
-            """,
-            assignment.lesson_id, assignment.title, assignment.description, assignment.due_date, assignment.max_score
-        )
-        logger.info(f"Assignment created: {row['id']}")
-        return dict(row)
+        row = await ASSIGNMENT_INSERT.fetchrow(conn, assignment.lesson_id, assignment.title, assignment.description, assignment.due_date, assignment.max_score)
+        await cache.publish(conn, "assignments", "tree")
+        logger.info(f"Assignment created: {row.id}")
+        return row
 
 @app.get("/assignments", response_model=List[AssignmentOut])
-async def list_assignments():
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM assignments")
+async def list_assignments(request: Request, response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info("Assignments list streamed")
+        return await stream_json(ASSIGNMENT_LIST, page.after, page.limit, model=AssignmentOut)
+    cache_key = page.cache_key("assignments")
+    unchanged = await revalidate_list(request, cache_key, ASSIGNMENT_LIST_VERSION, page.after, page.fetch_limit)
+    if unchanged:
+        logger.info("Assignments list not modified")
+        return unchanged
+    if page.fast:
+        async def load_json():
+            async with db.pool.acquire() as conn:
+                return await ASSIGNMENT_LIST_JSON.fetchrow(conn, page.after, page.fetch_limit)
+        row = await cache.get_or_load(cache_key, load_json)
+        etag = version_etag(row["version"])
+        if not_modified(request, etag):
+            logger.info("Assignments list not modified")
+            return not_modified_response(etag)
         logger.info("Assignments list retrieved")
-        return [dict(row) for row in rows]
+        return json_response(row, etag)
+    async def load():
+        async with db.pool.acquire() as conn:
+            rows = await ASSIGNMENT_LIST.fetch(conn, page.after, page.fetch_limit)
+            return rows
+    rows = await cache.get_or_load(cache_key, load)
+    etag = rows_etag(rows)
+    if not_modified(request, etag):
+        logger.info("Assignments list not modified")
+        return not_modified_response(etag)
+    response.headers.update(validator_headers(etag))
+    logger.info("Assignments list retrieved")
+    return page.apply(rows, response)
 
 @app.get("/assignments/{assignment_id}", response_model=AssignmentOut)
-async def get_assignment(assignment_id: int):
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM assignments WHERE id=$1", assignment_id)
-        if not row:
-            logger.warning(f"Assignment not found: {assignment_id}")
-            raise HTTPException(status_code=404, detail="Assignment not found")
-        logger.info(f"Assignment retrieved: {assignment_id}")
-        return dict(row)
+async def get_assignment(assignment_id: int, request: Request, response: Response):
+    cache_key = f"assignments:{assignment_id}"
+    unchanged = await revalidate_row(request, cache_key, ASSIGNMENT_UPDATED_AT, assignment_id)
+    if unchanged:
+        logger.info(f"Assignment not modified: {assignment_id}")
+        return unchanged
+    async def load():
+        async with db.pool.acquire() as conn:
+            row = await ASSIGNMENT_GET.fetchrow(conn, assignment_id)
+            return row
+    row = await cache.get_or_load(cache_key, load)
+    if not row:
+        logger.warning(f"Assignment not found: {assignment_id}")
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    logger.info(f"Assignment retrieved: {assignment_id}")
+    return conditional_row(request, response, row)
 
 @app.put("/assignments/{assignment_id}", response_model=AssignmentOut, dependencies=[role_required("admin")])
 async def update_assignment(assignment_id: int, assignment: AssignmentUpdate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE assignments SET lesson_id=$1, title=$2, description=$3, due_date=$4, max_score=$5, updated_at=NOW()
-            WHERE id=$6 RETURNING *
-            """,
-            assignment.lesson_id, assignment.title, assignment.description, assignment.due_date, assignment.max_score, assignment_id
-        )
+        row = await ASSIGNMENT_UPDATE.fetchrow(conn, assignment.lesson_id, assignment.title, assignment.description, assignment.due_date, assignment.max_score, assignment_id)
         if not row:
             logger.warning(f"Assignment not found for update: {assignment_id}")
             raise HTTPException(status_code=404, detail="Assignment not found")
+        await cache.publish(conn, "assignments", "tree")
         logger.info(f"Assignment updated: {assignment_id}")
-        return dict(row)
+        return row
 
 @app.delete("/assignments/{assignment_id}", dependencies=[role_required("admin")])
 async def delete_assignment(assignment_id: int):
     async with db.pool.acquire() as conn:
-        result = await conn.execute("DELETE FROM assignments WHERE id=$1", assignment_id)
+        result = await ASSIGNMENT_DELETE.execute(conn, assignment_id)
+        await cache.publish(conn, "assignments", "tree")
         logger.info(f"Assignment deleted: {assignment_id}")
         return {"message": "Assignment deleted"}
 
-class CohortBase(BaseModel):
-    name: str
-    start_date: datetime.date
-    end_date: datetime.date
-
-class CohortCreate(CohortBase):
-    pass
-
-class CohortUpdate(CohortBase):
-    pass
-
-class CohortOut(CohortBase):
-    id: int
-
-class EnrollmentBase(BaseModel):
-    user_id: int
-    cohort_id: int
-
-class EnrollmentOut(EnrollmentBase):
-    id: int
-    enrolled_at: datetime.datetime
-
-class EventBase(BaseModel):
-    cohort_id: int
-    title: str
-    description: Optional[str] = None
-    event_type: Optional[str] = None
-    start_time: datetime.datetime
-    end_time: datetime.datetime
-    location: Optional[str] = None
-
-class EventCreate(EventBase):
-    pass
-
-class EventUpdate(EventBase):
-    pass
-
-class EventOut(EventBase):
-    id: int
-    created_at: datetime.datetime
-    updated_at: datetime.datetime
-
 # Cohort Endpoints
 @app.post("/cohorts", response_model=CohortOut, dependencies=[role_required("admin")])
 async def create_cohort(cohort: CohortCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO cohorts (name, start_date, end_date)
-            VALUES ($1, $2, $3)
-            RETURNING *
-            """,
-            cohort.name, cohort.start_date, cohort.end_date
-        )
-        logger.info(f"Cohort created: {row['id']}")
-        return dict(row)
+        row = await COHORT_INSERT.fetchrow(conn, cohort.name, cohort.start_date, cohort.end_date)
+        logger.info(f"Cohort created: {row.id}")
+        return row
 
 @app.get("/cohorts", response_model=List[CohortOut])
-async def list_cohorts():
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM cohorts")
+async def list_cohorts(response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info("Cohort list streamed")
+        return await stream_json(COHORT_LIST, page.after, page.limit, model=CohortOut)
+    async with db.read() as conn:
+        if page.fast:
+            row = await COHORT_LIST_JSON.fetchrow(conn, page.after, page.fetch_limit)
+            logger.info("Cohort list retrieved")
+            return json_response(row)
+        rows = await COHORT_LIST.fetch(conn, page.after, page.fetch_limit)
         logger.info("Cohort list retrieved")
-        return [dict(row) for row in rows]
+        return page.apply(rows, response)
 
 @app.get("/cohorts/{cohort_id}", response_model=CohortOut)
 async def get_cohort(cohort_id: int):
-    async with db.pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM cohorts WHERE id=$1", cohort_id)
+    async with db.read() as conn:
+        row = await COHORT_GET.fetchrow(conn, cohort_id)
         if not row:
             logger.warning(f"Cohort not found: {cohort_id}")
             raise HTTPException(status_code=404, detail="Cohort not found")
         logger.info(f"Cohort retrieved: {cohort_id}")
-        return dict(row)
+        return row
+
+@app.get("/search", response_model=List[SearchResult])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Words, \"quoted phrases\", OR and -exclusions."),
+    cohort_id: Optional[int] = Query(None, description="Only content of curricula assigned to this cohort."),
+    kind: Optional[List[Literal["curriculum", "lesson", "assignment"]]] = Query(None, description="Kinds to search; all when omitted."),
+    limit: int = Query(20, ge=1, le=50),
+):
+    args = (q, list(kind or SEARCH_KINDS), limit, SEARCH_HEADLINE_OPTIONS, SEARCH_MAX_CANDIDATES)
+    async with db.read() as conn:
+        if cohort_id is None:
+            rows = await SEARCH.fetch(conn, *args)
+        else:
+            rows = await SEARCH_BY_COHORT.fetch(conn, *args, cohort_id)
+    for row in rows:
+        row["snippet"] = html.escape(row["snippet"]).replace("\x02", "<mark>").replace("\x03", "</mark>")
+    logger.info(f"Search for {q!r} returned {len(rows)} results")
+    return rows
+
+@app.get("/cohorts/{cohort_id}/gradebook", dependencies=[role_required('instructor')])
+async def export_gradebook(cohort_id: int, format: Literal["csv", "ndjson"] = "csv"):
+    async with db.read() as conn:
+        if not await COHORT_GET.fetchrow(conn, cohort_id):
+            logger.warning(f"Cohort not found for gradebook: {cohort_id}")
+            raise HTTPException(status_code=404, detail="Cohort not found")
+    logger.info(f"Gradebook exported for cohort {cohort_id} as {format}")
+    return await stream_gradebook(cohort_id, format)
+
+@app.get("/cohorts/{cohort_id}/calendar.ics")
+async def cohort_calendar(cohort_id: int, request: Request):
+    async with db.read() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            version = await feed_version(conn, cohort_id)
+            if version is None:
+                logger.warning(f"Cohort not found for calendar: {cohort_id}")
+                raise HTTPException(status_code=404, detail="Cohort not found")
+            etag, name = version
+            if not_modified(request, etag):
+                logger.info(f"Calendar not modified for cohort {cohort_id}")
+                return not_modified_response(etag)
+            body = await build_feed(conn, cohort_id, etag, name)
+    logger.info(f"Calendar served for cohort {cohort_id}")
+    return conditional_response(request, body, etag=etag, media_type="text/calendar; charset=utf-8")
 
 @app.put("/cohorts/{cohort_id}", response_model=CohortOut, dependencies=[role_required("admin")])
 async def update_cohort(cohort_id: int, cohort: CohortUpdate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE cohorts SET name=$1, start_date=$2, end_date=$3 WHERE id=$4 RETURNING *
-            """,
-            cohort.name, cohort.start_date, cohort.end_date, cohort_id
-        )
+        row = await COHORT_UPDATE.fetchrow(conn, cohort.name, cohort.start_date, cohort.end_date, cohort_id)
         if not row:
             logger.warning(f"Cohort not found for update: {cohort_id}")
             raise HTTPException(status_code=404, detail="Cohort not found")
         logger.info(f"Cohort updated: {cohort_id}")
-        return dict(row)
+        return row
 
 @app.delete("/cohorts/{cohort_id}", dependencies=[role_required("admin")])
 async def delete_cohort(cohort_id: int):
     async with db.pool.acquire() as conn:
-        await conn.execute("DELETE FROM cohorts WHERE id=$1", cohort_id)
+        await COHORT_DELETE.execute(conn, cohort_id)
         logger.info(f"Cohort deleted: {cohort_id}")
         return {"message": "Cohort deleted"}
 
@@ -434,32 +829,50 @@ async def delete_cohort(cohort_id: int):
 @app.post("/enrollments", response_model=EnrollmentOut)
 async def enroll_user(enrollment: EnrollmentBase):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO enrollments (user_id, cohort_id)
-            VALUES ($1, $2)
-            ON CONFLICT (user_id, cohort_id) DO NOTHING
-            RETURNING *
-            """,
-            enrollment.user_id, enrollment.cohort_id
-        )
+        row = await ENROLLMENT_INSERT.fetchrow(conn, enrollment.user_id, enrollment.cohort_id)
         if not row:
             logger.warning(f"User {enrollment.user_id} already enrolled in cohort {enrollment.cohort_id}")
             raise HTTPException(status_code=409, detail="User already enrolled in cohort")
         logger.info(f"User {enrollment.user_id} enrolled in cohort {enrollment.cohort_id}")
-        return dict(row)
+        return row
+
+@app.post("/enrollments/bulk", response_model=BulkEnrollmentResult, dependencies=[role_required("admin")])
+async def bulk_enroll_users(request: Request):
+    try:
+        records = parse_bulk_body(await request.body(), request.headers.get("content-type", ""), EnrollmentBase)
+    except BulkBodyError as error:
+        logger.warning(f"Rejected bulk enrollment body: {error}")
+        raise HTTPException(status_code=400, detail=str(error))
+    async with db.pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                await ENROLLMENT_STAGING_CREATE.execute(conn)
+                await conn.copy_records_to_table("enrollments_staging", records=records, columns=["user_id", "cohort_id"])
+                inserted = await ENROLLMENT_STAGING_MERGE.fetchval(conn)
+        except asyncpg.ForeignKeyViolationError as error:
+            logger.warning(f"Bulk enrollment references a missing user or cohort: {error.detail}")
+            raise HTTPException(status_code=422, detail=error.detail or "Unknown user or cohort")
+        logger.info(f"Bulk enrollment: {inserted} of {len(records)} rows inserted")
+        return {"received": len(records), "inserted": inserted, "duplicates": len(records) - inserted}
 
 @app.get("/enrollments/{cohort_id}", response_model=List[EnrollmentOut])
-async def list_enrollments(cohort_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM enrollments WHERE cohort_id=$1", cohort_id)
+async def list_enrollments(cohort_id: int, response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info(f"Enrollments listed for cohort {cohort_id}")
+        return await stream_json(ENROLLMENT_LIST_BY_COHORT, cohort_id, page.after, page.limit, model=EnrollmentOut)
+    async with db.read() as conn:
+        if page.fast:
+            row = await ENROLLMENT_LIST_BY_COHORT_JSON.fetchrow(conn, cohort_id, page.after, page.fetch_limit)
+            logger.info(f"Enrollments listed for cohort {cohort_id}")
+            return json_response(row)
+        rows = await ENROLLMENT_LIST_BY_COHORT.fetch(conn, cohort_id, page.after, page.fetch_limit)
         logger.info(f"Enrollments listed for cohort {cohort_id}")
-        return [dict(row) for row in rows]
+        return page.apply(rows, response)
 
 @app.delete("/enrollments/{enrollment_id}", dependencies=[role_required("admin")])
 async def delete_enrollment(enrollment_id: int):
     async with db.pool.acquire() as conn:
-        await conn.execute("DELETE FROM enrollments WHERE id=$1", enrollment_id)
+        await ENROLLMENT_DELETE.execute(conn, enrollment_id)
         logger.info(f"Enrollment deleted: {enrollment_id}")
         return {"message": "Enrollment deleted"}
 
@@ -467,144 +880,202 @@ async def delete_enrollment(enrollment_id: int):
 @app.post("/events", response_model=EventOut, dependencies=[role_required("admin")])
 async def create_event(event: EventCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO events (cohort_id, title, description, event_type, start_time, end_time, location)
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
-            RETURNING *
-            """,
-            event.cohort_id, event.title, event.description, event.event_type, event.start_time, event.end_time, event.location
-        )
-        logger.info(f"Event created: {row['id']}")
-        return dict(row)
+        row = await EVENT_INSERT.fetchrow(conn, event.cohort_id, event.title, event.description, event.event_type, event.start_time, event.end_time, event.location)
+        logger.info(f"Event created: {row.id}")
+        return row
 
 @app.get("/events/{cohort_id}", response_model=List[EventOut])
-async def list_events(cohort_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM events WHERE cohort_id=$1", cohort_id)
-        logger.info(f"Events listed for cohort {cohort_id}")
-        return [dict(row) for row in rows]
+async def list_events(
+    cohort_id: int,
+    request: Request,
+    response: Response,
+    start: Optional[datetime.datetime] = Query(None, description="Only events starting at or after this time."),
+    end: Optional[datetime.datetime] = Query(None, description="Only events starting before this time."),
+):
+    start, end = naive_utc(start) or datetime.datetime.min, naive_utc(end) or datetime.datetime.max
+    unchanged = await revalidate_list(request, None, EVENT_LIST_BY_COHORT_VERSION, cohort_id, start, end)
+    if unchanged:
+        logger.info(f"Events not modified for cohort {cohort_id}")
+        return unchanged
+    async with db.read() as conn:
+        rows = await EVENT_LIST_BY_COHORT.fetch(conn, cohort_id, start, end)
+    etag = rows_etag(rows)
+    if not_modified(request, etag):
+        logger.info(f"Events not modified for cohort {cohort_id}")
+        return not_modified_response(etag)
+    response.headers.update(validator_headers(etag))
+    logger.info(f"Events listed for cohort {cohort_id}")
+    return rows
 
 @app.put("/events/{event_id}", response_model=EventOut, dependencies=[role_required("admin")])
 async def update_event(event_id: int, event: EventUpdate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            UPDATE events SET cohort_id=$1, title=$2, description=$3, event_type=$4, start_time=$5, end_time=$6, location=$7, updated_at=NOW()
-            WHERE id=$8 RETURNING *
-            """,
-            event.cohort_id, event.title, event.description, event.event_type, event.start_time, event.end_time, event.location, event_id
-        )
+        row = await EVENT_UPDATE.fetchrow(conn, event.cohort_id, event.title, event.description, event.event_type, event.start_time, event.end_time, event.location, event_id)
         if not row:
             logger.warning(f"Event not found for update: {event_id}")
             raise HTTPException(status_code=404, detail="Event not found")
         logger.info(f"Event updated: {event_id}")
-        return dict(row)
+        return row
 
 @app.delete("/events/{event_id}", dependencies=[role_required("admin")])
 async def delete_event(event_id: int):
     async with db.pool.acquire() as conn:
-        await conn.execute("DELETE FROM events WHERE id=$1", event_id)
+        await EVENT_DELETE.execute(conn, event_id)
         logger.info(f"Event deleted: {event_id}")
         return {"message": "Event deleted"}
 
-class SubmissionBase(BaseModel):
-    assignment_id: int
-    user_id: int
-    file_url: str
-
-class SubmissionCreate(SubmissionBase):
-    pass
-
-class SubmissionOut(SubmissionBase):
-    id: int
-    submitted_at: datetime.datetime
-
-class GradeBase(BaseModel):
-    submission_id: int
-    grader_id: int
-    score: int
-    feedback: Optional[str] = None
-
-class GradeCreate(GradeBase):
-    pass
-
-class GradeOut(GradeBase):
-    id: int
-    graded_at: datetime.datetime
-
 # Assignment Submission Endpoints
 @app.post("/submissions", response_model=SubmissionOut)
 async def submit_assignment(submission: SubmissionCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO submissions (assignment_id, user_id, file_url)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (assignment_id, user_id) DO UPDATE SET file_url=EXCLUDED.file_url, submitted_at=NOW()
-            RETURNING *
-            """,
-            submission.assignment_id, submission.user_id, submission.file_url
-        )
-        logger.info(f"Submission created/updated: {row['id']}")
-        return dict(row)
+        row = await SUBMISSION_UPSERT.fetchrow(conn, submission.assignment_id, submission.user_id, submission.file_url)
+        logger.info(f"Submission created/updated: {row.id}")
+        return row
 
 @app.get("/submissions/{assignment_id}", response_model=List[SubmissionOut])
-async def list_submissions(assignment_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM submissions WHERE assignment_id=$1", assignment_id)
+async def list_submissions(assignment_id: int, response: Response, page: PageParams = Depends()):
+    if page.stream:
+        logger.info(f"Submissions listed for assignment {assignment_id}")
+        return await stream_json(SUBMISSION_LIST_BY_ASSIGNMENT, assignment_id, page.after, page.limit, model=SubmissionOut)
+    async with db.read() as conn:
+        if page.fast:
+            row = await SUBMISSION_LIST_BY_ASSIGNMENT_JSON.fetchrow(conn, assignment_id, page.after, page.fetch_limit)
+            logger.info(f"Submissions listed for assignment {assignment_id}")
+            return json_response(row)
+        rows = await SUBMISSION_LIST_BY_ASSIGNMENT.fetch(conn, assignment_id, page.after, page.fetch_limit)
         logger.info(f"Submissions listed for assignment {assignment_id}")
-        return [dict(row) for row in rows]
+        return page.apply(rows, response)
 
 @app.get("/submissions/user/{user_id}", response_model=List[SubmissionOut])
 async def list_user_submissions(user_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM submissions WHERE user_id=$1", user_id)
+    async with db.read() as conn:
+        rows = await SUBMISSION_LIST_BY_USER.fetch(conn, user_id)
         logger.info(f"Submissions listed for user {user_id}")
-        return [dict(row) for row in rows]
+        return rows
 
 # Grading Endpoints
 @app.post("/grades", response_model=GradeOut, dependencies=[role_required('instructor')])
 async def grade_submission(grade: GradeCreate):
     async with db.pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            INSERT INTO grades (submission_id, grader_id, score, feedback)
-            VALUES ($1, $2, $3, $4)
-            ON CONFLICT (submission_id, grader_id) DO UPDATE SET score=EXCLUDED.score, feedback=EXCLUDED.feedback, graded_at=NOW()
-            RETURNING *
-            """,
-            grade.submission_id, grade.grader_id, grade.score, grade.feedback
-        )
-        logger.info(f"Grade created/updated: {row['id']}")
-        return dict(row)
+        async with conn.transaction():
+            submission = await GRADE_LOCK_SUBMISSION.fetchrow(conn, grade.submission_id, grade.grader_id)
+            if submission is None:
+                raise HTTPException(status_code=404, detail="Submission not found")
+            if submission["claimed_by"] is not None and submission["claimed_by"] != grade.grader_id:
+                logger.warning(
+                    f"Grader {grade.grader_id} tried to grade submission {grade.submission_id} claimed by {submission['claimed_by']}"
+                )
+                raise HTTPException(status_code=409, detail="Submission is claimed by another grader")
+            if submission["graded_by"] is not None:
+                logger.warning(
+                    f"Grader {grade.grader_id} tried to grade submission {grade.submission_id} graded by {submission['graded_by']}"
+                )
+                raise HTTPException(status_code=409, detail="Submission is already graded by another grader")
+            row = await GRADE_UPSERT.fetchrow(conn, grade.submission_id, grade.grader_id, grade.score, grade.feedback)
+        logger.info(f"Grade created/updated: {row.id}")
+        return row
+
+@app.post("/grades/bulk", response_model=BulkGradeResult, dependencies=[role_required('instructor')])
+async def bulk_grade_submissions(request: Request):
+    result = BulkImport(max_errors=BULK_MAX_ERRORS)
+    try:
+        records = stream_bulk_records(request.stream(), request.headers.get("content-type", ""), GradeCreate, result)
+        async with db.pool.acquire() as conn:
+            async with conn.transaction():
+                await GRADE_STAGING_CREATE.execute(conn)
+                await conn.copy_records_to_table(
+                    "grades_staging", records=records, columns=["line", "submission_id", "grader_id", "score", "feedback"]
+                )
+                await GRADE_STAGING_LOCK.fetch(conn)
+                rejected = await GRADE_STAGING_REJECTED.fetch(conn)
+                if rejected:
+                    await GRADE_STAGING_DISCARD.execute(conn, [row["line"] for row in rejected])
+                counts = await GRADE_STAGING_MERGE.fetchrow(conn)
+    except BulkBodyError as error:
+        logger.warning(f"Rejected bulk grade body: {error}")
+        raise HTTPException(status_code=400, detail=str(error))
+    for row in rejected:
+        result.reject(row["line"], row["error"])
+    result.errors.sort(key=lambda error: error["row"])
+    logger.info(
+        f"Bulk grades: {result.received} rows, {counts['inserted']} inserted, {counts['updated']} updated, {result.rejected} rejected"
+    )
+    return {
+        "received": result.received,
+        "inserted": counts["inserted"],
+        "updated": counts["updated"],
+        "rejected": result.rejected,
+        "errors": result.errors,
+    }
 
 @app.get("/grades/{submission_id}", response_model=List[GradeOut])
 async def list_grades(submission_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM grades WHERE submission_id=$1", submission_id)
+    async with db.read() as conn:
+        rows = await GRADE_LIST_BY_SUBMISSION.fetch(conn, submission_id)
         logger.info(f"Grades listed for submission {submission_id}")
-        return [dict(row) for row in rows]
+        return rows
+
+# Grading Queue Endpoints
+@app.get("/grading/queue", response_model=List[GradingQueueItem], dependencies=[role_required('instructor')])
+async def grading_queue(cohort_id: Optional[int] = None, assignment_id: Optional[int] = None, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)):
+    async with db.pool.acquire() as conn:
+        rows = await GRADING_QUEUE.fetch(conn, cohort_id, assignment_id, limit)
+        logger.info(f"Grading queue listed: {len(rows)} ungraded (cohort {cohort_id}, assignment {assignment_id})")
+        return rows
+
+@app.post("/grading/claims", response_model=List[GradingClaim], dependencies=[role_required('instructor')])
+async def claim_submissions(claim: GradingClaimRequest):
+    async with db.pool.acquire() as conn:
+        rows = await GRADING_CLAIM.fetch(
+            conn, claim.cohort_id, claim.assignment_id, claim.batch_size, claim.grader_id, GRADING_LEASE_SECONDS
+        )
+        logger.info(f"Grader {claim.grader_id} claimed {len(rows)} submissions")
+        return rows
+
+@app.post("/grading/claims/{submission_id}/grade", response_model=GradeOut, dependencies=[role_required('instructor')])
+async def grade_claimed_submission(submission_id: int, grade: ClaimedGrade):
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            if await GRADE_LOCK_SUBMISSION.fetchrow(conn, submission_id, grade.grader_id) is None:
+                raise HTTPException(status_code=404, detail="Submission not found")
+            if not await GRADING_CLAIM_CONSUME.fetchval(conn, submission_id, grade.grader_id):
+                logger.warning(f"Grader {grade.grader_id} has no live claim on submission {submission_id}")
+                raise HTTPException(status_code=409, detail="No live claim on this submission; claim it again")
+            row = await GRADE_INSERT_IF_UNGRADED.fetchrow(conn, submission_id, grade.grader_id, grade.score, grade.feedback)
+            if not row:
+                raise HTTPException(status_code=409, detail="Submission is already graded")
+        logger.info(f"Claimed submission {submission_id} graded by {grade.grader_id}")
+        return row
+
+@app.delete("/grading/claims/{submission_id}", dependencies=[role_required('instructor')])
+async def release_claim(submission_id: int, grader_id: int):
+    async with db.pool.acquire() as conn:
+        await GRADING_CLAIM_RELEASE.execute(conn, submission_id, grader_id)
+        logger.info(f"Grader {grader_id} released submission {submission_id}")
+        return {"message": "Claim released"}
 
 # Instructor Dashboard Endpoint
 @app.get("/instructor/assignments/{instructor_id}", response_model=List[SubmissionOut], dependencies=[role_required('instructor')])
 async def instructor_assignments(instructor_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch(
-            """
-            SELECT s.* FROM submissions s
-            JOIN grades g ON s.id = g.submission_id
-            WHERE g.grader_id = $1
-            """,
-            instructor_id
-        )
+    async with db.read() as conn:
+        rows = await GRADED_SUBMISSIONS_BY_GRADER.fetch(conn, instructor_id)
         logger.info(f"Assignments to grade listed for instructor {instructor_id}")
-        return [dict(row) for row in rows]
+        return rows
 
 # Student Dashboard Endpoint
 @app.get("/student/assignments/{user_id}", response_model=List[SubmissionOut])
 async def student_assignments(user_id: int):
-    async with db.pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM submissions WHERE user_id=$1", user_id)
+    async with db.read() as conn:
+        rows = await SUBMISSION_LIST_BY_USER.fetch(conn, user_id)
         logger.info(f"Assignments listed for student {user_id}")
-        return [dict(row) for row in rows] 
\ No newline at end of file
+        return rows 
+
+@app.get("/student/dashboard/{user_id}", response_model=StudentDashboard)
+async def student_dashboard(user_id: int):
+    async with db.read() as conn:
+        items = await STUDENT_DASHBOARD.fetch(conn, user_id)
+    counts = DashboardCounts()
+    for item in items:
+        setattr(counts, item.status, getattr(counts, item.status) + 1)
+    logger.info(f"Dashboard built for student {user_id}")
+    return StudentDashboard(user_id=user_id, counts=counts, items=items)
@@ -0,0 +1,31 @@
+"""
+Markdown to sanitized HTML, plus the compressed variants served to clients.
+
+Runs in the lesson renderer's worker processes (see app/lesson_content.py),
+so it imports nothing from the app: no logger, no database, no settings.
+"""
+import gzip
+import hashlib
+
+import brotli
+import nh3
+from markdown_it import MarkdownIt
+
+# Bump when the output changes (parser options, sanitizer rules), so stored
+# renders are redone instead of reused.
+RENDERER_VERSION = "md1"
+
+# Raw HTML in lessons is allowed through the parser and cleaned by nh3 afterwards
+_markdown = MarkdownIt("commonmark", {"html": True}).enable(["table", "strikethrough"])
+
+
+def content_hash(markdown: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}\n{markdown}".encode()).hexdigest()
+
+
+def render(markdown: str):
+    """Returns (html, gzip bytes, brotli bytes)."""
+    html = nh3.clean(_markdown.render(markdown), link_rel="noopener noreferrer")
+    data = html.encode()
+    # mtime=0 keeps the gzip bytes a pure function of the content
+    return html, gzip.compress(data, compresslevel=9, mtime=0), brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
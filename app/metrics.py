@@ -0,0 +1,160 @@
+"""
+Small in-process metric types shared by the pool and request instrumentation.
+
+Request-scoped database time is collected through a context variable: the
+HTTP middleware opens a RequestTiming, and every named query and pool
+acquire made while serving that request adds to it. Everything is rendered
+in the Prometheus text format for /metrics.
+"""
+import contextvars
+import math
+
+# Upper bounds in milliseconds; the last bucket is open-ended.
+DEFAULT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram of durations, in milliseconds."""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for index, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self):
+        """(upper bound, count of observations <= bound) pairs, ending with +Inf."""
+        running = 0
+        pairs = []
+        for bound, count in zip(self.buckets_ms + (float("inf"),), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "buckets_ms": {("+Inf" if bound == float("inf") else str(bound)): count for bound, count in self.cumulative()},
+        }
+
+
+class RequestTiming:
+    """Database work attributed to one HTTP request."""
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.acquire_seconds = 0.0
+        self.queries = []
+
+    def add_query(self, name, seconds):
+        self.db_seconds += seconds
+        self.queries.append((name, seconds))
+
+    def breakdown(self):
+        """Per-query call counts and total milliseconds, slowest first."""
+        totals = {}
+        for name, seconds in self.queries:
+            calls, total = totals.get(name, (0, 0.0))
+            totals[name] = (calls + 1, total + seconds)
+        ordered = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+        return ", ".join(f"{name} x{calls} {total * 1000:.1f}ms" for name, (calls, total) in ordered)
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def record_query(name, seconds):
+    timing = current_request.get()
+    if timing is not None:
+        timing.add_query(name, seconds)
+
+
+def record_acquire(seconds):
+    timing = current_request.get()
+    if timing is not None:
+        timing.acquire_seconds += seconds
+
+
+class RouteMetrics:
+    """Latency, DB time and query counts per (method, route template, status)."""
+
+    def __init__(self):
+        self.latency = {}
+        self.db_time = {}
+        self.db_queries = {}
+
+    def observe(self, method, route, status, seconds, timing):
+        key = (method, route, str(status))
+        self.latency.setdefault(key, Histogram()).observe(seconds)
+        self.db_time.setdefault(key, Histogram()).observe(timing.db_seconds)
+        self.db_queries[key] = self.db_queries.get(key, 0) + len(timing.queries)
+
+
+route_metrics = RouteMetrics()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusText:
+    """Collects metric families and renders the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._families = {}
+
+    def _family(self, name, kind, help_text):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = {"type": kind, "help": help_text, "samples": []}
+        return family["samples"]
+
+    def gauge(self, name, help_text, value, **labels):
+        self._family(name, "gauge", help_text).append((name, labels, value))
+
+    def counter(self, name, help_text, value, **labels):
+        self._family(name, "counter", help_text).append((name, labels, value))
+
+    def histogram(self, name, help_text, histogram, **labels):
+        """Add a millisecond Histogram, exported in seconds."""
+        samples = self._family(name, "histogram", help_text)
+        for bound, count in histogram.cumulative():
+            le = "+Inf" if bound == math.inf else _format_value(bound / 1000)
+            samples.append((f"{name}_bucket", {**labels, "le": le}, count))
+        samples.append((f"{name}_sum", labels, histogram.total_ms / 1000))
+        samples.append((f"{name}_count", labels, histogram.count))
+
+    def render(self):
+        lines = []
+        for name, family in self._families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for sample, labels, value in family["samples"]:
+                lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
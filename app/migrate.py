@@ -0,0 +1,159 @@
+"""
+Versioned schema migrations.
+
+Migration files live in app/migrations and are named `NNNN_description.sql`.
+They are applied in version order and recorded in `schema_migrations` with a
+SHA-256 checksum, and editing a file after it has been applied is an error.
+Each file runs in one transaction unless its first line is
+`-- migrate:no-transaction`. That marker is required for
+CREATE INDEX CONCURRENTLY. Such files are split on `;` and run statement by
+statement, so they cannot contain dollar-quoted bodies (DO blocks,
+functions); put those in a transactional file. They must be idempotent
+(IF NOT EXISTS), because a failure part-way through leaves the earlier
+statements applied. A failed CREATE INDEX CONCURRENTLY leaves an INVALID
+index behind that IF NOT EXISTS would skip, so the runner drops it before
+retrying.
+"""
+import asyncio
+import hashlib
+import re
+from pathlib import Path
+
+import asyncpg
+
+from app.app_logging import app_logger as logger
+from app.db import DATABASE_URL
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+# Arbitrary advisory lock key so concurrent deploys apply migrations once.
+MIGRATION_LOCK_KEY = 74_230_001
+MIGRATION_LOCK_POLL_SECONDS = 1.0
+
+TRACKING_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT NOW()
+);
+"""
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+_DOLLAR_QUOTE = re.compile(r"\$\w*\$")
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, path: Path):
+        match = _FILENAME.match(path.name)
+        if not match:
+            raise MigrationError(f"Bad migration filename: {path.name}")
+        self.version = int(match.group(1))
+        self.name = match.group(2)
+        self.sql = path.read_text()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self):
+        if _DOLLAR_QUOTE.search(self.sql):
+            raise MigrationError(
+                f"Migration {self.version}_{self.name} uses dollar quoting, which "
+                f"{NO_TRANSACTION_MARKER} files do not support."
+            )
+        chunks = re.split(r";\s*(?:\n|$)", self.sql)
+        statements = []
+        for chunk in chunks:
+            code = "\n".join(line for line in chunk.splitlines() if not line.strip().startswith("--")).strip()
+            if code:
+                statements.append(code)
+        return statements
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = sorted((Migration(path) for path in Path(directory).glob("*.sql")), key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError("Duplicate migration version numbers.")
+    return migrations
+
+
+async def migrate(conn, directory=MIGRATIONS_DIR):
+    """Apply pending migrations on `conn`. Returns the versions applied."""
+    migrations = load_migrations(directory)
+    await conn.execute(TRACKING_TABLE_DDL)
+    await _acquire_lock(conn)
+    try:
+        applied = {
+            row["version"]: row["checksum"]
+            for row in await conn.fetch("SELECT version, checksum FROM schema_migrations")
+        }
+        newly_applied = []
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    raise MigrationError(
+                        f"Migration {migration.version}_{migration.name} was modified after it was applied."
+                    )
+                continue
+            logger.info(f"Applying migration {migration.version}_{migration.name}")
+            if migration.transactional:
+                async with conn.transaction():
+                    await conn.execute(migration.sql)
+                    await _record(conn, migration)
+            else:
+                for statement in migration.statements():
+                    await _drop_invalid_index(conn, statement)
+                    await conn.execute(statement)
+                await _record(conn, migration)
+            newly_applied.append(migration.version)
+        return newly_applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def _acquire_lock(conn):
+    # Waiting in pg_advisory_lock keeps a statement open, and CREATE INDEX
+    # CONCURRENTLY in the runner holding the lock would wait for it forever.
+    # Poll with the non-blocking variant instead.
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_KEY):
+        logger.info("Another process is applying migrations; waiting.")
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+
+async def _drop_invalid_index(conn, statement):
+    match = _CONCURRENT_INDEX.search(statement)
+    if not match:
+        return
+    index = match.group(1)
+    invalid = await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", index
+    )
+    if invalid:
+        logger.warning(f"Dropping invalid index {index} left by an earlier failed build")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+async def _record(conn, migration):
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+        migration.version, migration.name, migration.checksum
+    )
+
+
+async def main():
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        applied = await migrate(conn)
+        logger.info(f"Applied {len(applied)} migration(s)." if applied else "Database schema is up to date.")
+    finally:
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,19 @@
+-- migrate:no-transaction
+-- Secondary indexes for the hot lookup paths; built CONCURRENTLY so live
+-- databases keep taking writes while they are created.
+
+-- verify_login_code: email/code lookup over unused codes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_codes_email_code_unused_idx
+    ON auth_codes (email, code, expires_at) WHERE used = FALSE;
+
+-- list_events
+CREATE INDEX CONCURRENTLY IF NOT EXISTS events_cohort_id_idx ON events (cohort_id);
+
+-- list_user_submissions, student_assignments
+CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_user_id_idx ON submissions (user_id);
+
+-- instructor_assignments
+CREATE INDEX CONCURRENTLY IF NOT EXISTS grades_grader_id_idx ON grades (grader_id);
+
+-- list_enrollments (the unique key leads with user_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS enrollments_cohort_id_idx ON enrollments (cohort_id);
@@ -0,0 +1,9 @@
+-- migrate:no-transaction
+-- Indexes behind the single-query curriculum tree (get_curriculum_tree).
+
+-- Lessons of a curriculum, already in display order
+CREATE INDEX CONCURRENTLY IF NOT EXISTS lessons_curriculum_order_idx
+    ON lessons (curriculum_id, order_index, id);
+
+-- Assignments of a lesson
+CREATE INDEX CONCURRENTLY IF NOT EXISTS assignments_lesson_id_idx ON assignments (lesson_id, id);
@@ -0,0 +1,201 @@
+-- Per-student rollup behind GET /student/dashboard/{user_id}.
+--
+-- One row per (student, assignment) the student is responsible for: every
+-- assignment in the curricula of the cohorts they are enrolled in, plus any
+-- assignment they have submitted. Triggers on the source tables refresh only
+-- the affected rows, in the writing transaction, so the dashboard is a
+-- single primary-key range read. 'overdue' is derived at read time from
+-- due_date, since it changes without any write.
+
+CREATE TABLE IF NOT EXISTS student_assignment_status (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    assignment_id INTEGER NOT NULL REFERENCES assignments(id) ON DELETE CASCADE,
+    lesson_id INTEGER,
+    title TEXT NOT NULL,
+    due_date TIMESTAMP,
+    max_score INTEGER,
+    status TEXT NOT NULL, -- 'pending', 'submitted', 'graded'
+    submission_id INTEGER,
+    submitted_at TIMESTAMP,
+    score INTEGER,
+    feedback TEXT,
+    graded_at TIMESTAMP,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, assignment_id)
+);
+
+-- Recompute one student's rows, or just one assignment's row when given.
+-- Rows are upserted and only the ones that no longer qualify are deleted.
+-- The advisory lock serializes refreshes of one student, so two writes
+-- landing together (a submission and its grade) cannot both insert the
+-- same row, and multi-row upserts cannot deadlock on each other.
+CREATE OR REPLACE FUNCTION refresh_student_assignment_status(p_user_id INTEGER, p_assignment_id INTEGER DEFAULT NULL)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('student_assignment_status'), p_user_id);
+
+    INSERT INTO student_assignment_status (
+        user_id, assignment_id, lesson_id, title, due_date, max_score, status,
+        submission_id, submitted_at, score, feedback, graded_at
+    )
+    SELECT
+        p_user_id, a.id, a.lesson_id, a.title, a.due_date, a.max_score,
+        CASE WHEN g.id IS NOT NULL THEN 'graded' WHEN s.id IS NOT NULL THEN 'submitted' ELSE 'pending' END,
+        s.id, s.submitted_at, g.score, g.feedback, g.graded_at
+    FROM assignments a
+    LEFT JOIN submissions s ON s.assignment_id = a.id AND s.user_id = p_user_id
+    LEFT JOIN LATERAL (
+        SELECT id, score, feedback, graded_at FROM grades
+        WHERE submission_id = s.id ORDER BY graded_at DESC LIMIT 1
+    ) g ON TRUE
+    WHERE (p_assignment_id IS NULL OR a.id = p_assignment_id)
+      AND (
+        s.id IS NOT NULL
+        OR EXISTS (
+            SELECT 1 FROM enrollments e
+            JOIN curriculum c ON c.cohort_id = e.cohort_id
+            JOIN lessons l ON l.curriculum_id = c.id
+            WHERE e.user_id = p_user_id AND l.id = a.lesson_id
+        )
+      )
+    ON CONFLICT (user_id, assignment_id) DO UPDATE SET
+        lesson_id = EXCLUDED.lesson_id, title = EXCLUDED.title, due_date = EXCLUDED.due_date,
+        max_score = EXCLUDED.max_score, status = EXCLUDED.status, submission_id = EXCLUDED.submission_id,
+        submitted_at = EXCLUDED.submitted_at, score = EXCLUDED.score, feedback = EXCLUDED.feedback,
+        graded_at = EXCLUDED.graded_at, refreshed_at = NOW();
+
+    DELETE FROM student_assignment_status sas
+    WHERE sas.user_id = p_user_id AND (p_assignment_id IS NULL OR sas.assignment_id = p_assignment_id)
+      AND NOT EXISTS (SELECT 1 FROM submissions s WHERE s.assignment_id = sas.assignment_id AND s.user_id = p_user_id)
+      AND NOT EXISTS (
+        SELECT 1 FROM assignments a
+        JOIN lessons l ON l.id = a.lesson_id
+        JOIN curriculum c ON c.id = l.curriculum_id
+        JOIN enrollments e ON e.cohort_id = c.cohort_id
+        WHERE a.id = sas.assignment_id AND e.user_id = p_user_id
+      );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Everyone who might have a row for an assignment: its submitters and the
+-- students enrolled in the cohort its curriculum belongs to.
+CREATE OR REPLACE FUNCTION refresh_assignment_students(p_assignment_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM refresh_student_assignment_status(user_id, p_assignment_id)
+    FROM (
+        SELECT user_id FROM student_assignment_status WHERE assignment_id = p_assignment_id
+        UNION
+        SELECT s.user_id FROM submissions s WHERE s.assignment_id = p_assignment_id
+        UNION
+        SELECT e.user_id FROM assignments a
+        JOIN lessons l ON l.id = a.lesson_id
+        JOIN curriculum c ON c.id = l.curriculum_id
+        JOIN enrollments e ON e.cohort_id = c.cohort_id
+        WHERE a.id = p_assignment_id
+    ) affected;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_cohort_students(p_cohort_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM refresh_student_assignment_status(user_id)
+    FROM enrollments WHERE cohort_id = p_cohort_id;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_status_on_submission() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_student_assignment_status(OLD.user_id, OLD.assignment_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_student_assignment_status(NEW.user_id, NEW.assignment_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_status_on_grade() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_student_assignment_status(s.user_id, s.assignment_id)
+    FROM submissions s
+    WHERE s.id IN (
+        CASE WHEN TG_OP <> 'INSERT' THEN OLD.submission_id END,
+        CASE WHEN TG_OP <> 'DELETE' THEN NEW.submission_id END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_status_on_enrollment() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_student_assignment_status(OLD.user_id);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_student_assignment_status(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_status_on_assignment() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- Rows go with the assignment (ON DELETE CASCADE)
+        RETURN NULL;
+    END IF;
+    PERFORM refresh_assignment_students(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A lesson moving between curricula, or a curriculum between cohorts,
+-- changes which students own its assignments.
+CREATE OR REPLACE FUNCTION student_status_on_lesson() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_assignment_students(a.id) FROM assignments a WHERE a.lesson_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_status_on_curriculum() RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.cohort_id IS NOT NULL THEN
+        PERFORM refresh_cohort_students(OLD.cohort_id);
+    END IF;
+    IF NEW.cohort_id IS NOT NULL AND NEW.cohort_id IS DISTINCT FROM OLD.cohort_id THEN
+        PERFORM refresh_cohort_students(NEW.cohort_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS student_status_submissions ON submissions;
+CREATE TRIGGER student_status_submissions AFTER INSERT OR UPDATE OR DELETE ON submissions
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_submission();
+
+DROP TRIGGER IF EXISTS student_status_grades ON grades;
+CREATE TRIGGER student_status_grades AFTER INSERT OR UPDATE OR DELETE ON grades
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_grade();
+
+DROP TRIGGER IF EXISTS student_status_enrollments ON enrollments;
+CREATE TRIGGER student_status_enrollments AFTER INSERT OR UPDATE OR DELETE ON enrollments
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_enrollment();
+
+DROP TRIGGER IF EXISTS student_status_assignments ON assignments;
+CREATE TRIGGER student_status_assignments AFTER INSERT OR UPDATE ON assignments
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_assignment();
+
+DROP TRIGGER IF EXISTS student_status_lessons ON lessons;
+CREATE TRIGGER student_status_lessons AFTER UPDATE OF curriculum_id ON lessons
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_lesson();
+
+DROP TRIGGER IF EXISTS student_status_curriculum ON curriculum;
+CREATE TRIGGER student_status_curriculum AFTER UPDATE OF cohort_id ON curriculum
+    FOR EACH ROW EXECUTE FUNCTION student_status_on_curriculum();
+
+-- Backfill
+SELECT refresh_student_assignment_status(id) FROM users;
@@ -0,0 +1,14 @@
+-- Grading queue: short leases on ungraded submissions so several graders
+-- can work one cohort without colliding. A claim is live while
+-- expires_at > NOW(); an expired one can be taken over by the next claimer.
+
+CREATE TABLE IF NOT EXISTS grading_claims (
+    submission_id INTEGER PRIMARY KEY REFERENCES submissions(id) ON DELETE CASCADE,
+    grader_id INTEGER NOT NULL REFERENCES users(id),
+    claimed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS grading_claims_grader_idx ON grading_claims (grader_id);
+
+-- The queue's submissions index is built concurrently in 0012.
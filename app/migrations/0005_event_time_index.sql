@@ -0,0 +1,7 @@
+-- migrate:no-transaction
+-- list_events time-range filter and the calendar feed: a cohort's events in
+-- start_time order come straight off this index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS events_cohort_start_idx ON events (cohort_id, start_time, id);
+
+-- Covered by the leading column of events_cohort_start_idx
+DROP INDEX CONCURRENTLY IF EXISTS events_cohort_id_idx;
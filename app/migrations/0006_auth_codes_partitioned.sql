@@ -0,0 +1,94 @@
+-- auth_codes becomes range-partitioned by expires_at, one partition per UTC
+-- day, so days whose codes have all expired are dropped whole instead of
+-- deleted row by row. The sweeper (app/auth_codes.py) keeps partitions
+-- created ahead of time and drops old ones; the default partition only
+-- catches rows if it falls behind. Codes that are already used or expired
+-- are not carried over.
+
+ALTER TABLE auth_codes RENAME TO auth_codes_legacy;
+
+-- The partition key must be part of the primary key
+CREATE TABLE auth_codes (
+    id INTEGER NOT NULL DEFAULT nextval('auth_codes_id_seq'),
+    email TEXT NOT NULL,
+    code TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    used BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (id, expires_at)
+) PARTITION BY RANGE (expires_at);
+
+ALTER SEQUENCE auth_codes_id_seq OWNED BY auth_codes.id;
+
+CREATE TABLE auth_codes_default PARTITION OF auth_codes DEFAULT;
+
+-- Partitions from today through p_days_ahead days from now (UTC).
+-- Returns how many were created. Postgres refuses a new partition while the
+-- default partition holds rows in its range, which happens once a sweep is
+-- missed, so each day is built as a plain table, those rows are moved into
+-- it, and it is attached.
+CREATE OR REPLACE FUNCTION ensure_auth_code_partitions(p_days_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER AS $$
+DECLARE
+    today DATE := (NOW() AT TIME ZONE 'UTC')::date;
+    day DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    -- Several workers run the sweeper
+    PERFORM pg_advisory_xact_lock(hashtext('auth_codes_partitions'));
+    FOR day IN SELECT generate_series(today, today + p_days_ahead, INTERVAL '1 day')::date LOOP
+        partition_name := 'auth_codes_' || to_char(day, 'YYYYMMDD');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE auth_codes INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM auth_codes_default WHERE expires_at >= %L AND expires_at < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                day::timestamp, (day + 1)::timestamp, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE auth_codes ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, day::timestamp, (day + 1)::timestamp
+            );
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop day partitions whose codes have all expired (the day ended before
+-- today, UTC). Returns how many were dropped.
+CREATE OR REPLACE FUNCTION drop_expired_auth_code_partitions()
+RETURNS INTEGER AS $$
+DECLARE
+    today DATE := (NOW() AT TIME ZONE 'UTC')::date;
+    partition_name TEXT;
+    dropped INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('auth_codes_partitions'));
+    FOR partition_name IN
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'auth_codes'::regclass
+          AND c.relname ~ '^auth_codes_[0-9]{8}$'
+          AND to_date(right(c.relname, 8), 'YYYYMMDD') < today
+    LOOP
+        EXECUTE format('DROP TABLE %I', partition_name);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_auth_code_partitions();
+
+INSERT INTO auth_codes (id, email, code, expires_at, used, created_at)
+SELECT id, email, code, expires_at, used, created_at FROM auth_codes_legacy
+WHERE used = FALSE AND expires_at > NOW();
+
+DROP TABLE auth_codes_legacy;
+
+-- verify_login_code: email/code lookup over unused codes, per partition
+CREATE INDEX IF NOT EXISTS auth_codes_email_code_unused_idx
+    ON auth_codes (email, code, expires_at) WHERE used = FALSE;
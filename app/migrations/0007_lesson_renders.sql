@@ -0,0 +1,24 @@
+-- Lesson markdown rendered to sanitized HTML once per distinct content, with
+-- gzip and brotli variants stored beside it (app/lesson_content.py). Lessons
+-- keep a copy of the HTML so JSON reads need no join; the compressed
+-- variants are read only by GET /lessons/{id}/content. Existing lessons are
+-- rendered by the renderer's startup backfill.
+
+CREATE TABLE IF NOT EXISTS lesson_renders (
+    content_hash TEXT PRIMARY KEY, -- sha256 of the renderer version and markdown
+    renderer TEXT NOT NULL,
+    html TEXT NOT NULL,
+    html_gzip BYTEA NOT NULL,
+    html_br BYTEA NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Already compressed; don't let TOAST try again
+ALTER TABLE lesson_renders ALTER COLUMN html_gzip SET STORAGE EXTERNAL;
+ALTER TABLE lesson_renders ALTER COLUMN html_br SET STORAGE EXTERNAL;
+
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS content_html TEXT;
+
+-- For the prune's "still referenced" check
+CREATE INDEX IF NOT EXISTS lessons_content_hash_idx ON lessons (content_hash);
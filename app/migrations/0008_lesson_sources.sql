@@ -0,0 +1,10 @@
+-- Lessons synced from a markdown vault (app/vault_sync.py) remember the
+-- file they came from and its sha256, so a re-sync only writes lessons
+-- whose file changed and deletes those whose file is gone. Lessons created
+-- through the API have no source_path.
+
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS source_path TEXT;
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS source_hash TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS lessons_curriculum_source_path_idx
+    ON lessons (curriculum_id, source_path) WHERE source_path IS NOT NULL;
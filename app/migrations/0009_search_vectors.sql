@@ -0,0 +1,20 @@
+-- Full-text search (GET /search). Each searchable table gets a generated
+-- tsvector, so Postgres keeps it current on every insert and update: the
+-- title weighted A, the body weighted B. Adding a stored generated column
+-- rewrites the table; on a large install run this in a quiet window.
+-- The GIN indexes are built concurrently in 0010.
+
+ALTER TABLE curriculum ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+) STORED;
+
+ALTER TABLE lessons ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(content_markdown, '')), 'B')
+) STORED;
+
+ALTER TABLE assignments ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+) STORED;
@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- GIN indexes over the search vectors added in 0009.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS curriculum_search_idx ON curriculum USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS lessons_search_idx ON lessons USING GIN (search_vector);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS assignments_search_idx ON assignments USING GIN (search_vector);
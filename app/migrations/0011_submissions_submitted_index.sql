@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Grading queue and claims without an assignment scope: walk submissions
+-- oldest first and stop once LIMIT ungraded ones are found, instead of
+-- anti-joining and sorting every submission.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_submitted_idx ON submissions (submitted_at, id);
@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Grading queue order within an assignment (0004); the ungraded anti-join
+-- probes the grades (submission_id, grader_id) unique index. Built
+-- concurrently so submits are not blocked while it builds.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS submissions_assignment_submitted_idx ON submissions (assignment_id, submitted_at, id);
@@ -0,0 +1,6 @@
+-- Login-code emails carry the code in their body. Bodies are cleared once
+-- a message is sent or given up on (app/email_outbox.py), so the outbox
+-- keeps who was mailed and when, but no usable codes.
+ALTER TABLE email_outbox ALTER COLUMN html_content DROP NOT NULL;
+
+UPDATE email_outbox SET html_content = NULL WHERE status <> 'pending' AND html_content IS NOT NULL;
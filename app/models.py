@@ -79,6 +79,23 @@ CREATE TABLE IF NOT EXISTS grades (
 );
 """
 
+EMAIL_OUTBOX_DDL = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id SERIAL PRIMARY KEY,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html_content TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sent', 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP DEFAULT NOW(),
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS email_outbox_pending_idx ON email_outbox (next_attempt_at) WHERE status = 'pending';
+"""
+
 USER_TABLE_DDL = """
 CREATE TABLE IF NOT EXISTS roles (
     id SERIAL PRIMARY KEY,
@@ -109,4 +126,4 @@ CREATE TABLE IF NOT EXISTS auth_codes (
     used BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT NOW()
 );
-""" + CURRICULUM_TABLE_DDL + SCHEDULING_TABLE_DDL + ASSIGNMENT_SUBMISSION_DDL 
\ No newline at end of file
+""" + CURRICULUM_TABLE_DDL + SCHEDULING_TABLE_DDL + ASSIGNMENT_SUBMISSION_DDL + EMAIL_OUTBOX_DDL 
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Keyset pagination on `id` and streamed JSON arrays for the list endpoints.
+
+List queries take the cursor and page size as their last two parameters,
+e.g. `... WHERE id > $1 ORDER BY id LIMIT $2`. A NULL limit means no limit,
+so the same statement serves paged, unpaged and streamed requests.
+
+With FAST_JSON_LISTS=true, non-streamed pages come from each list query's
+`json_page` variant instead: Postgres renders the JSON array and the
+response body is sent as returned, skipping per-row model validation and
+serialization in Python.
+"""
+import os
+from contextlib import aclosing
+from typing import Optional
+
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+
+from app.db import db
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+STREAM_PREFETCH = int(os.getenv("STREAM_PREFETCH", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+FAST_JSON_LISTS = os.getenv("FAST_JSON_LISTS", "false").lower() == "true"
+
+
+class PageParams:
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for all rows."),
+        after: int = Query(0, ge=0, description="Return rows with id greater than this cursor."),
+        stream: bool = Query(False, description="Stream rows from a server-side cursor."),
+    ):
+        self.limit = limit
+        self.after = after
+        self.stream = stream
+
+    @property
+    def fetch_limit(self):
+        # One extra row tells us whether another page exists.
+        return self.limit + 1 if self.limit is not None else None
+
+    @property
+    def fast(self):
+        return FAST_JSON_LISTS and not self.stream
+
+    def cache_key(self, namespace):
+        """Cache key for this page, or None for unbounded requests, which are not cached."""
+        if self.limit is None:
+            return None
+        return f"{namespace}:list{'-json' if self.fast else ''}:{self.after}:{self.limit}"
+
+    def apply(self, rows, response: Response):
+        """Trim the look-ahead row and advertise the next cursor, if any."""
+        if self.limit is not None and len(rows) > self.limit:
+            rows = rows[:self.limit]
+            response.headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
+        return rows
+
+
+def json_response(row, etag=None):
+    """Response for a row from a `json_page` query, with the next cursor and ETag if any."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+    if row["next_cursor"] is not None:
+        headers[NEXT_CURSOR_HEADER] = str(row["next_cursor"])
+    return Response(content=row["body"], media_type="application/json", headers=headers)
+
+
+class ConnectionStream(StreamingResponse):
+    """A streamed response whose body reads from a connection acquired up front.
+
+    The connection is taken before the response is returned, so a pool
+    acquire timeout still reaches the 503 handler rather than failing after
+    the headers are sent. It is released when the body is exhausted, or when
+    the response ends early because the client went away.
+    """
+
+    def __init__(self, lease, body, **kwargs):
+        self._lease = lease
+        super().__init__(self._stream(body), **kwargs)
+
+    async def _stream(self, body):
+        try:
+            async with aclosing(body(self._lease.conn)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            await self._release()
+
+    async def _release(self):
+        if self._lease.conn is not None:
+            await self._lease.__aexit__(None, None, None)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # A body that never started has no finally of its own to run
+            await self.body_iterator.aclose()
+            await self._release()
+
+
+async def connection_stream(body, **kwargs):
+    """A ConnectionStream over a read connection; `body(conn)` yields the chunks."""
+    lease = db.read()
+    await lease.__aenter__()
+    return ConnectionStream(lease, body, **kwargs)
+
+
+async def stream_json(query, *args, model):
+    """Stream a named query's rows as a JSON array, validating each row against `model`.
+
+    Rows are read through a server-side cursor in batches of STREAM_PREFETCH,
+    so memory stays flat regardless of table size. The pool connection is
+    held until the client has received the last row.
+    """
+    async def body(conn):
+        async with conn.transaction():
+            yield b"["
+            chunk = []
+            separator = b""
+            async for record in query.cursor(conn, *args, prefetch=STREAM_PREFETCH):
+                chunk.append(separator + model.model_validate(dict(record)).model_dump_json().encode())
+                separator = b","
+                if len(chunk) >= STREAM_PREFETCH:
+                    yield b"".join(chunk)
+                    chunk = []
+            if chunk:
+                yield b"".join(chunk)
+            yield b"]"
+    return await connection_stream(body, media_type="application/json")
@@ -0,0 +1,737 @@
+"""
+Named SQL statements used by the API.
+
+Every statement is declared here once and run through asyncpg's per-connection
+statement cache, which outlives pool acquire/release, so each connection
+parses and plans a statement once and reuses it afterwards. The pool sizes
+that cache to hold the whole registry. Statements declared `hot=True` are
+prepared into that cache when a connection opens (QueryRegistry.prepare_hot,
+unless DB_PREPARE_HOT=false); the rest are prepared on first use. Rows
+decode into the `*Out` response models without re-validating what Postgres
+already typed. Each call is timed
+for the per-query stats at /queries/stats and attributed to the current
+request for /metrics.
+
+In pgbouncer mode the statement cache is off and every call is parsed again.
+"""
+import re
+import time
+
+from app.metrics import record_query
+from app.schemas import (
+    AssignmentOut,
+    CohortOut,
+    CurriculumOut,
+    DashboardItem,
+    EnrollmentOut,
+    EventOut,
+    GradeOut,
+    GradingClaim,
+    GradingQueueItem,
+    LessonOut,
+    SubmissionOut,
+)
+
+
+def as_model(model):
+    """Decode rows into `model` without re-validating values Postgres already typed."""
+    return lambda record: model.model_construct(**record)
+
+
+class NamedQuery:
+    # {name: arguments} of the first successful run of each statement while
+    # QueryRegistry.start_capture() is in effect; see tests/test_query_plans.py
+    captured = None
+
+    def __init__(self, name, sql, decode=dict, hot=False):
+        self.name = name
+        self.sql = sql
+        # Applied to every row returned by fetch/fetchrow.
+        self.decode = decode
+        # Prepared on every new connection rather than on first use.
+        self.hot = hot
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def _run(self, conn, method, *args):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await getattr(conn, method)(self.sql, *args)
+            failed = False
+            if NamedQuery.captured is not None and self.name not in NamedQuery.captured:
+                # executemany's one argument is the list of argument tuples
+                sample = args if method != "executemany" else tuple(next(iter(args[0]), ()))
+                NamedQuery.captured[self.name] = sample
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            self.calls += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            record_query(self.name, elapsed)
+            if failed:
+                self.errors += 1
+
+    async def fetch(self, conn, *args):
+        rows = await self._run(conn, "fetch", *args)
+        return [self.decode(row) for row in rows]
+
+    async def fetchrow(self, conn, *args):
+        row = await self._run(conn, "fetchrow", *args)
+        return self.decode(row) if row is not None else None
+
+    async def fetchval(self, conn, *args):
+        return await self._run(conn, "fetchval", *args)
+
+    async def execute(self, conn, *args):
+        return await self._run(conn, "execute", *args)
+
+    async def executemany(self, conn, args):
+        return await self._run(conn, "executemany", args)
+
+    def cursor(self, conn, *args, prefetch=None):
+        """Server-side cursor over the statement; iterate it inside a transaction."""
+        self.calls += 1
+        if NamedQuery.captured is not None:
+            NamedQuery.captured.setdefault(self.name, args)
+        return conn.cursor(self.sql, *args, prefetch=prefetch)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "avg_ms": round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+        }
+
+
+class QueryRegistry:
+    def __init__(self):
+        self.queries = {}
+
+    def register(self, name, sql, decode=dict, hot=False):
+        if name in self.queries:
+            raise ValueError(f"Query already registered: {name}")
+        query = NamedQuery(name, sql, decode=decode, hot=hot)
+        self.queries[name] = query
+        return query
+
+    async def prepare_hot(self, conn):
+        """Prepare every hot statement into `conn`'s statement cache; returns how many.
+
+        Connection.prepare() returns a PreparedStatement outside that cache,
+        which fetch() and friends never consult and which is invalid once the
+        connection goes back to the pool, so this fills the cache the way
+        fetch() itself does.
+        """
+        hot = [query for query in self.queries.values() if query.hot]
+        for query in hot:
+            await conn._get_statement(query.sql, None)
+        # Parse/Describe are sent without a Sync, which leaves the implicit
+        # transaction they opened waiting (and holding back CREATE INDEX
+        # CONCURRENTLY) until the next message; a simple query closes it.
+        await conn.execute("SELECT 1")
+        return len(hot)
+
+    def stats(self):
+        return {name: query.stats() for name, query in sorted(self.queries.items())}
+
+    def start_capture(self):
+        """Record the arguments each statement first runs with, until stop_capture()."""
+        NamedQuery.captured = {}
+
+    def stop_capture(self):
+        captured, NamedQuery.captured = NamedQuery.captured or {}, None
+        return captured
+
+registry = QueryRegistry()
+query = registry.register
+
+
+def columns(model):
+    """Select list naming `model`'s fields, for tables that also hold columns no response needs."""
+    return ", ".join(model.model_fields)
+
+
+def json_fields(model, alias=None):
+    """`json_build_object` arguments for every field of `model`."""
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(f"'{field}', {prefix}{field}" for field in model.model_fields)
+
+
+# md5 over "id@updated_at" (microseconds since the epoch, 0 for NULL) of
+# every row, in id order; http_cache.rows_etag computes the same digest in Python.
+VERSION_HASH = """md5(COALESCE(string_agg(
+    id || '@' || COALESCE((extract(epoch FROM updated_at) * 1000000)::bigint, 0), ',' ORDER BY id), ''))"""
+
+
+def version_query(list_query):
+    """Register a variant of a list query that returns only the VERSION_HASH of its rows."""
+    return query(f"{list_query.name}_version", f"SELECT {VERSION_HASH} AS version FROM ({list_query.sql}) page")
+
+
+def json_page(list_query, model, versioned=False):
+    """Register a variant of a keyset list query that returns the page as JSON text.
+
+    Postgres builds the array with json_agg over `model`'s fields, so the API
+    can send the bytes as they are. The list query fetches one look-ahead row
+    through its `LIMIT $n`; that row is left out of `body` and, when present,
+    `next_cursor` holds the id of the last row included. With `versioned`,
+    `version` holds the list's VERSION_HASH, look-ahead row included.
+    """
+    limit = "$" + re.search(r"LIMIT \$(\d+)", list_query.sql).group(1)
+    fields = json_fields(model)
+    version = f",\n            {VERSION_HASH} AS version" if versioned else ""
+    return query(f"{list_query.name}_json", f"""
+        WITH page AS ({list_query.sql}),
+        ranked AS (SELECT page.*, row_number() OVER (ORDER BY id) AS row_number FROM page)
+        SELECT
+            coalesce(json_agg(json_build_object({fields}) ORDER BY row_number)
+                FILTER (WHERE {limit}::bigint IS NULL OR row_number < {limit}), '[]')::text AS body,
+            CASE WHEN count(*) = {limit} THEN max(id) FILTER (WHERE row_number = {limit} - 1) END AS next_cursor{version}
+        FROM ranked
+    """)
+
+
+# Auth
+AUTH_CODE_INSERT = query("auth_code.insert", """
+    INSERT INTO auth_codes (email, code, expires_at)
+    VALUES ($1, $2, $3)
+""")
+AUTH_CODE_VERIFY = query("auth_code.verify", """
+    SELECT * FROM auth_codes WHERE email=$1 AND code=$2 AND used=FALSE AND expires_at > NOW()
+""")
+# expires_at narrows the update to one partition
+AUTH_CODE_MARK_USED = query("auth_code.mark_used", "UPDATE auth_codes SET used=TRUE WHERE id=$1 AND expires_at=$2")
+# Sweeper (migration 0006): used codes, and expired ones left in partitions
+# that cannot be dropped yet, are deleted a batch at a time.
+AUTH_CODE_PURGE = query("auth_code.purge", """
+    WITH doomed AS (
+        SELECT id, expires_at FROM auth_codes
+        WHERE used OR expires_at <= NOW()
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ), deleted AS (
+        DELETE FROM auth_codes a USING doomed d
+        WHERE a.id = d.id AND a.expires_at = d.expires_at
+        RETURNING 1
+    )
+    SELECT count(*) FROM deleted
+""")
+AUTH_CODE_ENSURE_PARTITIONS = query("auth_code.ensure_partitions", "SELECT ensure_auth_code_partitions($1)")
+AUTH_CODE_DROP_PARTITIONS = query("auth_code.drop_partitions", "SELECT drop_expired_auth_code_partitions()")
+USER_ROLE = query("user.role", """
+    SELECT r.name FROM users u JOIN roles r ON u.role_id = r.id WHERE u.email = $1
+""", hot=True)
+# Claims for the session token issued at login
+USER_SESSION = query("user.session", """
+    SELECT u.id, r.name AS role FROM users u LEFT JOIN roles r ON u.role_id = r.id WHERE u.email = $1
+""", hot=True)
+
+# Curriculum
+CURRICULUM_INSERT = query("curriculum.insert", f"""
+    INSERT INTO curriculum (title, description, cohort_id, published)
+    VALUES ($1, $2, $3, $4)
+    RETURNING {columns(CurriculumOut)}
+""", decode=as_model(CurriculumOut))
+CURRICULUM_LIST = query("curriculum.list", f"SELECT {columns(CurriculumOut)} FROM curriculum WHERE id > $1 ORDER BY id LIMIT $2", decode=as_model(CurriculumOut))
+CURRICULUM_LIST_JSON = json_page(CURRICULUM_LIST, CurriculumOut, versioned=True)
+CURRICULUM_LIST_VERSION = version_query(CURRICULUM_LIST)
+CURRICULUM_GET = query("curriculum.get", f"SELECT {columns(CurriculumOut)} FROM curriculum WHERE id=$1", decode=as_model(CurriculumOut), hot=True)
+CURRICULUM_UPDATED_AT = query("curriculum.updated_at", "SELECT updated_at FROM curriculum WHERE id=$1")
+CURRICULUM_UPDATE = query("curriculum.update", f"""
+    UPDATE curriculum SET title=$1, description=$2, cohort_id=$3, published=$4, updated_at=NOW()
+    WHERE id=$5 RETURNING {columns(CurriculumOut)}
+""", decode=as_model(CurriculumOut))
+CURRICULUM_DELETE = query("curriculum.delete", "DELETE FROM curriculum WHERE id=$1")
+# The whole course as one JSON document: lessons by order_index, each with
+# its assignments. last_modified is the newest updated_at in the tree.
+CURRICULUM_TREE = query("curriculum.tree", f"""
+    SELECT
+        json_build_object({json_fields(CurriculumOut, "c")}, 'lessons', coalesce((
+            SELECT json_agg(json_build_object({json_fields(LessonOut, "l")}, 'assignments', coalesce((
+                SELECT json_agg(json_build_object({json_fields(AssignmentOut, "a")}) ORDER BY a.id)
+                FROM assignments a WHERE a.lesson_id = l.id
+            ), '[]'::json)) ORDER BY l.order_index NULLS LAST, l.id)
+            FROM lessons l WHERE l.curriculum_id = c.id
+        ), '[]'::json))::text AS body,
+        greatest(
+            c.updated_at,
+            (SELECT max(l.updated_at) FROM lessons l WHERE l.curriculum_id = c.id),
+            (SELECT max(a.updated_at) FROM assignments a JOIN lessons l ON a.lesson_id = l.id WHERE l.curriculum_id = c.id)
+        ) AS last_modified
+    FROM curriculum c WHERE c.id = $1
+""")
+
+# Lessons
+LESSON_INSERT = query("lesson.insert", f"""
+    INSERT INTO lessons (curriculum_id, title, content_markdown, order_index, content_hash, content_html)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    RETURNING {columns(LessonOut)}
+""", decode=as_model(LessonOut))
+LESSON_LIST = query("lesson.list", f"SELECT {columns(LessonOut)} FROM lessons WHERE id > $1 ORDER BY id LIMIT $2", decode=as_model(LessonOut))
+LESSON_LIST_JSON = json_page(LESSON_LIST, LessonOut, versioned=True)
+LESSON_LIST_VERSION = version_query(LESSON_LIST)
+LESSON_GET = query("lesson.get", f"SELECT {columns(LessonOut)} FROM lessons WHERE id=$1", decode=as_model(LessonOut), hot=True)
+LESSON_UPDATED_AT = query("lesson.updated_at", "SELECT updated_at FROM lessons WHERE id=$1")
+LESSON_UPDATE = query("lesson.update", f"""
+    UPDATE lessons SET curriculum_id=$1, title=$2, content_markdown=$3, order_index=$4,
+        content_hash=$6, content_html=$7, updated_at=NOW()
+    WHERE id=$5 RETURNING {columns(LessonOut)}
+""", decode=as_model(LessonOut))
+LESSON_DELETE = query("lesson.delete", "DELETE FROM lessons WHERE id=$1")
+# Rendered content (migration 0007), one row per content hash shared by
+# every lesson with the same markdown. $2 picks the stored variant to send.
+LESSON_CONTENT = query("lesson.content", """
+    SELECT l.content_hash, l.content_html,
+        CASE $2 WHEN 'br' THEN r.html_br WHEN 'gzip' THEN r.html_gzip END AS encoded
+    FROM lessons l LEFT JOIN lesson_renders r ON r.content_hash = l.content_hash
+    WHERE l.id = $1
+""", hot=True)
+LESSON_RENDER_HTML = query("lesson_render.html", "SELECT html FROM lesson_renders WHERE content_hash = $1", hot=True)
+LESSON_RENDER_HTML_MANY = query("lesson_render.html_many", "SELECT content_hash, html FROM lesson_renders WHERE content_hash = ANY($1::text[])")
+LESSON_RENDER_INSERT = query("lesson_render.insert", """
+    INSERT INTO lesson_renders (content_hash, renderer, html, html_gzip, html_br)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (content_hash) DO NOTHING
+""")
+# Lessons with markdown but no render by the current renderer: written
+# before migration 0007, or rendered by an older RENDERER_VERSION.
+LESSON_RENDER_PENDING = query("lesson_render.pending", """
+    SELECT l.id, l.content_markdown FROM lessons l
+    WHERE l.content_markdown IS NOT NULL AND l.id > $2
+      AND NOT EXISTS (SELECT 1 FROM lesson_renders r WHERE r.content_hash = l.content_hash AND r.renderer = $1)
+    ORDER BY l.id LIMIT $3
+""")
+# Skipped if the markdown changed since it was read; that write rendered it already.
+# updated_at (the lesson's ETag) moves only if the HTML itself changed.
+LESSON_RENDER_ATTACH = query("lesson_render.attach", """
+    UPDATE lessons SET content_hash = $2, content_html = $3,
+        updated_at = CASE WHEN content_html IS NOT DISTINCT FROM $3 THEN updated_at ELSE NOW() END
+    WHERE id = $1 AND content_markdown = $4
+""")
+# Session lock, so one process backfills while the others skip
+LESSON_RENDER_BACKFILL_LOCK = query("lesson_render.backfill_lock", "SELECT pg_try_advisory_lock(hashtext('lesson_render_backfill'))")
+LESSON_RENDER_BACKFILL_UNLOCK = query("lesson_render.backfill_unlock", "SELECT pg_advisory_unlock(hashtext('lesson_render_backfill'))")
+# Renders no lesson points at any more. The grace period covers a render
+# stored moments before the lesson write that will reference it.
+LESSON_RENDER_PRUNE = query("lesson_render.prune", """
+    DELETE FROM lesson_renders r
+    WHERE r.created_at < NOW() - make_interval(secs => $1)
+      AND NOT EXISTS (SELECT 1 FROM lessons l WHERE l.content_hash = r.content_hash)
+""")
+
+# Vault sync (migration 0008): lessons keyed by (curriculum_id, source_path)
+LESSON_SOURCE_HASHES = query("lesson.source_hashes", """
+    SELECT source_path, source_hash FROM lessons WHERE curriculum_id = $1 AND source_path IS NOT NULL
+""")
+# Serializes syncs of one curriculum
+LESSON_SYNC_LOCK = query("lesson.sync_lock", "SELECT pg_advisory_xact_lock(hashtext('lesson_sync'), $1)")
+LESSON_SYNC_STAGING_CREATE = query("lesson.sync_staging_create", """
+    CREATE TEMP TABLE lessons_sync_staging (
+        source_path TEXT, source_hash TEXT, title TEXT, content_markdown TEXT,
+        order_index INTEGER, content_hash TEXT, content_html TEXT
+    ) ON COMMIT DROP
+""")
+LESSON_SYNC_MERGE = query("lesson.sync_merge", """
+    WITH merged AS (
+        INSERT INTO lessons (curriculum_id, source_path, source_hash, title, content_markdown, order_index, content_hash, content_html)
+        SELECT $1, source_path, source_hash, title, content_markdown, order_index, content_hash, content_html
+        FROM lessons_sync_staging
+        ON CONFLICT (curriculum_id, source_path) WHERE source_path IS NOT NULL DO UPDATE SET
+            source_hash = EXCLUDED.source_hash, title = EXCLUDED.title, content_markdown = EXCLUDED.content_markdown,
+            order_index = EXCLUDED.order_index, content_hash = EXCLUDED.content_hash,
+            content_html = EXCLUDED.content_html, updated_at = NOW()
+        WHERE lessons.source_hash IS DISTINCT FROM EXCLUDED.source_hash
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted) AS created, count(*) FILTER (WHERE NOT inserted) AS updated FROM merged
+""")
+# Synced lessons whose file is gone. Those with assignments are kept, and
+# listed, rather than failing the whole sync on the foreign key.
+LESSON_SYNC_DELETE = query("lesson.sync_delete", """
+    WITH removed AS (
+        SELECT id, source_path FROM lessons
+        WHERE curriculum_id = $1 AND source_path IS NOT NULL AND source_path <> ALL($2::text[])
+    ), deleted AS (
+        DELETE FROM lessons l USING removed r
+        WHERE l.id = r.id AND NOT EXISTS (SELECT 1 FROM assignments a WHERE a.lesson_id = l.id)
+        RETURNING l.id
+    )
+    SELECT
+        (SELECT count(*) FROM deleted) AS deleted,
+        coalesce((SELECT array_agg(source_path ORDER BY source_path) FROM removed
+                  WHERE id NOT IN (SELECT id FROM deleted)), '{}') AS kept
+""")
+
+# Assignments
+ASSIGNMENT_INSERT = query("assignment.insert", f"""
+    INSERT INTO assignments (lesson_id, title, description, due_date, max_score)
+    VALUES ($1, $2, $3, $4, $5)
+    RETURNING {columns(AssignmentOut)}
+""", decode=as_model(AssignmentOut))
+ASSIGNMENT_LIST = query("assignment.list", f"SELECT {columns(AssignmentOut)} FROM assignments WHERE id > $1 ORDER BY id LIMIT $2", decode=as_model(AssignmentOut))
+ASSIGNMENT_LIST_JSON = json_page(ASSIGNMENT_LIST, AssignmentOut, versioned=True)
+ASSIGNMENT_LIST_VERSION = version_query(ASSIGNMENT_LIST)
+ASSIGNMENT_GET = query("assignment.get", f"SELECT {columns(AssignmentOut)} FROM assignments WHERE id=$1", decode=as_model(AssignmentOut), hot=True)
+ASSIGNMENT_UPDATED_AT = query("assignment.updated_at", "SELECT updated_at FROM assignments WHERE id=$1")
+ASSIGNMENT_UPDATE = query("assignment.update", f"""
+    UPDATE assignments SET lesson_id=$1, title=$2, description=$3, due_date=$4, max_score=$5, updated_at=NOW()
+    WHERE id=$6 RETURNING {columns(AssignmentOut)}
+""", decode=as_model(AssignmentOut))
+ASSIGNMENT_DELETE = query("assignment.delete", "DELETE FROM assignments WHERE id=$1")
+
+# Full-text search (migrations 0009/0010). At most $5 matches of each kind
+# are ranked, and the best $3 of each are merged. Without the cap, a very
+# common word would rank most of the table. Snippets are built for the
+# final page only, since ts_headline re-parses the document. $2 lists the
+# kinds to search and $4 holds the ts_headline options.
+#
+# Unscoped searches find matches through the GIN indexes. Cohort-scoped
+# searches test each row of the cohort's content instead. A cohort holds a
+# few thousand rows at most, while a GIN scan for a common word returns
+# most of the table before the cohort filter. OFFSET 0 keeps the planner
+# from pushing the match into the subquery and onto the index.
+def _search_query(name, cohort_scoped):
+    if cohort_scoped:
+        curriculum = "SELECT id, title, cohort_id, search_vector FROM curriculum WHERE cohort_id = $6"
+        lessons = """SELECT * FROM (
+                    SELECT l.id, l.title, l.curriculum_id, c.cohort_id, l.search_vector
+                    FROM curriculum c JOIN lessons l ON l.curriculum_id = c.id
+                    WHERE c.cohort_id = $6 OFFSET 0
+                ) scoped"""
+        assignments = """SELECT * FROM (
+                    SELECT a.id, a.title, l.curriculum_id, c.cohort_id, a.search_vector
+                    FROM curriculum c JOIN lessons l ON l.curriculum_id = c.id JOIN assignments a ON a.lesson_id = l.id
+                    WHERE c.cohort_id = $6 OFFSET 0
+                ) scoped"""
+    else:
+        curriculum = "SELECT id, title, cohort_id, search_vector FROM curriculum"
+        lessons = """SELECT l.id, l.title, l.curriculum_id, c.cohort_id, l.search_vector
+                FROM lessons l LEFT JOIN curriculum c ON c.id = l.curriculum_id"""
+        assignments = """SELECT a.id, a.title, l.curriculum_id, c.cohort_id, a.search_vector
+                FROM assignments a LEFT JOIN lessons l ON l.id = a.lesson_id LEFT JOIN curriculum c ON c.id = l.curriculum_id"""
+    branches = "\n            UNION ALL\n".join(f"""
+            (SELECT '{kind}' AS kind, id, title, {curriculum_id} AS curriculum_id, cohort_id, ts_rank(search_vector, q.query) AS rank
+             FROM (
+                SELECT source.* FROM ({source}) source, q
+                WHERE '{kind}' = ANY($2::text[]) AND source.search_vector @@ q.query
+                LIMIT $5
+             ) candidates, q
+             ORDER BY rank DESC LIMIT $3)""" for kind, curriculum_id, source in (
+        ("curriculum", "id", curriculum), ("lesson", "curriculum_id", lessons), ("assignment", "curriculum_id", assignments),
+    ))
+    return query(name, f"""
+        WITH q AS (SELECT websearch_to_tsquery('english', $1) AS query),
+        hits AS ({branches}
+        ),
+        top AS (SELECT * FROM hits ORDER BY rank DESC, kind, id LIMIT $3)
+        SELECT top.kind, top.id, top.title, top.curriculum_id, top.cohort_id, top.rank::float8 AS rank,
+            ts_headline('english', coalesce(CASE top.kind
+                WHEN 'lesson' THEN (SELECT content_markdown FROM lessons WHERE id = top.id)
+                WHEN 'assignment' THEN (SELECT description FROM assignments WHERE id = top.id)
+                ELSE (SELECT description FROM curriculum WHERE id = top.id)
+            END, top.title), q.query, $4) AS snippet
+        FROM top, q
+        ORDER BY top.rank DESC, top.kind, top.id
+    """)
+
+
+SEARCH = _search_query("search", cohort_scoped=False)
+SEARCH_BY_COHORT = _search_query("search.by_cohort", cohort_scoped=True)
+
+# Cohorts
+COHORT_INSERT = query("cohort.insert", """
+    INSERT INTO cohorts (name, start_date, end_date)
+    VALUES ($1, $2, $3)
+    RETURNING *
+""", decode=as_model(CohortOut))
+COHORT_LIST = query("cohort.list", "SELECT * FROM cohorts WHERE id > $1 ORDER BY id LIMIT $2", decode=as_model(CohortOut))
+COHORT_LIST_JSON = json_page(COHORT_LIST, CohortOut)
+COHORT_GET = query("cohort.get", "SELECT * FROM cohorts WHERE id=$1", decode=as_model(CohortOut))
+COHORT_UPDATE = query("cohort.update", """
+    UPDATE cohorts SET name=$1, start_date=$2, end_date=$3 WHERE id=$4 RETURNING *
+""", decode=as_model(CohortOut))
+COHORT_DELETE = query("cohort.delete", "DELETE FROM cohorts WHERE id=$1")
+
+# Enrollments
+ENROLLMENT_INSERT = query("enrollment.insert", """
+    INSERT INTO enrollments (user_id, cohort_id)
+    VALUES ($1, $2)
+    ON CONFLICT (user_id, cohort_id) DO NOTHING
+    RETURNING *
+""", decode=as_model(EnrollmentOut))
+ENROLLMENT_STAGING_CREATE = query("enrollment.staging_create", """
+    CREATE TEMP TABLE enrollments_staging (user_id INTEGER NOT NULL, cohort_id INTEGER NOT NULL)
+    ON COMMIT DROP
+""")
+ENROLLMENT_STAGING_MERGE = query("enrollment.staging_merge", """
+    WITH inserted AS (
+        INSERT INTO enrollments (user_id, cohort_id)
+        SELECT DISTINCT user_id, cohort_id FROM enrollments_staging
+        ON CONFLICT (user_id, cohort_id) DO NOTHING
+        RETURNING 1
+    )
+    SELECT count(*) FROM inserted
+""")
+ENROLLMENT_LIST_BY_COHORT = query("enrollment.list_by_cohort", """
+    SELECT * FROM enrollments WHERE cohort_id=$1 AND id > $2 ORDER BY id LIMIT $3
+""", decode=as_model(EnrollmentOut))
+ENROLLMENT_LIST_BY_COHORT_JSON = json_page(ENROLLMENT_LIST_BY_COHORT, EnrollmentOut)
+ENROLLMENT_DELETE = query("enrollment.delete", "DELETE FROM enrollments WHERE id=$1")
+
+# Events
+EVENT_INSERT = query("event.insert", """
+    INSERT INTO events (cohort_id, title, description, event_type, start_time, end_time, location)
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+    RETURNING *
+""", decode=as_model(EventOut))
+# Events starting in [$2, $3); callers pass datetime.min/max for an open
+# end, so both bounds stay sargable on events_cohort_start_idx.
+EVENT_LIST_BY_COHORT = query("event.list_by_cohort", """
+    SELECT * FROM events WHERE cohort_id=$1 AND start_time >= $2 AND start_time < $3 ORDER BY start_time, id
+""", decode=as_model(EventOut))
+EVENT_LIST_BY_COHORT_VERSION = version_query(EVENT_LIST_BY_COHORT)
+# Validator for the calendar feed: changes whenever an event is added,
+# edited or removed, or the cohort is renamed. No row means no cohort.
+EVENT_FEED_VERSION = query("event.feed_version", """
+    SELECT c.name, md5(c.name || ';' || COALESCE(string_agg(e.id || '@' || e.updated_at, ',' ORDER BY e.id), '')) AS version
+    FROM cohorts c LEFT JOIN events e ON e.cohort_id = c.id
+    WHERE c.id = $1
+    GROUP BY c.id
+""")
+EVENT_UPDATE = query("event.update", """
+    UPDATE events SET cohort_id=$1, title=$2, description=$3, event_type=$4, start_time=$5, end_time=$6, location=$7, updated_at=NOW()
+    WHERE id=$8 RETURNING *
+""", decode=as_model(EventOut))
+EVENT_DELETE = query("event.delete", "DELETE FROM events WHERE id=$1")
+
+# Submissions
+SUBMISSION_UPSERT = query("submission.upsert", """
+    INSERT INTO submissions (assignment_id, user_id, file_url)
+    VALUES ($1, $2, $3)
+    ON CONFLICT (assignment_id, user_id) DO UPDATE SET file_url=EXCLUDED.file_url, submitted_at=NOW()
+    RETURNING *
+""", decode=as_model(SubmissionOut), hot=True)
+SUBMISSION_LIST_BY_ASSIGNMENT = query("submission.list_by_assignment", """
+    SELECT * FROM submissions WHERE assignment_id=$1 AND id > $2 ORDER BY id LIMIT $3
+""", decode=as_model(SubmissionOut))
+SUBMISSION_LIST_BY_ASSIGNMENT_JSON = json_page(SUBMISSION_LIST_BY_ASSIGNMENT, SubmissionOut)
+SUBMISSION_LIST_BY_USER = query("submission.list_by_user", "SELECT * FROM submissions WHERE user_id=$1", decode=as_model(SubmissionOut))
+
+# Grading queue (migrations 0004, 0011, 0012). Both statements take an optional
+# cohort ($1) and assignment ($2) scope. The cohort's assignment ids are
+# collected once into an array, so a scoped queue reads only their
+# submissions off the (assignment_id, submitted_at, id) index; a correlated
+# EXISTS under the OR was checked against every submission instead.
+_UNGRADED_IN_SCOPE = """
+    NOT EXISTS (SELECT 1 FROM grades g WHERE g.submission_id = s.id)
+    AND ($1::int IS NULL OR s.assignment_id = ANY(ARRAY(
+        SELECT a.id FROM assignments a
+        JOIN lessons l ON l.id = a.lesson_id
+        JOIN curriculum cu ON cu.id = l.curriculum_id
+        WHERE cu.cohort_id = $1
+    )))
+    AND ($2::int IS NULL OR s.assignment_id = $2)
+"""
+GRADING_QUEUE = query("grading.queue", f"""
+    SELECT s.id, s.assignment_id, s.user_id, s.file_url, s.submitted_at,
+           c.grader_id AS claimed_by, c.expires_at AS claim_expires_at
+    FROM submissions s
+    LEFT JOIN grading_claims c ON c.submission_id = s.id AND c.expires_at > NOW()
+    WHERE {_UNGRADED_IN_SCOPE}
+    ORDER BY s.submitted_at, s.id
+    LIMIT $3
+""", decode=as_model(GradingQueueItem), hot=True)
+# SKIP LOCKED lets concurrent claimers pass over each other's candidates
+# instead of queueing behind them. An expired claim is taken over; a live
+# one is left alone by the ON CONFLICT ... WHERE.
+GRADING_CLAIM = query("grading.claim", f"""
+    WITH candidates AS (
+        SELECT s.id FROM submissions s
+        WHERE {_UNGRADED_IN_SCOPE}
+          AND NOT EXISTS (
+              SELECT 1 FROM grading_claims c WHERE c.submission_id = s.id AND c.expires_at > NOW()
+          )
+        ORDER BY s.submitted_at, s.id
+        LIMIT $3
+        FOR UPDATE OF s SKIP LOCKED
+    ), claimed AS (
+        INSERT INTO grading_claims (submission_id, grader_id, expires_at)
+        SELECT id, $4, NOW() + make_interval(secs => $5) FROM candidates
+        ON CONFLICT (submission_id) DO UPDATE
+            SET grader_id = EXCLUDED.grader_id, claimed_at = NOW(), expires_at = EXCLUDED.expires_at
+            WHERE grading_claims.expires_at <= NOW()
+        RETURNING submission_id, expires_at
+    )
+    SELECT s.id, s.assignment_id, s.user_id, s.file_url, s.submitted_at, claimed.expires_at
+    FROM claimed JOIN submissions s ON s.id = claimed.submission_id
+    ORDER BY s.submitted_at, s.id
+""", decode=as_model(GradingClaim))
+# Consuming the claim row serializes graders of the same submission.
+GRADING_CLAIM_CONSUME = query("grading.claim_consume", """
+    DELETE FROM grading_claims WHERE submission_id = $1 AND grader_id = $2 AND expires_at > NOW()
+    RETURNING submission_id
+""")
+GRADING_CLAIM_RELEASE = query("grading.claim_release", """
+    DELETE FROM grading_claims WHERE submission_id = $1 AND grader_id = $2
+""")
+GRADE_INSERT_IF_UNGRADED = query("grade.insert_if_ungraded", """
+    INSERT INTO grades (submission_id, grader_id, score, feedback)
+    SELECT $1, $2, $3, $4 WHERE NOT EXISTS (SELECT 1 FROM grades WHERE submission_id = $1)
+    RETURNING *
+""", decode=as_model(GradeOut))
+
+# Gradebook export: one row per enrolled student with the latest score for
+# each of the cohort's assignments, in the order GRADEBOOK_ASSIGNMENTS lists
+# them. Read both in one snapshot so the columns match.
+_COHORT_ASSIGNMENTS = """
+    SELECT a.id, a.title, a.max_score,
+           row_number() OVER (ORDER BY cu.id, l.order_index NULLS LAST, l.id, a.due_date NULLS LAST, a.id) AS position
+    FROM assignments a
+    JOIN lessons l ON l.id = a.lesson_id
+    JOIN curriculum cu ON cu.id = l.curriculum_id
+    WHERE cu.cohort_id = $1
+"""
+GRADEBOOK_ASSIGNMENTS = query("gradebook.assignments", f"""
+    SELECT id, title, max_score FROM ({_COHORT_ASSIGNMENTS}) ca ORDER BY position
+""")
+GRADEBOOK_ROWS = query("gradebook.rows", f"""
+    SELECT u.id AS user_id, u.email, u.full_name,
+           COALESCE(array_agg(g.score ORDER BY ca.position) FILTER (WHERE ca.id IS NOT NULL), '{{}}') AS scores
+    FROM enrollments e
+    JOIN users u ON u.id = e.user_id
+    LEFT JOIN ({_COHORT_ASSIGNMENTS}) ca ON TRUE
+    LEFT JOIN submissions s ON s.assignment_id = ca.id AND s.user_id = e.user_id
+    LEFT JOIN LATERAL (
+        SELECT score FROM grades WHERE submission_id = s.id ORDER BY graded_at DESC LIMIT 1
+    ) g ON TRUE
+    WHERE e.cohort_id = $1
+    GROUP BY u.id
+    ORDER BY u.id
+""")
+
+# Student dashboard, from the student_assignment_status rollup (migration 0003)
+STUDENT_DASHBOARD = query("student.dashboard", """
+    SELECT assignment_id, lesson_id, title, due_date, max_score,
+           CASE WHEN status = 'pending' AND due_date < NOW() THEN 'overdue' ELSE status END AS status,
+           submission_id, submitted_at, score, feedback, graded_at
+    FROM student_assignment_status
+    WHERE user_id = $1
+    ORDER BY due_date NULLS LAST, assignment_id
+""", decode=as_model(DashboardItem), hot=True)
+
+# Grades. A submission is graded by one grader: writes lock the submission
+# row first, then refuse it when another grader holds a live claim or has
+# already graded it. The grader who graded it may revise their grade.
+GRADE_LOCK_SUBMISSION = query("grade.lock_submission", """
+    SELECT
+        (SELECT grader_id FROM grading_claims c WHERE c.submission_id = s.id AND c.expires_at > NOW()) AS claimed_by,
+        (SELECT grader_id FROM grades g WHERE g.submission_id = s.id AND g.grader_id <> $2 LIMIT 1) AS graded_by
+    FROM submissions s
+    WHERE s.id = $1
+    FOR UPDATE OF s
+""")
+GRADE_UPSERT = query("grade.upsert", """
+    INSERT INTO grades (submission_id, grader_id, score, feedback)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (submission_id, grader_id) DO UPDATE SET score=EXCLUDED.score, feedback=EXCLUDED.feedback, graded_at=NOW()
+    RETURNING *
+""", decode=as_model(GradeOut))
+# Bulk grade import: rows are COPYed into the staging table, the submissions
+# they name are locked, rows that would fail (or that another grader holds a
+# live claim on or has graded, in the database or earlier in the file) are
+# reported, and the rest are merged in one statement. The last row wins for
+# a repeated (submission, grader) pair.
+GRADE_STAGING_CREATE = query("grade.staging_create", """
+    CREATE TEMP TABLE grades_staging (
+        line INTEGER NOT NULL, submission_id INTEGER NOT NULL, grader_id INTEGER NOT NULL,
+        score INTEGER NOT NULL, feedback TEXT
+    ) ON COMMIT DROP
+""")
+GRADE_STAGING_LOCK = query("grade.staging_lock", """
+    SELECT id FROM submissions WHERE id IN (SELECT submission_id FROM grades_staging) ORDER BY id FOR UPDATE
+""")
+GRADE_STAGING_REJECTED = query("grade.staging_rejected", """
+    SELECT st.line,
+           CASE WHEN s.id IS NULL THEN 'unknown submission ' || st.submission_id
+                WHEN u.id IS NULL THEN 'unknown grader ' || st.grader_id
+                WHEN c.submission_id IS NOT NULL THEN 'submission ' || st.submission_id || ' is claimed by another grader'
+                ELSE 'submission ' || st.submission_id || ' is already graded by another grader'
+           END AS error
+    FROM (
+        SELECT *, first_value(grader_id) OVER (PARTITION BY submission_id ORDER BY line) AS first_grader_id
+        FROM grades_staging
+    ) st
+    LEFT JOIN submissions s ON s.id = st.submission_id
+    LEFT JOIN users u ON u.id = st.grader_id
+    LEFT JOIN grading_claims c
+        ON c.submission_id = st.submission_id AND c.expires_at > NOW() AND c.grader_id <> st.grader_id
+    LEFT JOIN LATERAL (
+        SELECT grader_id FROM grades g WHERE g.submission_id = st.submission_id AND g.grader_id <> st.grader_id LIMIT 1
+    ) graded ON TRUE
+    WHERE s.id IS NULL OR u.id IS NULL OR c.submission_id IS NOT NULL
+       OR graded.grader_id IS NOT NULL OR st.first_grader_id <> st.grader_id
+    ORDER BY st.line
+""")
+GRADE_STAGING_DISCARD = query("grade.staging_discard", "DELETE FROM grades_staging WHERE line = ANY($1::int[])")
+GRADE_STAGING_MERGE = query("grade.staging_merge", """
+    WITH merged AS (
+        INSERT INTO grades (submission_id, grader_id, score, feedback)
+        SELECT DISTINCT ON (submission_id, grader_id) submission_id, grader_id, score, feedback
+        FROM grades_staging
+        ORDER BY submission_id, grader_id, line DESC
+        ON CONFLICT (submission_id, grader_id) DO UPDATE SET score=EXCLUDED.score, feedback=EXCLUDED.feedback, graded_at=NOW()
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted) AS inserted, count(*) FILTER (WHERE NOT inserted) AS updated FROM merged
+""")
+GRADE_LIST_BY_SUBMISSION = query("grade.list_by_submission", "SELECT * FROM grades WHERE submission_id=$1", decode=as_model(GradeOut))
+GRADED_SUBMISSIONS_BY_GRADER = query("submission.graded_by", """
+    SELECT s.* FROM submissions s
+    JOIN grades g ON s.id = g.submission_id
+    WHERE g.grader_id = $1
+""", decode=as_model(SubmissionOut))
+
+# Email outbox
+EMAIL_OUTBOX_INSERT = query("email_outbox.insert", """
+    INSERT INTO email_outbox (to_email, subject, html_content)
+    VALUES ($1, $2, $3)
+""")
+EMAIL_OUTBOX_LEASE = query("email_outbox.lease", """
+    UPDATE email_outbox SET attempts = attempts + 1, next_attempt_at = NOW() + make_interval(secs => $2)
+    WHERE id IN (
+        SELECT id FROM email_outbox
+        WHERE status = 'pending' AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, to_email, subject, html_content, attempts
+""")
+# Settled messages drop their body (migration 0013): login-code emails
+# would otherwise keep every code ever issued in plaintext.
+EMAIL_OUTBOX_MARK_SENT = query("email_outbox.mark_sent", """
+    UPDATE email_outbox SET status='sent', sent_at=NOW(), last_error=NULL, html_content=NULL WHERE id = ANY($1::int[])
+""")
+EMAIL_OUTBOX_MARK_FAILED = query("email_outbox.mark_failed", """
+    UPDATE email_outbox SET last_error=$2, next_attempt_at = NOW() + make_interval(secs => $3),
+        status = CASE WHEN $4 THEN 'failed' ELSE 'pending' END,
+        html_content = CASE WHEN $4 THEN NULL ELSE html_content END
+    WHERE id=$1
+""")
+
+# Cache invalidation
+CACHE_NOTIFY = query("cache.notify", "SELECT pg_notify($1, $2)")
+
+# Replica health: seconds behind the primary, 0 when caught up or not a standby
+REPLICA_LAG = query("replica.lag", """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END::float8
+""")
@@ -0,0 +1,44 @@
+"""
+In-process token-bucket rate limiting.
+
+Each key (an email, a client IP) has a bucket holding up to `burst` tokens
+that refills at `rate_per_minute`. A request spends one token or is refused
+with the number of seconds until one is available. Buckets live in one
+worker's memory, so with several workers the effective limit is per worker;
+the least recently used keys are forgotten beyond `max_keys`.
+"""
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def acquire(self, key, now=None) -> float:
+        """Spend a token for `key`. Returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.allowed += 1
+        else:
+            wait = (1 - tokens) / self.rate if self.rate else float("inf")
+            self.rejected += 1
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        self._buckets.clear()
+
+    def stats(self):
+        return {"keys": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected}
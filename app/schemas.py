@@ -0,0 +1,232 @@
+"""
+Pydantic request and response models for the API.
+"""
+import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, EmailStr, Field, field_validator
+
+def naive_utc(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    """Timestamps are stored as naive UTC; convert offset-aware input to match."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+class LoginRequest(BaseModel):
+    email: EmailStr
+
+class VerifyCodeRequest(BaseModel):
+    email: EmailStr
+    code: str
+
+class CurriculumBase(BaseModel):
+    title: str
+    description: Optional[str] = None
+    cohort_id: Optional[int] = None
+    published: Optional[bool] = False
+
+class CurriculumCreate(CurriculumBase):
+    pass
+
+class CurriculumUpdate(CurriculumBase):
+    pass
+
+class CurriculumOut(CurriculumBase):
+    id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class LessonBase(BaseModel):
+    curriculum_id: int
+    title: str
+    content_markdown: Optional[str] = None
+    order_index: Optional[int] = None
+
+class LessonCreate(LessonBase):
+    pass
+
+class LessonUpdate(LessonBase):
+    pass
+
+class LessonOut(LessonBase):
+    id: int
+    # Sanitized HTML rendered from content_markdown when the lesson was written
+    content_html: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class AssignmentBase(BaseModel):
+    lesson_id: int
+    title: str
+    description: Optional[str] = None
+    due_date: Optional[datetime.datetime] = None
+    max_score: Optional[int] = None
+
+class AssignmentCreate(AssignmentBase):
+    pass
+
+class AssignmentUpdate(AssignmentBase):
+    pass
+
+class AssignmentOut(AssignmentBase):
+    id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class LessonTree(LessonOut):
+    assignments: List[AssignmentOut]
+
+class CurriculumTree(CurriculumOut):
+    lessons: List[LessonTree]
+
+class CohortBase(BaseModel):
+    name: str
+    start_date: datetime.date
+    end_date: datetime.date
+
+class CohortCreate(CohortBase):
+    pass
+
+class CohortUpdate(CohortBase):
+    pass
+
+class CohortOut(CohortBase):
+    id: int
+
+class EnrollmentBase(BaseModel):
+    user_id: int
+    cohort_id: int
+
+class EnrollmentOut(EnrollmentBase):
+    id: int
+    enrolled_at: datetime.datetime
+
+class BulkEnrollmentResult(BaseModel):
+    received: int
+    inserted: int
+    duplicates: int
+
+class EventBase(BaseModel):
+    cohort_id: int
+    title: str
+    description: Optional[str] = None
+    event_type: Optional[str] = None
+    start_time: datetime.datetime
+    end_time: datetime.datetime
+    location: Optional[str] = None
+
+    _naive_utc = field_validator("start_time", "end_time")(naive_utc)
+
+class EventCreate(EventBase):
+    pass
+
+class EventUpdate(EventBase):
+    pass
+
+class EventOut(EventBase):
+    id: int
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class SubmissionBase(BaseModel):
+    assignment_id: int
+    user_id: int
+    file_url: str
+
+class SubmissionCreate(SubmissionBase):
+    pass
+
+class SubmissionOut(SubmissionBase):
+    id: int
+    submitted_at: datetime.datetime
+
+class GradeBase(BaseModel):
+    submission_id: int
+    grader_id: int
+    score: int
+    feedback: Optional[str] = None
+
+class GradeCreate(GradeBase):
+    pass
+
+class GradeOut(GradeBase):
+    id: int
+    graded_at: datetime.datetime
+
+class SearchResult(BaseModel):
+    kind: str  # 'curriculum', 'lesson' or 'assignment'
+    id: int
+    title: str
+    curriculum_id: Optional[int] = None
+    cohort_id: Optional[int] = None
+    rank: float
+    # HTML-escaped excerpt with matches wrapped in <mark>
+    snippet: str
+
+class VaultSyncRequest(BaseModel):
+    # Directory under VAULT_DIR; the whole of VAULT_DIR when omitted
+    path: Optional[str] = None
+    dry_run: bool = False
+
+class VaultSyncResult(BaseModel):
+    scanned: int
+    unchanged: int
+    created: int
+    updated: int
+    deleted: int
+    # Lessons whose file is gone but which still have assignments
+    kept: List[str]
+    dry_run: bool
+
+class BulkRowError(BaseModel):
+    row: int
+    error: str
+
+class BulkGradeResult(BaseModel):
+    received: int
+    inserted: int
+    updated: int
+    rejected: int
+    errors: List[BulkRowError]
+
+class GradingQueueItem(SubmissionOut):
+    claimed_by: Optional[int] = None
+    claim_expires_at: Optional[datetime.datetime] = None
+
+class GradingClaimRequest(BaseModel):
+    grader_id: int
+    cohort_id: Optional[int] = None
+    assignment_id: Optional[int] = None
+    batch_size: int = Field(10, ge=1, le=50)
+
+class GradingClaim(SubmissionOut):
+    expires_at: datetime.datetime
+
+class ClaimedGrade(BaseModel):
+    grader_id: int
+    score: int
+    feedback: Optional[str] = None
+
+class DashboardItem(BaseModel):
+    assignment_id: int
+    lesson_id: Optional[int] = None
+    title: str
+    due_date: Optional[datetime.datetime] = None
+    max_score: Optional[int] = None
+    status: str  # 'pending', 'overdue', 'submitted' or 'graded'
+    submission_id: Optional[int] = None
+    submitted_at: Optional[datetime.datetime] = None
+    score: Optional[int] = None
+    feedback: Optional[str] = None
+    graded_at: Optional[datetime.datetime] = None
+
+class DashboardCounts(BaseModel):
+    pending: int = 0
+    overdue: int = 0
+    submitted: int = 0
+    graded: int = 0
+
+class StudentDashboard(BaseModel):
+    user_id: int
+    counts: DashboardCounts
+    items: List[DashboardItem]
@@ -0,0 +1,173 @@
+"""
+Sync a curriculum's lessons from a directory of markdown pages, such as the
+content folder of an Obsidian vault published with Quartz.
+
+Every `*.md` file under the directory (hidden directories like `.obsidian`
+are skipped) is one lesson, identified by its path relative to the
+directory. Files are hashed and compared with the `source_hash` stored on
+each synced lesson (migration 0008); only new or changed pages are read,
+rendered and written, all in one transaction, and lessons whose file is
+gone are deleted. A re-sync where nothing changed costs a directory walk
+and one query.
+
+A page's title comes from its front matter `title:`, else its first `# `
+heading, else its file name; `order:` (or `weight:`) in the front matter
+sets order_index. The front matter is not stored in the lesson.
+
+    python -m app.vault_sync quartz_site/content --curriculum-id 3 [--dry-run]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+from typing import NamedTuple, Optional
+
+from app.app_logging import app_logger as logger
+from app.cache import cache
+from app.db import db
+from app.lesson_content import renderer
+from app.queries import (
+    LESSON_SOURCE_HASHES,
+    LESSON_SYNC_DELETE,
+    LESSON_SYNC_LOCK,
+    LESSON_SYNC_MERGE,
+    LESSON_SYNC_STAGING_CREATE,
+)
+
+# Root the sync endpoint reads from; requests name a directory inside it
+VAULT_DIR = os.getenv("VAULT_DIR", "quartz_site/content")
+# Pages rendered per round, bounding the compressed output held in memory
+VAULT_SYNC_RENDER_BATCH = int(os.getenv("VAULT_SYNC_RENDER_BATCH", "100"))
+
+
+class VaultPage(NamedTuple):
+    path: str
+    source_hash: str
+    title: str
+    order_index: Optional[int]
+    markdown: str
+
+
+def _walk(root):
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        for name in sorted(files):
+            if name.endswith(".md") and not name.startswith("."):
+                full_path = os.path.join(directory, name)
+                yield os.path.relpath(full_path, root).replace(os.sep, "/"), full_path
+
+
+def scan_vault(root):
+    """{relative path: sha256 of the file's bytes} for every page under `root`."""
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Not a directory: {root}")
+    hashes = {}
+    for path, full_path in _walk(root):
+        with open(full_path, "rb") as page:
+            hashes[path] = hashlib.sha256(page.read()).hexdigest()
+    return hashes
+
+
+def _front_matter(text):
+    """(fields, body) for a page that starts with a `---` block of `key: value` lines."""
+    lines = text.split("\n")
+    if not lines or lines[0].strip() != "---":
+        return {}, text
+    for index, line in enumerate(lines[1:], start=1):
+        if line.strip() in ("---", "..."):
+            fields = {}
+            for entry in lines[1:index]:
+                key, separator, value = entry.partition(":")
+                if separator and not entry.startswith((" ", "\t", "-")):
+                    fields[key.strip().lower()] = value.strip().strip("'\"")
+            return fields, "\n".join(lines[index + 1:]).lstrip("\n")
+    return {}, text
+
+
+def parse_page(path, data: bytes) -> VaultPage:
+    text = data.decode("utf-8-sig").replace("\r\n", "\n")
+    fields, body = _front_matter(text)
+    title = fields.get("title")
+    if not title:
+        heading = next((line for line in body.split("\n") if line.startswith("# ")), None)
+        title = heading[2:].strip() if heading else os.path.splitext(os.path.basename(path))[0]
+    order = fields.get("order") or fields.get("weight")
+    try:
+        order_index = int(order) if order else None
+    except ValueError:
+        order_index = None
+    return VaultPage(path, hashlib.sha256(data).hexdigest(), title, order_index, body)
+
+
+def load_pages(root, paths):
+    pages = []
+    for path in paths:
+        with open(os.path.join(root, *path.split("/")), "rb") as page:
+            pages.append(parse_page(path, page.read()))
+    return pages
+
+
+async def sync_vault(curriculum_id, root, dry_run=False):
+    """Bring the curriculum's synced lessons in line with the pages under `root`; returns counts."""
+    hashes = await asyncio.to_thread(scan_vault, root)
+    async with db.pool.acquire() as conn:
+        stored = {row["source_path"]: row["source_hash"] for row in await LESSON_SOURCE_HASHES.fetch(conn, curriculum_id)}
+    changed = [path for path, digest in hashes.items() if stored.get(path) != digest]
+    removed = [path for path in stored if path not in hashes]
+    result = {
+        "scanned": len(hashes),
+        "unchanged": len(hashes) - len(changed),
+        "created": sum(1 for path in changed if path not in stored),
+        "updated": sum(1 for path in changed if path in stored),
+        "deleted": len(removed),
+        "kept": [],
+        "dry_run": dry_run,
+    }
+    if dry_run or not (changed or removed):
+        return result
+
+    # Read and render before the transaction, so no locks are held meanwhile
+    records = []
+    for start in range(0, len(changed), VAULT_SYNC_RENDER_BATCH):
+        pages = await asyncio.to_thread(load_pages, root, changed[start:start + VAULT_SYNC_RENDER_BATCH])
+        renders = await renderer.prepare_many([page.markdown for page in pages])
+        records.extend(
+            (page.path, page.source_hash, page.title, page.markdown, page.order_index, digest, html)
+            for page, (digest, html) in zip(pages, renders)
+        )
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            await LESSON_SYNC_LOCK.execute(conn, curriculum_id)
+            await LESSON_SYNC_STAGING_CREATE.execute(conn)
+            await conn.copy_records_to_table("lessons_sync_staging", records=records, columns=[
+                "source_path", "source_hash", "title", "content_markdown", "order_index", "content_hash", "content_html",
+            ])
+            merged = await LESSON_SYNC_MERGE.fetchrow(conn, curriculum_id)
+            deleted = await LESSON_SYNC_DELETE.fetchrow(conn, curriculum_id, list(hashes))
+        await cache.publish(conn, "lessons", "tree")
+    result.update(created=merged["created"], updated=merged["updated"], deleted=deleted["deleted"], kept=list(deleted["kept"]))
+    logger.info(
+        f"Vault sync for curriculum {curriculum_id}: {result['scanned']} pages, {result['created']} created, "
+        f"{result['updated']} updated, {result['deleted']} deleted"
+        + (f", {len(result['kept'])} kept with assignments" if result["kept"] else "")
+    )
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync a curriculum's lessons from a markdown directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--curriculum-id", type=int, required=True)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing.")
+    args = parser.parse_args()
+    await db.connect()
+    await renderer.start(background=False)
+    try:
+        result = await sync_vault(args.curriculum_id, args.directory, dry_run=args.dry_run)
+        logger.info(f"Vault sync result: {result}")
+    finally:
+        await renderer.stop()
+        await db.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+Compare POST /grades/bulk with one POST /grades request per grade.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/lms_bench python -m benchmarks.bench_bulk_grades
+
+The database is created from the app's DDL and migrations if needed. Each
+round grades the same BENCH_GRADES submissions, so after the first round
+both paths are updating existing grades.
+"""
+import asyncio
+import os
+import statistics
+import time
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost/lms_bench")
+BENCH_GRADES = int(os.getenv("BENCH_GRADES", "2000"))
+BENCH_ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("EMAIL_TRANSPORT", "log")
+# Requests authenticate with the legacy header, which is off by default
+os.environ.setdefault("AUTH_ALLOW_EMAIL_HEADER", "true")
+
+import asyncpg
+from fastapi.testclient import TestClient
+
+from app.main import app as api
+from app.migrate import migrate
+from app.models import USER_TABLE_DDL
+
+INSTRUCTOR = {"X-User-Email": "bench-instructor@example.com"}
+
+
+async def seed():
+    """Return (grader id, submission ids), creating what is missing."""
+    conn = await asyncpg.connect(BENCH_DATABASE_URL)
+    try:
+        await conn.execute(USER_TABLE_DDL)
+        await migrate(conn)
+        await conn.execute("INSERT INTO roles (name) VALUES ('student'), ('instructor'), ('admin') ON CONFLICT DO NOTHING")
+        grader_id = await conn.fetchval("""
+            INSERT INTO users (email, full_name, role_id)
+            SELECT $1, 'Bench Instructor', id FROM roles WHERE name = 'instructor'
+            ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name
+            RETURNING id
+        """, INSTRUCTOR["X-User-Email"])
+        student_id = await conn.fetchval("""
+            INSERT INTO users (email, full_name, role_id)
+            SELECT 'bench-student@example.com', 'Bench Student', id FROM roles WHERE name = 'student'
+            ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name
+            RETURNING id
+        """)
+        existing = await conn.fetchval("SELECT count(*) FROM submissions WHERE user_id = $1", student_id)
+        if existing < BENCH_GRADES:
+            lesson_id = await conn.fetchval("""
+                WITH c AS (INSERT INTO curriculum (title) VALUES ('Bench grades') RETURNING id)
+                INSERT INTO lessons (curriculum_id, title) SELECT id, 'Bench lesson' FROM c RETURNING id
+            """)
+            await conn.execute("""
+                WITH a AS (
+                    INSERT INTO assignments (lesson_id, title, max_score)
+                    SELECT $1, 'Bench assignment ' || n, 100 FROM generate_series(1, $2) AS n
+                    RETURNING id
+                )
+                INSERT INTO submissions (assignment_id, user_id, file_url)
+                SELECT id, $3, 'https://example.com/bench.pdf' FROM a
+            """, lesson_id, BENCH_GRADES - existing, student_id)
+        submission_ids = await conn.fetch(
+            "SELECT id FROM submissions WHERE user_id = $1 ORDER BY id LIMIT $2", student_id, BENCH_GRADES
+        )
+        return grader_id, [row["id"] for row in submission_ids]
+    finally:
+        await conn.close()
+
+
+def per_request(client, grader_id, submission_ids, score):
+    for submission_id in submission_ids:
+        response = client.post(
+            "/grades", json={"submission_id": submission_id, "grader_id": grader_id, "score": score}, headers=INSTRUCTOR
+        )
+        assert response.status_code == 200
+
+
+def bulk(client, grader_id, submission_ids, score):
+    body = "submission_id,grader_id,score,feedback\n" + "".join(
+        f"{submission_id},{grader_id},{score},\n" for submission_id in submission_ids
+    )
+    response = client.post("/grades/bulk", content=body.encode(), headers={**INSTRUCTOR, "Content-Type": "text/csv"})
+    assert response.status_code == 200 and response.json()["rejected"] == 0
+
+
+def main():
+    grader_id, submission_ids = asyncio.run(seed())
+    results = {}
+    with TestClient(api) as client:
+        for label, load in (("per-request", per_request), ("bulk", bulk)):
+            timings = []
+            for round_number in range(BENCH_ROUNDS):
+                started = time.perf_counter()
+                load(client, grader_id, submission_ids, round_number % 100)
+                timings.append(time.perf_counter() - started)
+            results[label] = timings
+    baseline = statistics.median(results["per-request"])
+    print(f"{len(submission_ids)} grades, {BENCH_ROUNDS} rounds")
+    for label, timings in results.items():
+        median = statistics.median(timings)
+        print(
+            f"{label:>12}: median {median * 1000:9.1f} ms  {len(submission_ids) / median:9.0f} rows/s"
+            f"  speedup {baseline / median:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
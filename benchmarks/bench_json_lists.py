@@ -0,0 +1,77 @@
+"""
+Compare the validated list path with the json_agg fast path on a 10k-row list.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/lms_bench python -m benchmarks.bench_json_lists
+
+The database is created from the app's DDL and migrations if needed, and
+seeded with BENCH_ROWS curriculum rows. Each mode then serves the unpaged
+GET /curriculum list (which is never cached) BENCH_ROUNDS times through the
+ASGI app.
+"""
+import asyncio
+import os
+import statistics
+import time
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost/lms_bench")
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "10000"))
+BENCH_ROUNDS = int(os.getenv("BENCH_ROUNDS", "20"))
+
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("EMAIL_TRANSPORT", "log")
+
+import asyncpg
+from fastapi.testclient import TestClient
+
+import app.pagination
+from app.main import app as api
+from app.migrate import migrate
+from app.models import USER_TABLE_DDL
+
+
+async def seed():
+    conn = await asyncpg.connect(BENCH_DATABASE_URL)
+    try:
+        await conn.execute(USER_TABLE_DDL)
+        await migrate(conn)
+        existing = await conn.fetchval("SELECT count(*) FROM curriculum")
+        if existing < BENCH_ROWS:
+            await conn.execute("""
+                INSERT INTO curriculum (title, description, published)
+                SELECT 'Curriculum ' || n, repeat('Description text. ', 10), n % 2 = 0
+                FROM generate_series($1::int, $2::int) AS n
+            """, existing + 1, BENCH_ROWS)
+    finally:
+        await conn.close()
+
+
+def run(client, fast):
+    app.pagination.FAST_JSON_LISTS = fast
+    client.get("/curriculum")  # warm the statement cache
+    timings = []
+    for _ in range(BENCH_ROUNDS):
+        started = time.perf_counter()
+        response = client.get("/curriculum")
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200
+    return len(response.content), timings
+
+
+def main():
+    asyncio.run(seed())
+    with TestClient(api) as client:
+        results = {label: run(client, fast) for label, fast in (("validated", False), ("json_agg", True))}
+    baseline = statistics.median(results["validated"][1])
+    print(f"GET /curriculum, {BENCH_ROWS} rows, {BENCH_ROUNDS} rounds")
+    for label, (size, timings) in results.items():
+        median = statistics.median(timings)
+        print(
+            f"{label:>10}: median {median * 1000:8.1f} ms  p95 {sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:8.1f} ms"
+            f"  body {size / 1024:7.0f} KiB  speedup {baseline / median:4.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Replay a realistic mix of API traffic against a seeded database and report
+per-route latency and throughput as JSON.
+
+Usage:
+    python -m benchmarks.seed
+    BENCH_OUTPUT=before.json python -m benchmarks.load
+    ... change something ...
+    BENCH_OUTPUT=after.json python -m benchmarks.load
+    python -m benchmarks.load compare before.json after.json
+
+Without BENCH_URL the driver starts `uvicorn app.main:app` itself on a free
+port against BENCH_DATABASE_URL, with BENCH_WORKERS workers, a shared
+AUTH_TOKEN_SECRET and the login code rate limits lifted (the whole load
+comes from one address). With BENCH_URL it uses that server as it is, and
+BENCH_DATABASE_URL must be the database behind it.
+
+BENCH_CONCURRENCY virtual users each act as one student and the instructor
+of that student's cohort, and log in as both through /auth/request_code and
+/auth/verify_code. Each then picks scenarios by the weights in BENCH_MIX
+(`name=weight,...`, overriding MIX) until BENCH_DURATION seconds have
+passed. Requests in the first BENCH_WARMUP seconds are not counted. Writes
+(submissions, grades, claims) change the data, so reseed before runs that
+are meant to be compared.
+
+The report has, per route template and in total: requests, throughput,
+p50/p95/p99/max latency in milliseconds, and responses by status. `errors`
+counts 5xx responses and requests that got no response. `compare` prints
+the change per route and exits 1 if any p95 grew by more than
+BENCH_REGRESSION (a fraction, default 0.2) on a route with at least 50
+requests in both runs.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import asyncpg
+import httpx
+
+from benchmarks.seed import WORDS
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost/lms_load")
+BENCH_URL = os.getenv("BENCH_URL")
+BENCH_WORKERS = int(os.getenv("BENCH_WORKERS", "1"))
+BENCH_CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "32"))
+BENCH_DURATION = float(os.getenv("BENCH_DURATION", "60"))
+BENCH_WARMUP = float(os.getenv("BENCH_WARMUP", "5"))
+BENCH_MIX = os.getenv("BENCH_MIX", "")
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT")
+BENCH_REGRESSION = float(os.getenv("BENCH_REGRESSION", "0.2"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "1"))
+# Where a spawned server's log and console output go
+BENCH_SERVER_LOG = os.getenv("BENCH_SERVER_LOG", os.path.join(tempfile.gettempdir(), "lms_load_server.log"))
+
+# Relative weights of the scenarios; each is one Visitor method
+MIX = {
+    "login": 3,
+    "browse_lesson": 25,
+    "list_lessons": 10,
+    "search": 6,
+    "submit": 15,
+    "student_dashboard": 20,
+    "grading_queue": 6,
+    "grade": 8,
+    "instructor_dashboard": 5,
+    "gradebook": 2,
+}
+COMPARE_MIN_REQUESTS = 50
+
+
+class Fixture:
+    """The seeded ids the scenarios pick from, read once from the database."""
+
+    @classmethod
+    async def load(cls, database_url):
+        fixture = cls()
+        conn = await asyncpg.connect(database_url)
+        try:
+            fixture.students = [tuple(row) for row in await conn.fetch("""
+                SELECT u.id, u.email, e.cohort_id FROM users u JOIN enrollments e ON e.user_id = u.id ORDER BY u.id
+            """)]
+            fixture.instructors = {row["cohort_id"]: (row["id"], row["email"]) for row in await conn.fetch("""
+                SELECT u.id, u.email, u.cohort_id FROM users u JOIN roles r ON r.id = u.role_id
+                WHERE r.name = 'instructor' AND u.cohort_id IS NOT NULL ORDER BY u.id
+            """)}
+            fixture.curricula = {row["cohort_id"]: row["id"] for row in await conn.fetch(
+                "SELECT id, cohort_id FROM curriculum WHERE cohort_id IS NOT NULL ORDER BY id"
+            )}
+            fixture.lessons = defaultdict(list)
+            fixture.assignments = defaultdict(list)
+            for row in await conn.fetch("""
+                SELECT c.cohort_id, l.id AS lesson_id, a.id AS assignment_id
+                FROM curriculum c JOIN lessons l ON l.curriculum_id = c.id LEFT JOIN assignments a ON a.lesson_id = l.id
+                WHERE c.cohort_id IS NOT NULL ORDER BY l.id, a.id
+            """):
+                if not fixture.lessons[row["cohort_id"]] or fixture.lessons[row["cohort_id"]][-1] != row["lesson_id"]:
+                    fixture.lessons[row["cohort_id"]].append(row["lesson_id"])
+                if row["assignment_id"] is not None:
+                    fixture.assignments[row["cohort_id"]].append(row["assignment_id"])
+            fixture.max_lesson_id = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM lessons")
+            fixture.dataset = {
+                table: await conn.fetchval(f"SELECT count(*) FROM {table}")
+                for table in ("users", "cohorts", "lessons", "assignments", "enrollments", "submissions", "grades")
+            }
+        finally:
+            await conn.close()
+        fixture.students = [student for student in fixture.students if student[2] in fixture.instructors]
+        if not fixture.students:
+            raise SystemExit(f"No students with an instructor in {database_url}; run python -m benchmarks.seed first")
+        return fixture
+
+
+class Recorder:
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, status, seconds, started):
+        if started >= self.measure_from:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+
+class Visitor:
+    """One virtual user: a student, plus the instructor of their cohort."""
+
+    def __init__(self, client, fixture, recorder, rng):
+        self.client = client
+        self.fixture = fixture
+        self.recorder = recorder
+        self.rng = rng
+        self.student_token = None
+        self.instructor_token = None
+
+    async def call(self, method, route, path, token=None, **kwargs):
+        """Send one request, recorded under its route template; returns the response, or None on a transport error."""
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=headers, **kwargs)
+            # Streamed bodies (gradebook, content) count until the last byte
+            await response.aread()
+            status = str(response.status_code)
+        except httpx.HTTPError as error:
+            response, status = None, type(error).__name__
+        self.recorder.record(f"{method} {route}", status, time.perf_counter() - started, started)
+        return response
+
+    async def log_in(self, email):
+        response = await self.call("POST", "/auth/request_code", "/auth/request_code", json={"email": email})
+        if response is None or response.status_code != 200 or "code" not in response.json():
+            return None
+        response = await self.call(
+            "POST", "/auth/verify_code", "/auth/verify_code", json={"email": email, "code": response.json()["code"]}
+        )
+        return response.json()["token"] if response is not None and response.status_code == 200 else None
+
+    async def become(self, student):
+        self.user_id, email, self.cohort_id = student
+        self.instructor_id, instructor_email = self.fixture.instructors[self.cohort_id]
+        self.student_token = await self.log_in(email)
+        self.instructor_token = await self.log_in(instructor_email)
+
+    async def login(self):
+        await self.become(self.rng.choice(self.fixture.students))
+
+    async def browse_lesson(self):
+        curriculum_id = self.fixture.curricula[self.cohort_id]
+        lesson_id = self.rng.choice(self.fixture.lessons[self.cohort_id])
+        await self.call("GET", "/curriculum/{curriculum_id}/tree", f"/curriculum/{curriculum_id}/tree", self.student_token)
+        await self.call("GET", "/lessons/{lesson_id}", f"/lessons/{lesson_id}", self.student_token)
+        await self.call(
+            "GET", "/lessons/{lesson_id}/content", f"/lessons/{lesson_id}/content", self.student_token,
+            headers={"Accept-Encoding": "br, gzip"},
+        )
+
+    async def list_lessons(self):
+        after = self.rng.randint(0, max(self.fixture.max_lesson_id - 50, 0))
+        await self.call("GET", "/lessons", "/lessons", self.student_token, params={"limit": 50, "after": after})
+
+    async def search(self):
+        words = " ".join(self.rng.sample(WORDS, self.rng.choice((1, 1, 2))))
+        params = {"q": words, "limit": 20}
+        if self.rng.random() < 0.5:
+            params["cohort_id"] = self.cohort_id
+        await self.call("GET", "/search", "/search", self.student_token, params=params)
+
+    async def submit(self):
+        assignment_id = self.rng.choice(self.fixture.assignments[self.cohort_id])
+        await self.call("POST", "/submissions", "/submissions", self.student_token, json={
+            "assignment_id": assignment_id,
+            "user_id": self.user_id,
+            "file_url": f"https://files.example.com/{self.user_id}/{assignment_id}-{self.rng.randint(1, 10**6)}.pdf",
+        })
+
+    async def student_dashboard(self):
+        await self.call("GET", "/student/dashboard/{user_id}", f"/student/dashboard/{self.user_id}", self.student_token)
+
+    async def grading_queue(self):
+        await self.call(
+            "GET", "/grading/queue", "/grading/queue", self.instructor_token, params={"cohort_id": self.cohort_id, "limit": 50}
+        )
+
+    async def grade(self):
+        response = await self.call("POST", "/grading/claims", "/grading/claims", self.instructor_token, json={
+            "grader_id": self.instructor_id, "cohort_id": self.cohort_id, "batch_size": 3,
+        })
+        if response is None or response.status_code != 200:
+            return
+        for claim in response.json():
+            await self.call(
+                "POST", "/grading/claims/{submission_id}/grade", f"/grading/claims/{claim['id']}/grade", self.instructor_token,
+                json={"grader_id": self.instructor_id, "score": self.rng.randint(40, 100), "feedback": "Graded under load."},
+            )
+
+    async def instructor_dashboard(self):
+        await self.call(
+            "GET", "/instructor/assignments/{instructor_id}", f"/instructor/assignments/{self.instructor_id}", self.instructor_token
+        )
+
+    async def gradebook(self):
+        await self.call("GET", "/cohorts/{cohort_id}/gradebook", f"/cohorts/{self.cohort_id}/gradebook", self.instructor_token)
+
+
+def parse_mix(text):
+    mix = dict(MIX)
+    for item in filter(None, (item.strip() for item in text.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in MIX:
+            raise SystemExit(f"Unknown scenario {name!r} in BENCH_MIX; known: {', '.join(MIX)}")
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, statuses, seconds):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "throughput_rps": round(len(ordered) / seconds, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "statuses": dict(sorted(statuses.items())),
+        "errors": sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 500),
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def start_server():
+    """Run the app under uvicorn on a free port; returns (process, base URL)."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    env = {
+        **os.environ,
+        "DATABASE_URL": BENCH_DATABASE_URL,
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "LOG_FILE": BENCH_SERVER_LOG,
+        "EMAIL_TRANSPORT": os.getenv("EMAIL_TRANSPORT", "log"),
+        "AUTH_TOKEN_SECRET": os.getenv("AUTH_TOKEN_SECRET", "benchmark-secret"),
+        "AUTH_CODE_IP_BURST": "1000000000",
+        "AUTH_CODE_IP_PER_MINUTE": "1000000000",
+        "AUTH_CODE_EMAIL_BURST": "1000000000",
+        "AUTH_CODE_EMAIL_PER_MINUTE": "1000000000",
+    }
+    with open(BENCH_SERVER_LOG + ".console", "w") as console:
+        process = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(BENCH_WORKERS), "--no-access-log", "--log-level", "warning",
+        ], env=env, stdout=subprocess.DEVNULL, stderr=console)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_healthy(client, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}; see {BENCH_SERVER_LOG}.console")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("Server did not become healthy")
+
+
+async def run(base_url, fixture, mix, process=None):
+    rng = random.Random(BENCH_SEED)
+    limits = httpx.Limits(max_connections=BENCH_CONCURRENCY, max_keepalive_connections=BENCH_CONCURRENCY)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await wait_until_healthy(client, process)
+        started = time.perf_counter()
+        recorder = Recorder(started + BENCH_WARMUP)
+        stop_at = started + BENCH_WARMUP + BENCH_DURATION
+        names, weights = list(mix), list(mix.values())
+
+        async def visit(visitor):
+            await visitor.login()
+            while time.perf_counter() < stop_at:
+                await getattr(visitor, visitor.rng.choices(names, weights)[0])()
+
+        visitors = [Visitor(client, fixture, recorder, random.Random(rng.random())) for _ in range(BENCH_CONCURRENCY)]
+        await asyncio.gather(*(visit(visitor) for visitor in visitors))
+        # Scenarios that started before the deadline may finish after it
+        measured = max(time.perf_counter(), stop_at) - recorder.measure_from
+    routes = {
+        route: summarize(recorder.latencies[route], recorder.statuses[route], measured)
+        for route in sorted(recorder.latencies)
+    }
+    total_statuses = defaultdict(int)
+    for statuses in recorder.statuses.values():
+        for status, count in statuses.items():
+            total_statuses[status] += count
+    return {
+        **git_revision(),
+        "started_at": datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "config": {
+            "url": BENCH_URL or "spawned",
+            "workers": BENCH_WORKERS if BENCH_URL is None else None,
+            "concurrency": BENCH_CONCURRENCY,
+            "duration_seconds": BENCH_DURATION,
+            "warmup_seconds": BENCH_WARMUP,
+            "mix": mix,
+            "seed": BENCH_SEED,
+        },
+        "dataset": fixture.dataset,
+        "total": summarize([seconds for latencies in recorder.latencies.values() for seconds in latencies], total_statuses, measured),
+        "routes": routes,
+    }
+
+
+def print_report(report, stream=sys.stderr):
+    print(f"{'route':<48} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}", file=stream)
+    for route, result in [*report["routes"].items(), ("total", report["total"])]:
+        print(
+            f"{route:<48} {result['throughput_rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}"
+            f" {result['p99_ms']:>8.1f} {result['errors']:>6}", file=stream,
+        )
+
+
+def compare(before_path, after_path, threshold=BENCH_REGRESSION):
+    """Print per-route changes between two reports; returns the routes whose p95 regressed past `threshold`."""
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"{(before.get('commit') or '?')[:10]} -> {(after.get('commit') or '?')[:10]}")
+    print(f"{'route':<48} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'req/s':>17}")
+    regressed = []
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        old, new = before["routes"].get(route), after["routes"].get(route)
+        if old is None or new is None:
+            print(f"{route:<48} only in {'after' if old is None else 'before'}")
+            continue
+        cells = []
+        for field in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            change = (new[field] - old[field]) / old[field] if old[field] else 0.0
+            cells.append(f"{new[field]:>9.1f} {change:>+7.0%}")
+        print(f"{route:<48} {' '.join(cells)}")
+        if (
+            min(old["requests"], new["requests"]) >= COMPARE_MIN_REQUESTS
+            and old["p95_ms"] and (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] > threshold
+        ):
+            regressed.append(route)
+    for route in regressed:
+        print(f"REGRESSION: {route} p95 {before['routes'][route]['p95_ms']} -> {after['routes'][route]['p95_ms']} ms")
+    return regressed
+
+
+async def main():
+    mix = parse_mix(BENCH_MIX)
+    fixture = await Fixture.load(BENCH_DATABASE_URL)
+    process, base_url = (None, BENCH_URL) if BENCH_URL else start_server()
+    try:
+        report = await run(base_url, fixture, mix, process)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    print_report(report)
+    output = json.dumps(report, indent=2)
+    if BENCH_OUTPUT:
+        with open(BENCH_OUTPUT, "w") as report_file:
+            report_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API load benchmark.")
+    subcommands = parser.add_subparsers(dest="command")
+    compare_parser = subcommands.add_parser("compare", help="Compare two JSON reports.")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION, help="Allowed p95 growth, as a fraction.")
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args.before, args.after, args.threshold) else 0)
+    asyncio.run(main())
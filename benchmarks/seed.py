@@ -0,0 +1,289 @@
+"""
+Load a synthetic LMS of realistic size for the load and plan benchmarks.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/lms_load python -m benchmarks.seed
+
+The database is created from the app's DDL and migrations if needed, then
+EMPTIED and filled with BENCH_USERS users (BENCH_COHORTS instructors, one
+admin per thousand users, the rest students), one published curriculum
+per cohort of BENCH_LESSONS lessons with BENCH_ASSIGNMENTS assignments
+each, BENCH_EVENTS events per cohort, about BENCH_SUBMISSIONS submissions
+and BENCH_GRADED of those graded, plus BENCH_AUTH_CODES login codes from
+the last twelve hours with their emails. Every student is enrolled in one cohort
+and only submits that cohort's assignments. The same BENCH_SEED gives the
+same rows.
+
+Rows go in with COPY, with triggers and foreign key checks switched off
+for the session (so the role must be a superuser). The per-student status
+rows the triggers would have written are then built with one INSERT, and
+the tables analyzed. Lesson bodies come from a pool of BENCH_LESSON_BODIES
+distinct pages, rendered here, so the server starts with nothing to
+backfill. At the defaults this takes about a minute.
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost/lms_load")
+BENCH_USERS = int(os.getenv("BENCH_USERS", "10000"))
+BENCH_COHORTS = int(os.getenv("BENCH_COHORTS", "500"))
+BENCH_LESSONS = int(os.getenv("BENCH_LESSONS", "10"))
+BENCH_ASSIGNMENTS = int(os.getenv("BENCH_ASSIGNMENTS", "12"))
+BENCH_EVENTS = int(os.getenv("BENCH_EVENTS", "20"))
+BENCH_SUBMISSIONS = int(os.getenv("BENCH_SUBMISSIONS", "1000000"))
+BENCH_GRADED = float(os.getenv("BENCH_GRADED", "0.7"))
+BENCH_AUTH_CODES = int(os.getenv("BENCH_AUTH_CODES", "100000"))
+BENCH_LESSON_BODIES = int(os.getenv("BENCH_LESSON_BODIES", "50"))
+BENCH_SEED = int(os.getenv("BENCH_SEED", "1"))
+
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import asyncpg
+
+from app.markdown_render import RENDERER_VERSION, content_hash, render
+from app.migrate import migrate
+from app.models import USER_TABLE_DDL
+
+# Also the search terms the load driver asks for
+WORDS = (
+    "algebra array async binary cache class closure compiler database debugging design dictionary "
+    "function generator graph hashing index integer iterator join lambda latency linked list loop "
+    "matrix memory module network object parser pointer pointers probability query queue recursion "
+    "regression scheduling schema sorting stack statistics string testing thread tree types variables"
+).split()
+
+DATA_TABLES = (
+    "student_assignment_status", "grading_claims", "grades", "submissions", "enrollments", "events",
+    "assignments", "lessons", "lesson_renders", "curriculum", "auth_codes", "email_outbox", "users", "cohorts",
+)
+SERIAL_TABLES = ("cohorts", "users", "curriculum", "lessons", "assignments", "events", "enrollments", "submissions", "grades", "email_outbox")
+
+# What the status triggers (migration 0003) would have written, for every student at once
+STATUS_REBUILD = """
+    INSERT INTO student_assignment_status (
+        user_id, assignment_id, lesson_id, title, due_date, max_score, status,
+        submission_id, submitted_at, score, feedback, graded_at
+    )
+    SELECT
+        e.user_id, a.id, a.lesson_id, a.title, a.due_date, a.max_score,
+        CASE WHEN g.id IS NOT NULL THEN 'graded' WHEN s.id IS NOT NULL THEN 'submitted' ELSE 'pending' END,
+        s.id, s.submitted_at, g.score, g.feedback, g.graded_at
+    FROM enrollments e
+    JOIN curriculum c ON c.cohort_id = e.cohort_id
+    JOIN lessons l ON l.curriculum_id = c.id
+    JOIN assignments a ON a.lesson_id = l.id
+    LEFT JOIN submissions s ON s.assignment_id = a.id AND s.user_id = e.user_id
+    LEFT JOIN grades g ON g.submission_id = s.id
+"""
+
+
+class Layout:
+    """Ids of everything the seed writes; the load driver reads the same layout back from the database."""
+
+    def __init__(self, users=BENCH_USERS, cohorts=BENCH_COHORTS, lessons=BENCH_LESSONS, assignments=BENCH_ASSIGNMENTS):
+        self.cohorts = cohorts
+        self.admins = max(1, users // 1000)
+        self.students = users - self.admins - cohorts
+        if self.students < cohorts:
+            raise ValueError(f"{users} users is too few for {cohorts} cohorts with a student each")
+        self.lessons = lessons
+        self.assignments = assignments
+
+    def instructor_id(self, cohort_id):
+        return self.admins + cohort_id
+
+    def student_ids(self):
+        return range(self.admins + self.cohorts + 1, self.admins + self.cohorts + self.students + 1)
+
+    def student_cohort(self, user_id):
+        return (user_id - self.admins - self.cohorts - 1) % self.cohorts + 1
+
+    def lesson_ids(self, cohort_id):
+        first = (cohort_id - 1) * self.lessons + 1
+        return range(first, first + self.lessons)
+
+    def assignment_ids(self, lesson_id):
+        first = (lesson_id - 1) * self.assignments + 1
+        return range(first, first + self.assignments)
+
+
+def _phrase(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def lesson_bodies(rng, count):
+    """`count` distinct lesson pages of a few kilobytes: headings, prose, lists, code and a table."""
+    bodies = []
+    for number in range(count):
+        sections = []
+        for section in range(rng.randint(3, 6)):
+            paragraphs = "\n\n".join(
+                " ".join(_phrase(rng, rng.randint(8, 16)).capitalize() + "." for _ in range(rng.randint(2, 5)))
+                for _ in range(rng.randint(1, 3))
+            )
+            bullets = "\n".join(f"- **{rng.choice(WORDS)}**: {_phrase(rng, 6)}" for _ in range(rng.randint(2, 5)))
+            sections.append(f"## {_phrase(rng, 3).title()}\n\n{paragraphs}\n\n{bullets}")
+        code = "\n".join(f"    {word} = {word}_{index}()" for index, word in enumerate(rng.sample(WORDS, 4)))
+        table = "| term | meaning |\n| --- | --- |\n" + "\n".join(f"| {word} | {_phrase(rng, 4)} |" for word in rng.sample(WORDS, 3))
+        bodies.append(f"# Lesson page {number + 1}\n\n" + "\n\n".join(sections) + f"\n\n```python\n{code}\n```\n\n{table}\n")
+    return bodies
+
+
+def submissions(layout, rng, now):
+    """(id, assignment_id, user_id, file_url, submitted_at, grade) for each submission; grade is None or (score, feedback)."""
+    pairs = layout.students * layout.lessons * layout.assignments
+    rate = min(1.0, BENCH_SUBMISSIONS / pairs)
+    submission_id = 0
+    for user_id in layout.student_ids():
+        for lesson_id in layout.lesson_ids(layout.student_cohort(user_id)):
+            for assignment_id in layout.assignment_ids(lesson_id):
+                if rng.random() >= rate:
+                    continue
+                submission_id += 1
+                submitted_at = now - datetime.timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+                grade = None
+                if rng.random() < BENCH_GRADED:
+                    grade = (rng.randint(40, 100), rng.choice((None, "Good work.", "See the comments inline.")))
+                yield submission_id, assignment_id, user_id, f"https://files.example.com/{user_id}/{assignment_id}.pdf", submitted_at, grade
+
+
+async def seed(conn, layout=None):
+    """Replace everything in the database with the synthetic data set; returns row counts per table."""
+    layout = layout or Layout()
+    rng = random.Random(BENCH_SEED)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    today = now.date()
+
+    await conn.execute(USER_TABLE_DDL)
+    await migrate(conn)
+    await conn.execute("INSERT INTO roles (name) VALUES ('student'), ('instructor'), ('admin') ON CONFLICT DO NOTHING")
+    role_ids = {row["name"]: row["id"] for row in await conn.fetch("SELECT id, name FROM roles")}
+
+    async with conn.transaction():
+        await conn.execute(f"TRUNCATE {', '.join(DATA_TABLES)} RESTART IDENTITY")
+        # Skips the per-row status triggers and foreign key checks for this transaction
+        await conn.execute("SET LOCAL session_replication_role = replica")
+
+        cohort_starts = {cohort_id: today - datetime.timedelta(days=rng.randint(0, 120)) for cohort_id in range(1, layout.cohorts + 1)}
+        await conn.copy_records_to_table("cohorts", columns=["id", "name", "start_date", "end_date"], records=(
+            (cohort_id, f"Cohort {cohort_id}", start, start + datetime.timedelta(days=120))
+            for cohort_id, start in cohort_starts.items()
+        ))
+
+        def users():
+            for user_id in range(1, layout.admins + 1):
+                yield user_id, f"admin{user_id}@example.com", f"Admin {user_id}", role_ids["admin"], None
+            for cohort_id in range(1, layout.cohorts + 1):
+                user_id = layout.instructor_id(cohort_id)
+                yield user_id, f"instructor{cohort_id}@example.com", f"Instructor {cohort_id}", role_ids["instructor"], cohort_id
+            for user_id in layout.student_ids():
+                yield user_id, f"student{user_id}@example.com", f"Student {user_id}", role_ids["student"], layout.student_cohort(user_id)
+        await conn.copy_records_to_table("users", columns=["id", "email", "full_name", "role_id", "cohort_id"], records=users())
+
+        await conn.copy_records_to_table("enrollments", columns=["user_id", "cohort_id"], records=(
+            (user_id, layout.student_cohort(user_id)) for user_id in layout.student_ids()
+        ))
+
+        await conn.copy_records_to_table("curriculum", columns=["id", "title", "description", "cohort_id", "published"], records=(
+            (cohort_id, f"{_phrase(rng, 2).title()} (cohort {cohort_id})", _phrase(rng, 12), cohort_id, True)
+            for cohort_id in range(1, layout.cohorts + 1)
+        ))
+
+        renders = []
+        for markdown in lesson_bodies(rng, BENCH_LESSON_BODIES):
+            html, html_gzip, html_br = render(markdown)
+            renders.append((content_hash(markdown), markdown, html, html_gzip, html_br))
+        await conn.copy_records_to_table("lesson_renders", columns=["content_hash", "renderer", "html", "html_gzip", "html_br"], records=(
+            (digest, RENDERER_VERSION, html, html_gzip, html_br) for digest, _, html, html_gzip, html_br in renders
+        ))
+
+        def lessons():
+            for cohort_id in range(1, layout.cohorts + 1):
+                for order_index, lesson_id in enumerate(layout.lesson_ids(cohort_id), start=1):
+                    digest, markdown, html, _, _ = rng.choice(renders)
+                    title = f"Week {order_index}: {_phrase(rng, 3).title()}"
+                    yield lesson_id, cohort_id, title, markdown, order_index, digest, html
+        await conn.copy_records_to_table("lessons", columns=[
+            "id", "curriculum_id", "title", "content_markdown", "order_index", "content_hash", "content_html",
+        ], records=lessons())
+
+        def assignments():
+            for cohort_id, start in cohort_starts.items():
+                for week, lesson_id in enumerate(layout.lesson_ids(cohort_id), start=1):
+                    for assignment_id in layout.assignment_ids(lesson_id):
+                        due = datetime.datetime.combine(start, datetime.time(23, 59)) + datetime.timedelta(weeks=week)
+                        yield assignment_id, lesson_id, f"{_phrase(rng, 3).capitalize()} exercise", _phrase(rng, 20), due, 100
+        await conn.copy_records_to_table("assignments", columns=[
+            "id", "lesson_id", "title", "description", "due_date", "max_score",
+        ], records=assignments())
+
+        def events():
+            for cohort_id, start in cohort_starts.items():
+                for number in range(BENCH_EVENTS):
+                    begins = datetime.datetime.combine(start, datetime.time(17)) + datetime.timedelta(days=number * 3)
+                    yield (
+                        cohort_id, f"Session {number + 1}", _phrase(rng, 8), rng.choice(("class", "meeting", "deadline")),
+                        begins, begins + datetime.timedelta(hours=2), "Room 101",
+                    )
+        await conn.copy_records_to_table("events", columns=[
+            "cohort_id", "title", "description", "event_type", "start_time", "end_time", "location",
+        ], records=events())
+
+        # Generated twice from the same seed rather than held in memory
+        submission_seed = rng.random()
+        await conn.copy_records_to_table("submissions", columns=[
+            "id", "assignment_id", "user_id", "file_url", "submitted_at",
+        ], records=(row[:5] for row in submissions(layout, random.Random(submission_seed), now)))
+        await conn.copy_records_to_table("grades", columns=[
+            "submission_id", "grader_id", "score", "feedback", "graded_at",
+        ], records=(
+            (submission_id, layout.instructor_id(layout.student_cohort(user_id)), grade[0], grade[1],
+             min(submitted_at + datetime.timedelta(hours=36), now))
+            for submission_id, _, user_id, _, submitted_at, grade in submissions(layout, random.Random(submission_seed), now)
+            if grade is not None
+        ))
+
+        # Mostly used or expired, as on a live system between sweeps
+        await conn.execute("SELECT ensure_auth_code_partitions()")
+        codes = []
+        for _ in range(BENCH_AUTH_CODES):
+            user_id = rng.choice(layout.student_ids())
+            created_at = now - datetime.timedelta(seconds=rng.randint(0, 12 * 3600))
+            codes.append((f"student{user_id}@example.com", f"{rng.randint(0, 999999):06d}", created_at))
+        await conn.copy_records_to_table("auth_codes", columns=["email", "code", "expires_at", "used", "created_at"], records=(
+            (email, code, created_at + datetime.timedelta(minutes=10), rng.random() < 0.9, created_at)
+            for email, code, created_at in codes
+        ))
+        await conn.copy_records_to_table("email_outbox", columns=[
+            "to_email", "subject", "html_content", "status", "attempts", "next_attempt_at", "created_at", "sent_at",
+        ], records=(
+            (email, "Your Magic Login Code", None, "sent", 1, created_at, created_at, created_at)
+            for email, code, created_at in codes
+        ))
+
+        await conn.execute(STATUS_REBUILD)
+        for table in SERIAL_TABLES:
+            await conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST(MAX(id), 1)) FROM {table}")
+
+    await conn.execute("VACUUM ANALYZE")
+    return {table: await conn.fetchval(f"SELECT count(*) FROM {table}") for table in DATA_TABLES}
+
+
+async def main():
+    started = time.perf_counter()
+    conn = await asyncpg.connect(BENCH_DATABASE_URL)
+    try:
+        counts = await seed(conn)
+    finally:
+        await conn.close()
+    print(f"Seeded {BENCH_DATABASE_URL} in {time.perf_counter() - started:.1f}s")
+    for table, count in counts.items():
+        print(f"{table:>26}: {count:>9,}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
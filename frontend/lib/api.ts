@@ -1,20 +1,21 @@
-import type { Curriculum, Lesson, AssignmentSubmission, Event } from "@/types/api"
+import type { Curriculum, CurriculumTree, Lesson, AssignmentSubmission, Event } from "@/types/api"
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000"
 
 async function fetcher<T>(endpoint: string, options?: RequestInit): Promise<T> {
   try {
-    // Try to get user email from localStorage/session for demo; fallback to example
+    // Prefer the session token from /auth/verify_code; the email header is the legacy fallback
     let userEmail = "user@example.com"
+    let sessionToken: string | null = null
     if (typeof window !== "undefined") {
       userEmail = localStorage.getItem("userEmail") || userEmail
+      sessionToken = localStorage.getItem("sessionToken")
     }
     const response = await fetch(`${API_BASE_URL}${endpoint}`, {
       ...options,
       headers: {
         "Content-Type": "application/json",
-        // TODO: Replace with JWT/session token in production
-        "X-User-Email": userEmail,
+        ...(sessionToken ? { Authorization: `Bearer ${sessionToken}` } : { "X-User-Email": userEmail }),
         ...options?.headers,
       },
     })
@@ -41,9 +42,17 @@ export const requestAuthCode = (email: string) =>
     body: JSON.stringify({ email }),
   })
 
+export const verifyAuthCode = (email: string, code: string) =>
+  fetcher<{ message: string; email: string; token: string; token_type: "bearer"; expires_at: string }>("/auth/verify_code", {
+    method: "POST",
+    body: JSON.stringify({ email, code }),
+  })
+
 // --- Curriculum & Lessons ---
 export const getCurricula = () => fetcher<Curriculum[]>("/curriculum")
 export const getLessons = () => fetcher<Lesson[]>("/lessons")
+// One request for a whole course: lessons in order, each with its assignments
+export const getCurriculumTree = (curriculumId: number) => fetcher<CurriculumTree>(`/curriculum/${curriculumId}/tree`)
 
 // --- Assignments & Submissions ---
 export const getStudentAssignments = (userId: number) =>
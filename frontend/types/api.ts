@@ -38,6 +38,14 @@ export interface Assignment {
   max_score: number
 }
 
+export interface LessonWithAssignments extends Lesson {
+  assignments: Assignment[]
+}
+
+export interface CurriculumTree extends Curriculum {
+  lessons: LessonWithAssignments[]
+}
+
 export interface Grade {
   id: number
   submission_id: number
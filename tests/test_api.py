@@ -2,9 +2,19 @@ import os
 import pytest
 import asyncpg
 import asyncio
+import json
+import tempfile
+import time
 
 TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "postgresql://localhost/lms_test_db")
 os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+# Keep test runs out of the committed lms_backend.log
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "lms_backend_test.log"))
+os.environ["EMAIL_TRANSPORT"] = "fake"
+os.environ["EMAIL_POLL_SECONDS"] = "0.05"
+os.environ["EMAIL_RETRY_BASE_SECONDS"] = "0.05"
+# Most tests authenticate with the legacy X-User-Email header
+os.environ["AUTH_ALLOW_EMAIL_HEADER"] = "true"
 
 @pytest.fixture(scope="function")
 def client():
@@ -22,13 +32,18 @@ def client():
             END $$;
             """)
             from app.models import USER_TABLE_DDL
+            from app.migrate import migrate
             await conn.execute(USER_TABLE_DDL)
+            await migrate(conn)
             # Insert test data
             await conn.execute("INSERT INTO roles (id, name) VALUES (1, 'student'), (2, 'instructor'), (3, 'admin') ON CONFLICT DO NOTHING;")
-            await conn.execute("INSERT INTO users (id, email, full_name, role_id) VALUES (1, 'student@example.com', 'Student User', 1), (2, 'instructor@example.com', 'Instructor User', 2) ON CONFLICT DO NOTHING;")
+            await conn.execute("INSERT INTO users (id, email, full_name, role_id) VALUES (1, 'student@example.com', 'Student User', 1), (2, 'instructor@example.com', 'Instructor User', 2), (3, 'admin@example.com', 'Admin User', 3) ON CONFLICT DO NOTHING;")
             await conn.execute("INSERT INTO curriculum (id, title) VALUES (1, 'Test Curriculum') ON CONFLICT DO NOTHING;")
             await conn.execute("INSERT INTO lessons (id, curriculum_id, title) VALUES (1, 1, 'Test Lesson') ON CONFLICT DO NOTHING;")
             await conn.execute("INSERT INTO assignments (id, lesson_id, title, description, due_date, max_score) VALUES (1, 1, 'Test Assignment', 'Desc', NOW(), 100) ON CONFLICT DO NOTHING;")
+            # Seeded rows use explicit ids; move the sequences past them
+            for table in ("roles", "users", "curriculum", "lessons", "assignments"):
+                await conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
             # Debug: check assignments table
             row = await conn.fetchrow("SELECT * FROM assignments WHERE id=1;")
             if not row:
@@ -41,7 +56,7 @@ def client():
     from app.main import app
     from app.db import db
     asyncio.run(db.disconnect())
-    asyncio.run(db.connect())
+    # The app's startup handler opens the pool inside the TestClient's loop
     from fastapi.testclient import TestClient
     with TestClient(app) as c:
         yield c
@@ -132,6 +147,15 @@ def test_grading_and_dashboards(client):
     grades = response.json()
     assert any(g["grader_id"] == grader_id for g in grades)
 
+    # A second grader cannot grade it again; the first can revise their grade
+    response = client.post("/grades", json={"submission_id": submission_id, "grader_id": 3, "score": 10}, headers={"X-User-Email": "instructor@example.com"})
+    assert response.status_code == 409
+    response = client.post("/grades", json={"submission_id": submission_id, "grader_id": grader_id, "score": 90}, headers={"X-User-Email": "instructor@example.com"})
+    assert response.status_code == 200
+    assert [(g["grader_id"], g["score"]) for g in client.get(f"/grades/{submission_id}").json()] == [(grader_id, 90)]
+    response = client.post("/grades", json={"submission_id": 9999, "grader_id": grader_id, "score": 1}, headers={"X-User-Email": "instructor@example.com"})
+    assert response.status_code == 404
+
     # Instructor dashboard
     instructor_id = grader_id
     response = client.get(f"/instructor/assignments/{instructor_id}", headers={"X-User-Email": "instructor@example.com"})
@@ -144,4 +168,982 @@ def test_grading_and_dashboards(client):
     response = client.get(f"/student/assignments/{user_id}")
     assert response.status_code == 200
     student_assignments = response.json()
-    assert isinstance(student_assignments, list) 
\ No newline at end of file
+    assert isinstance(student_assignments, list) 
+
+
+def test_content_cache_hits_and_invalidation(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    # The listener connects in the background and clears the cache when it does
+    for _ in range(100):
+        if client.get("/cache/stats").json()["listening"]:
+            break
+        time.sleep(0.02)
+    before = client.get("/cache/stats").json()
+    assert client.get("/curriculum/1").json()["title"] == "Test Curriculum"
+    assert client.get("/curriculum/1").json()["title"] == "Test Curriculum"
+    after = client.get("/cache/stats").json()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    # Only bounded list pages are cached
+    client.get("/curriculum")
+    assert client.get("/cache/stats").json()["entries"] == 1
+    client.get("/curriculum?limit=10")
+    assert client.get("/cache/stats").json()["entries"] == 2
+
+    # A write through the API invalidates the cached row and list
+    response = client.put("/curriculum/1", json={"title": "Renamed Curriculum"}, headers=admin)
+    assert response.status_code == 200
+    assert client.get("/curriculum/1").json()["title"] == "Renamed Curriculum"
+    assert [c["title"] for c in client.get("/curriculum?limit=10").json()] == ["Renamed Curriculum"]
+
+    # A NOTIFY from another worker drops the local copy
+    async def rename_elsewhere():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        await conn.execute("UPDATE lessons SET title='Changed Elsewhere' WHERE id=1")
+        await conn.execute("SELECT pg_notify('lms_cache_invalidate', 'lessons')")
+        await conn.close()
+    assert client.get("/lessons/1").json()["title"] == "Test Lesson"
+    asyncio.run(rename_elsewhere())
+    for _ in range(50):
+        if client.get("/lessons/1").json()["title"] == "Changed Elsewhere":
+            break
+        time.sleep(0.05)
+    assert client.get("/lessons/1").json()["title"] == "Changed Elsewhere"
+
+def test_cache_listener_failure_does_not_block_startup(monkeypatch):
+    from app.cache import ContentCache
+    monkeypatch.setattr("app.cache.DATABASE_URL", "postgresql://nobody@127.0.0.1:1/nowhere")
+    monkeypatch.setattr("app.cache.CACHE_LISTEN_RETRY_SECONDS", 0.05)
+
+    async def start_and_stop():
+        cache = ContentCache()
+        await asyncio.wait_for(cache.start(), 1)
+        await asyncio.sleep(0.2)
+        listening = cache.stats()["listening"]
+        await cache.stop()
+        return listening
+
+    assert asyncio.run(start_and_stop()) is False
+
+def test_keyset_pagination_and_streaming(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    for i in range(5):
+        response = client.post("/cohorts", json={"name": f"Cohort {i}", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin)
+        assert response.status_code == 200
+
+    names, after = [], 0
+    while True:
+        response = client.get("/cohorts", params={"limit": 2, "after": after})
+        assert response.status_code == 200
+        names += [c["name"] for c in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        after = int(response.headers["X-Next-Cursor"])
+    assert names == [f"Cohort {i}" for i in range(5)]
+
+    unpaged = client.get("/cohorts").json()
+    streamed = client.get("/cohorts", params={"stream": "true"})
+    assert streamed.status_code == 200
+    assert streamed.json() == unpaged
+    assert client.get("/cohorts", params={"stream": "true", "after": unpaged[-1]["id"]}).json() == []
+    assert client.get("/cohorts", params={"limit": 0}).status_code == 422
+
+
+def normalize_timestamps(rows):
+    # Postgres trims trailing zeros from fractional seconds; compare instants
+    import datetime
+    def parse(value):
+        if isinstance(value, str) and len(value) >= 19 and value[10:11] == "T":
+            return datetime.datetime.fromisoformat(value)
+        return value
+    return [{key: parse(value) for key, value in row.items()} for row in rows]
+
+
+def test_fast_json_lists_match_validated_responses(client, monkeypatch):
+    import app.pagination
+    admin = {"X-User-Email": "admin@example.com"}
+    for i in range(3):
+        client.post("/cohorts", json={"name": f"Cohort {i}", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin)
+    client.post("/submissions", json={"assignment_id": 1, "user_id": 1, "file_url": "https://example.com/a.pdf"})
+    requests = [
+        ("/cohorts", {}),
+        ("/cohorts", {"limit": 2}),
+        ("/cohorts", {"limit": 2, "after": 2}),
+        ("/cohorts", {"limit": 3}),
+        ("/curriculum", {"limit": 5}),
+        ("/lessons", {"limit": 1}),
+        ("/assignments", {}),
+        ("/submissions/1", {"limit": 10}),
+        ("/enrollments/1", {}),
+    ]
+    expected = [client.get(path, params=params) for path, params in requests]
+    monkeypatch.setattr(app.pagination, "FAST_JSON_LISTS", True)
+    for (path, params), slow in zip(requests, expected):
+        fast = client.get(path, params=params)
+        assert fast.status_code == 200
+        assert normalize_timestamps(fast.json()) == normalize_timestamps(slow.json()), path
+        assert fast.headers.get("X-Next-Cursor") == slow.headers.get("X-Next-Cursor"), (path, params)
+
+def test_lesson_markdown_rendered_once_and_served_precompressed(client):
+    from app.lesson_content import renderer
+
+    admin = {"X-User-Email": "admin@example.com"}
+    markdown = "# Loops\n\n<script>alert(1)</script>\n\nUse `for` **often**.\n\n" + "Repeat the drill. " * 200
+    lesson = client.post("/lessons", json={"curriculum_id": 1, "title": "Loops", "content_markdown": markdown}, headers=admin).json()
+    assert lesson["content_html"].startswith("<h1>Loops</h1>")
+    assert "<strong>often</strong>" in lesson["content_html"] and "script" not in lesson["content_html"]
+    assert client.get(f"/lessons/{lesson['id']}").json()["content_html"] == lesson["content_html"]
+    assert [l["content_html"] for l in client.get("/lessons").json()] == [None, lesson["content_html"]]
+
+    url = f"/lessons/{lesson['id']}/content"
+    for accept, encoding in (("gzip, br;q=0.5", "br"), ("gzip", "gzip"), ("br;q=0, deflate", None)):
+        response = client.get(url, headers={"Accept-Encoding": accept})
+        assert response.status_code == 200 and response.text == lesson["content_html"]
+        assert response.headers.get("content-encoding") == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+    compressed = client.get(url, headers={"Accept-Encoding": "br"}).headers["content-length"]
+    assert int(compressed) * 10 < int(response.headers["content-length"])
+    etag = response.headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag, "Accept-Encoding": "gzip"}).status_code == 304
+    assert client.get("/lessons/9999/content").status_code == 404
+
+    # Same markdown again (another lesson, or an edit of other fields) reuses the render
+    rendered, reused = renderer.rendered, renderer.reused
+    client.put(f"/lessons/{lesson['id']}", json={"curriculum_id": 1, "title": "Loops!", "content_markdown": markdown}, headers=admin)
+    copy = client.post("/lessons", json={"curriculum_id": 1, "title": "Loops copy", "content_markdown": markdown}, headers=admin).json()
+    assert (renderer.rendered, renderer.reused) == (rendered, reused + 2)
+    updated = client.put(f"/lessons/{lesson['id']}", json={"curriculum_id": 1, "title": "Loops", "content_markdown": "Plain *text*"}, headers=admin).json()
+    assert updated["content_html"] == "<p>Plain <em>text</em></p>\n" and renderer.rendered == rendered + 1
+    assert client.get(url).text == updated["content_html"]
+
+    # Lessons written without a render are filled in; unused renders are pruned
+    async def legacy_lesson():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute("UPDATE lesson_renders SET created_at = NOW() - interval '1 day'")
+            return await conn.fetchval("INSERT INTO lessons (curriculum_id, title, content_markdown) VALUES (1, 'Old', '- a\n- b') RETURNING id")
+        finally:
+            await conn.close()
+    legacy_id = asyncio.run(legacy_lesson())
+    assert client.portal.call(renderer.backfill) == 1
+    assert client.get(f"/lessons/{legacy_id}").json()["content_html"] == "<ul>\n<li>a</li>\n<li>b</li>\n</ul>\n"
+
+    # Another process holding the backfill lock makes this one skip; a
+    # re-render with the same HTML leaves the lesson's ETag alone
+    async def stale_render(hold_lock):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        if hold_lock:
+            await conn.execute("SELECT pg_advisory_lock(hashtext('lesson_render_backfill'))")
+        await conn.execute("UPDATE lessons SET content_hash = 'older-renderer' WHERE id = $1", legacy_id)
+        return conn
+    etag = client.get(f"/lessons/{legacy_id}").headers["etag"]
+    holder = client.portal.call(stale_render, True)
+    try:
+        assert client.portal.call(renderer.backfill) == 0
+    finally:
+        client.portal.call(holder.close)
+    assert client.portal.call(renderer.backfill) == 1
+    assert client.get(f"/lessons/{legacy_id}").headers["etag"] == etag
+    client.delete(f"/lessons/{copy['id']}", headers=admin)
+    assert client.portal.call(renderer.prune) == 1
+    assert client.get(f"/lessons/{copy['id']}/content").status_code == 404
+
+def test_vault_sync_writes_only_changed_pages(client, tmp_path, monkeypatch):
+    import app.main
+
+    monkeypatch.setattr(app.main, "VAULT_DIR", str(tmp_path))
+    admin = {"X-User-Email": "admin@example.com"}
+    vault = tmp_path / "python-101"
+    (vault / "week-1").mkdir(parents=True)
+    (vault / ".obsidian").mkdir()
+    (vault / "intro.md").write_text("---\ntitle: \"Welcome\"\norder: 1\n---\n\nHello *class*.\n")
+    (vault / "week-1" / "loops.md").write_text("# Loops\n\nUse `for`.\n")
+    (vault / "week-1" / "extra.md").write_text("Extra notes\n")
+    (vault / ".obsidian" / "workspace.md").write_text("ignored")
+    (vault / "notes.txt").write_text("ignored")
+
+    def sync(**body):
+        response = client.post("/curriculum/1/sync", json={"path": "python-101", **body}, headers=admin)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    assert sync() == {"scanned": 3, "unchanged": 0, "created": 3, "updated": 0, "deleted": 0, "kept": [], "dry_run": False}
+    lessons = {l["title"]: l for l in client.get("/lessons").json()}
+    assert lessons["Welcome"]["order_index"] == 1 and lessons["Welcome"]["content_markdown"] == "Hello *class*.\n"
+    assert lessons["Welcome"]["content_html"] == "<p>Hello <em>class</em>.</p>\n"
+    assert {"Loops", "extra", "Test Lesson"} <= set(lessons)
+
+    # Nothing changed: no write transaction at all
+    merges = client.get("/queries/stats").json()["lesson.sync_merge"]["calls"]
+    assert sync()["unchanged"] == 3
+    assert client.get("/queries/stats").json()["lesson.sync_merge"]["calls"] == merges
+
+    # An edit, a removal, and a removal the lesson's assignment blocks
+    client.post("/assignments", json={"lesson_id": lessons["extra"]["id"], "title": "Keep me"}, headers=admin)
+    (vault / "week-1" / "loops.md").write_text("# While loops\n")
+    (vault / "intro.md").unlink()
+    (vault / "week-1" / "extra.md").unlink()
+    assert sync(dry_run=True) == {"scanned": 1, "unchanged": 0, "created": 0, "updated": 1, "deleted": 2, "kept": [], "dry_run": True}
+    assert sync() == {"scanned": 1, "unchanged": 0, "created": 0, "updated": 1, "deleted": 1, "kept": ["week-1/extra.md"], "dry_run": False}
+    titles = {l["title"]: l for l in client.get("/lessons").json()}
+    assert "Welcome" not in titles and "extra" in titles
+    assert titles["While loops"]["id"] == lessons["Loops"]["id"]
+
+    assert client.post("/curriculum/1/sync", json={"path": "../"}, headers=admin).status_code == 400
+    assert client.post("/curriculum/1/sync", json={"path": "missing"}, headers=admin).status_code == 404
+    assert client.post("/curriculum/999/sync", json={"path": "python-101"}, headers=admin).status_code == 404
+
+def test_search_ranks_highlights_and_scopes_by_cohort(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    cohort_id = client.post("/cohorts", json={"name": "Search", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    course = client.post("/curriculum", json={"title": "Python Basics", "description": "Variables and recursion", "cohort_id": cohort_id}, headers=admin).json()
+    titled = client.post("/lessons", json={"curriculum_id": course["id"], "title": "Recursion", "content_markdown": "Functions that call themselves."}, headers=admin).json()
+    body_only = client.post("/lessons", json={"curriculum_id": course["id"], "title": "Loops", "content_markdown": 'Unlike recursion, a loop uses "i" & j to repeat work.'}, headers=admin).json()
+    other = client.post("/lessons", json={"curriculum_id": 1, "title": "Recursive thinking", "content_markdown": "Elsewhere."}, headers=admin).json()
+    task = client.post("/assignments", json={"lesson_id": titled["id"], "title": "Write a recursive factorial"}, headers=admin).json()
+
+    results = client.get("/search", params={"q": "recursion", "cohort_id": cohort_id}).json()
+    # Title matches outrank body matches
+    assert {(r["kind"], r["id"]) for r in results[:2]} == {("lesson", titled["id"]), ("assignment", task["id"])}
+    assert {(r["kind"], r["id"]) for r in results} == {
+        ("lesson", titled["id"]), ("lesson", body_only["id"]), ("assignment", task["id"]), ("curriculum", course["id"]),
+    }
+    assert all(r["cohort_id"] == cohort_id for r in results)
+    loops = next(r for r in results if r["id"] == body_only["id"] and r["kind"] == "lesson")
+    assert loops["snippet"] == "Unlike <mark>recursion</mark>, a loop uses &quot;i&quot; &amp; j to repeat work"
+
+    # Unscoped search sees every cohort; kinds narrow it; vectors follow updates
+    assert ("lesson", other["id"]) in {(r["kind"], r["id"]) for r in client.get("/search", params={"q": "recursion"}).json()}
+    assert {r["kind"] for r in client.get("/search", params={"q": "recursion", "kind": "assignment"}).json()} == {"assignment"}
+    client.put(f"/lessons/{body_only['id']}", json={"curriculum_id": course["id"], "title": "Loops", "content_markdown": "Iteration only."}, headers=admin)
+    assert body_only["id"] not in [r["id"] for r in client.get("/search", params={"q": "recursion", "kind": "lesson"}).json()]
+    assert client.get("/search", params={"q": "the"}).json() == []
+    assert client.get("/search", params={"q": "recursion", "kind": "video"}).status_code == 422
+
+def test_content_conditional_gets(client, monkeypatch):
+    import app.pagination
+    from app.cache import cache
+    from app.queries import LESSON_GET
+    admin = {"X-User-Email": "admin@example.com"}
+
+    response = client.get("/lessons/1")
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    assert client.get("/lessons/1", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/lessons/1", headers={"If-Modified-Since": last_modified}).status_code == 304
+    # Not cached: answered from updated_at alone
+    cache.clear()
+    calls = LESSON_GET.calls
+    assert client.get("/lessons/1", headers={"If-None-Match": etag}).status_code == 304
+    assert LESSON_GET.calls == calls
+    client.put("/lessons/1", json={"curriculum_id": 1, "title": "Edited", "order_index": 1}, headers=admin)
+    response = client.get("/lessons/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+    # List ETags agree across the validated path, the json_agg path and the version query
+    for path, params in (("/lessons", {}), ("/assignments", {"limit": 1}), ("/curriculum", {})):
+        etag = client.get(path, params=params).headers["ETag"]
+        monkeypatch.setattr(app.pagination, "FAST_JSON_LISTS", True)
+        assert client.get(path, params=params).headers["ETag"] == etag, path
+        monkeypatch.setattr(app.pagination, "FAST_JSON_LISTS", False)
+        cache.clear()
+        assert client.get(path, params=params, headers={"If-None-Match": etag}).status_code == 304, path
+    client.post("/lessons", json={"curriculum_id": 1, "title": "Another"}, headers=admin)
+    assert client.get("/lessons", headers={"If-None-Match": client.get("/lessons").headers["ETag"]}).status_code == 304
+    assert client.get("/lessons", headers={"If-None-Match": etag}).status_code == 200
+
+    cohort_id = client.post("/cohorts", json={"name": "Events", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    client.post("/events", json={"cohort_id": cohort_id, "title": "Lab", "start_time": "2024-07-01T10:00:00", "end_time": "2024-07-01T11:00:00"}, headers=admin)
+    etag = client.get(f"/events/{cohort_id}").headers["ETag"]
+    assert client.get(f"/events/{cohort_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/events/{cohort_id}", params={"start": "2025-01-01T00:00:00"}, headers={"If-None-Match": etag}).status_code == 200
+
+def test_get_update_and_delete_round_trips(client):
+    from app.cache import cache
+    admin = {"X-User-Email": "admin@example.com"}
+    curriculum = client.post("/curriculum", json={"title": "Short-lived"}, headers=admin).json()
+    lesson = client.post("/lessons", json={"curriculum_id": curriculum["id"], "title": "Only lesson"}, headers=admin).json()
+    assignment = client.post("/assignments", json={"lesson_id": lesson["id"], "title": "Only task"}, headers=admin).json()
+    for path in (f"/curriculum/{curriculum['id']}", f"/assignments/{assignment['id']}"):
+        etag = client.get(path).headers["ETag"]
+        cache.clear()
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304, path
+
+    cohort = client.post("/cohorts", json={"name": "Temp", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()
+    renamed = client.put(f"/cohorts/{cohort['id']}", json={"name": "Renamed", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin)
+    assert renamed.status_code == 200 and renamed.json()["name"] == "Renamed"
+    enrollment = client.post("/enrollments", json={"user_id": 1, "cohort_id": cohort["id"]}).json()
+    assert client.delete(f"/enrollments/{enrollment['id']}", headers=admin).status_code == 200
+    assert client.get(f"/enrollments/{cohort['id']}").json() == []
+    assert client.delete(f"/cohorts/{cohort['id']}", headers=admin).status_code == 200
+    assert client.get(f"/cohorts/{cohort['id']}").status_code == 404
+
+    assert client.delete(f"/assignments/{assignment['id']}", headers=admin).status_code == 200
+    assert client.get(f"/assignments/{assignment['id']}").status_code == 404
+    client.delete(f"/lessons/{lesson['id']}", headers=admin)
+    assert client.delete(f"/curriculum/{curriculum['id']}", headers=admin).status_code == 200
+    assert client.get(f"/curriculum/{curriculum['id']}").status_code == 404
+
+def test_reads_route_to_replicas_with_failover_and_read_your_writes(client):
+    from app.db import Replica, db
+    from app.models import USER_TABLE_DDL
+    from app.migrate import migrate
+    # A second database stands in for a replica; rows that exist only there
+    # show which side served a read.
+    replica_url = TEST_DATABASE_URL.rsplit("/", 1)[0] + "/lms_test_replica"
+
+    async def create_replica():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute("DROP DATABASE IF EXISTS lms_test_replica")
+            await conn.execute("CREATE DATABASE lms_test_replica")
+        finally:
+            await conn.close()
+        conn = await asyncpg.connect(replica_url)
+        try:
+            await conn.execute(USER_TABLE_DDL)
+            await migrate(conn)
+            await conn.execute("INSERT INTO cohorts (id, name, start_date, end_date) VALUES (1000, 'Replica Only', '2024-07-01', '2024-12-31')")
+        finally:
+            await conn.close()
+    asyncio.run(create_replica())
+
+    replica = Replica(replica_url)
+    client.portal.call(replica.connect, db)
+    db.replicas = [replica]
+    try:
+        assert replica.healthy and replica.lag_seconds == 0
+        assert client.get("/cohorts/1000").json()["name"] == "Replica Only"
+        assert client.get("/db/pool/stats").json()["replicas"][0]["healthy"] is True
+
+        # A write pins this session's reads to the primary
+        response = client.post("/cohorts", json={"name": "Fresh", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers={"X-User-Email": "admin@example.com"})
+        assert "lms_read_primary" in response.cookies
+        fresh_id = response.json()["id"]
+        assert client.get(f"/cohorts/{fresh_id}").json()["name"] == "Fresh"
+        assert client.get("/cohorts/1000").status_code == 404
+        client.cookies.clear()
+        assert client.get("/cohorts/1000").status_code == 200
+
+        # A replica that stops answering is skipped and the primary serves the read
+        client.portal.call(replica.pool.close)
+        assert client.get(f"/cohorts/{fresh_id}").json()["name"] == "Fresh"
+        assert not replica.healthy and replica.failovers == 1
+    finally:
+        db.replicas = []
+        client.portal.call(replica.close)
+
+def test_auth_codes_are_partitioned_swept_and_throttled(client):
+    from app.auth_codes import sweeper
+    from app.main import email_code_limiter, ip_code_limiter
+
+    async def partitions():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            return sorted(await conn.fetchval(
+                "SELECT array_agg(c.relname) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'auth_codes'::regclass"
+            ))
+        finally:
+            await conn.close()
+
+    async def seed_stale_codes():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            # A partition for a day that has ended, and stale rows in today's partitions
+            await conn.execute("CREATE TABLE auth_codes_20000101 PARTITION OF auth_codes FOR VALUES FROM ('2000-01-01') TO ('2000-01-02')")
+            await conn.execute("INSERT INTO auth_codes (email, code, expires_at) VALUES ('old@example.com', '1', '2000-01-01 12:00')")
+            await conn.execute("""
+                INSERT INTO auth_codes (email, code, expires_at, used)
+                SELECT 'stale@example.com', n::text, (NOW() AT TIME ZONE 'UTC')::date + INTERVAL '1 minute', n % 2 = 0
+                FROM generate_series(1, 5) AS n
+            """)
+            await conn.execute("INSERT INTO auth_codes (email, code, expires_at) VALUES ('live@example.com', '7', NOW() + INTERVAL '10 minutes')")
+        finally:
+            await conn.close()
+
+    names = asyncio.run(partitions())
+    assert "auth_codes_default" in names and len(names) >= 4
+    asyncio.run(seed_stale_codes())
+    created, dropped, purged = client.portal.call(sweeper.sweep)
+    assert dropped == 1 and purged >= 2
+    assert "auth_codes_20000101" not in asyncio.run(partitions())
+
+    # After a missed sweep, codes for a new day land in the default
+    # partition; creating that day's partition moves them into it
+    async def codes_in_default_then_partition():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            day = await conn.fetchval("SELECT (NOW() AT TIME ZONE 'UTC')::date + 5")
+            await conn.execute("INSERT INTO auth_codes (email, code, expires_at) VALUES ('late@example.com', '5', $1::date + INTERVAL '1 hour')", day)
+            assert await conn.fetchval("SELECT count(*) FROM auth_codes_default WHERE email = 'late@example.com'") == 1
+            created = await conn.fetchval("SELECT ensure_auth_code_partitions(5)")
+            partition = await conn.fetchval("SELECT tableoid::regclass::text FROM auth_codes WHERE email = 'late@example.com'")
+            return created, partition, day
+        finally:
+            await conn.close()
+    created, partition, day = asyncio.run(codes_in_default_then_partition())
+    assert created >= 1 and partition == f"auth_codes_{day:%Y%m%d}"
+
+    # The code minted below still verifies after a sweep
+    email_code_limiter.clear()
+    ip_code_limiter.clear()
+    code = client.post("/auth/request_code", json={"email": "student@example.com"}).json()["code"]
+    client.portal.call(sweeper.sweep)
+    assert client.post("/auth/verify_code", json={"email": "student@example.com", "code": code}).status_code == 200
+    assert client.post("/auth/verify_code", json={"email": "student@example.com", "code": code}).status_code == 401
+
+    # Bursts are capped per email; other addresses are unaffected
+    statuses = [client.post("/auth/request_code", json={"email": "storm@example.com"}).status_code for _ in range(5)]
+    assert statuses[:2] == [200, 200] and statuses[-1] == 429
+    throttled = client.post("/auth/request_code", json={"email": "storm@example.com"})
+    assert int(throttled.headers["Retry-After"]) >= 1
+    assert client.post("/auth/request_code", json={"email": "calm@example.com"}).status_code == 200
+    email_code_limiter.clear()
+    ip_code_limiter.clear()
+
+def test_session_tokens_authorize_without_role_lookups(client, monkeypatch):
+    from app.auth_tokens import issue_token, revocations, verify_token, InvalidToken
+    from app.main import email_code_limiter, ip_code_limiter
+
+    def login(email):
+        code = client.post("/auth/request_code", json={"email": email}).json()["code"]
+        body = client.post("/auth/verify_code", json={"email": email, "code": code}).json()
+        assert body["token_type"] == "bearer" and body["expires_at"].endswith("Z")
+        return {"Authorization": f"Bearer {body['token']}"}
+
+    admin, student = login("admin@example.com"), login("student@example.com")
+    # A valid code for an address with no user gets no session
+    code = client.post("/auth/request_code", json={"email": "nobody@example.com"}).json()["code"]
+    assert client.post("/auth/verify_code", json={"email": "nobody@example.com", "code": code}).status_code == 401
+    email_code_limiter.clear()
+    ip_code_limiter.clear()
+
+    role_lookups = client.get("/queries/stats").json().get("user.role", {}).get("calls", 0)
+    assert client.get("/admin/protected", headers=admin).status_code == 200
+    assert client.get("/admin/protected", headers=student).status_code == 403
+    assert client.get("/queries/stats").json().get("user.role", {}).get("calls", 0) == role_lookups
+
+    # Legacy header works only where enabled; no credentials, a tampered or an expired token do not
+    assert client.get("/admin/protected", headers={"X-User-Email": "admin@example.com"}).status_code == 200
+    monkeypatch.setattr("app.main.AUTH_ALLOW_EMAIL_HEADER", False)
+    assert client.get("/admin/protected", headers={"X-User-Email": "admin@example.com"}).status_code == 401
+    monkeypatch.setattr("app.main.AUTH_ALLOW_EMAIL_HEADER", True)
+    assert client.get("/admin/protected").status_code == 401
+    payload, _, signature = admin["Authorization"].removeprefix("Bearer ").partition(".")
+    forged = payload[:-2] + ("AA" if payload[-2:] != "AA" else "BB")
+    assert client.get("/admin/protected", headers={"Authorization": f"Bearer {forged}.{signature}"}).status_code == 401
+    expired, _ = issue_token(3, "admin", ttl_seconds=-1)
+    response = client.get("/admin/protected", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401 and response.headers["WWW-Authenticate"] == "Bearer"
+
+    # Logout revokes that token only, until it would have expired
+    assert client.post("/auth/logout", headers=admin).status_code == 200
+    assert client.get("/admin/protected", headers=admin).status_code == 401
+    assert client.post("/auth/logout", headers=admin).status_code == 401
+    token, session = issue_token(3, "admin")
+    revocations.on_invalidate(f"{session.token_id}:{session.expires_at}")  # as relayed from another worker
+    with pytest.raises(InvalidToken):
+        verify_token(token)
+    revocations.clear()
+
+def test_bulk_enrollment_json_and_csv(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    cohort = client.post("/cohorts", json={"name": "Bulk Cohort", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()
+    cohort_id = cohort["id"]
+
+    response = client.post("/enrollments/bulk", json=[
+        {"user_id": 1, "cohort_id": cohort_id},
+        {"user_id": 1, "cohort_id": cohort_id},
+    ], headers=admin)
+    assert response.status_code == 200
+    assert response.json() == {"received": 2, "inserted": 1, "duplicates": 1}
+
+    csv_body = f"user_id,cohort_id\n1,{cohort_id}\n2,{cohort_id}\n3,{cohort_id}\n"
+    response = client.post("/enrollments/bulk", content=csv_body, headers={**admin, "Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json() == {"received": 3, "inserted": 2, "duplicates": 1}
+    assert sorted(e["user_id"] for e in client.get(f"/enrollments/{cohort_id}").json()) == [1, 2, 3]
+
+    response = client.post("/enrollments/bulk", json=[{"user_id": "x", "cohort_id": cohort_id}], headers=admin)
+    assert response.status_code == 400
+    response = client.post("/enrollments/bulk", json=[{"user_id": 999, "cohort_id": cohort_id}], headers=admin)
+    assert response.status_code == 422
+    csv_headers = {**admin, "Content-Type": "text/csv"}
+    assert client.post("/enrollments/bulk", content=b"user_id,cohort_id\n\xff,1\n", headers=csv_headers).status_code == 400
+    oversized = b"user_id,cohort_id\n" + b"1" * 200_000 + b",1\n"
+    assert client.post("/enrollments/bulk", content=oversized, headers=csv_headers).status_code == 400
+    assert client.post("/enrollments/bulk", json=[], headers={"X-User-Email": "student@example.com"}).status_code == 403
+
+def test_bulk_grades_stream_csv_and_ndjson(client):
+    instructor = {"X-User-Email": "instructor@example.com"}
+    submission = client.post("/submissions", json={"assignment_id": 1, "user_id": 1, "file_url": "https://example.com/bulk.pdf"}).json()
+    sid = submission["id"]
+
+    def chunked(body, size=5):
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+
+    # Quoted multi-line feedback split across chunks; a bad score; an unknown submission;
+    # the repeated (submission, grader) pair keeps the last row
+    csv_body = (
+        "submission_id,grader_id,score,feedback\n"
+        f'{sid},2,70,"first, draft"\n'
+        f"{sid},3,oops,\n"
+        "9999,2,50,\n"
+        f'{sid},2,88,"line one\nline ""two"""\n'
+    ).encode()
+    response = client.post("/grades/bulk", content=chunked(csv_body), headers={**instructor, "Content-Type": "text/csv"})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["inserted"], result["updated"], result["rejected"]) == (4, 1, 0, 2)
+    assert [error["row"] for error in result["errors"]] == [2, 3]
+    assert "unknown submission 9999" in result["errors"][1]["error"]
+    grades = client.get(f"/grades/{sid}").json()
+    assert [(g["grader_id"], g["score"], g["feedback"]) for g in grades] == [(2, 88, 'line one\nline "two"')]
+
+    ndjson_body = (
+        json.dumps({"submission_id": sid, "grader_id": 2, "score": 91}) + "\n"
+        + "{not json\n"
+        + json.dumps({"submission_id": sid, "grader_id": 3, "score": 60, "feedback": "second"}) + "\n"
+    ).encode()
+    response = client.post("/grades/bulk", content=ndjson_body, headers={**instructor, "Content-Type": "application/x-ndjson"})
+    result = response.json()
+    # Grader 2 already graded the submission, so grader 3's row is refused
+    assert (result["received"], result["inserted"], result["updated"], result["rejected"]) == (3, 0, 1, 2)
+    assert "already graded by another grader" in result["errors"][1]["error"]
+    assert [(g["grader_id"], g["score"]) for g in client.get(f"/grades/{sid}").json()] == [(2, 91)]
+
+    # Within one file, the first grader named for a submission wins
+    other = client.post("/submissions", json={"assignment_id": 1, "user_id": 3, "file_url": "https://example.com/other.pdf"}).json()
+    csv_body = f"submission_id,grader_id,score,feedback\n{other['id']},3,40,\n{other['id']},2,45,\n".encode()
+    result = client.post("/grades/bulk", content=csv_body, headers={**instructor, "Content-Type": "text/csv"}).json()
+    assert (result["inserted"], result["rejected"]) == (1, 1)
+    assert [(g["grader_id"], g["score"]) for g in client.get(f"/grades/{other['id']}").json()] == [(3, 40)]
+
+    assert client.post("/grades/bulk", content=b"[]", headers={**instructor, "Content-Type": "application/json"}).status_code == 400
+    assert client.post("/grades/bulk", content=b"submission_id\n\xff\n", headers={**instructor, "Content-Type": "text/csv"}).status_code == 400
+    assert client.post("/grades/bulk", content=b"", headers={"X-User-Email": "student@example.com", "Content-Type": "text/csv"}).status_code == 403
+
+def test_cohort_gradebook_export(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    instructor = {"X-User-Email": "instructor@example.com"}
+    cohort_id = client.post("/cohorts", json={"name": "Gradebook", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    curriculum = client.post("/curriculum", json={"title": "Gradebook Course", "cohort_id": cohort_id}, headers=admin).json()
+    lesson = client.post("/lessons", json={"curriculum_id": curriculum["id"], "title": "Week 1", "order_index": 1}, headers=admin).json()
+    essay = client.post("/assignments", json={"lesson_id": lesson["id"], "title": "Essay, part 1", "max_score": 100}, headers=admin).json()
+    quiz = client.post("/assignments", json={"lesson_id": lesson["id"], "title": "Quiz", "max_score": 10}, headers=admin).json()
+    client.post("/enrollments/bulk", json=[{"user_id": 1, "cohort_id": cohort_id}, {"user_id": 3, "cohort_id": cohort_id}], headers=admin)
+    submission = client.post("/submissions", json={"assignment_id": quiz["id"], "user_id": 1, "file_url": "https://example.com/q.pdf"}).json()
+    client.post("/grades", json={"submission_id": submission["id"], "grader_id": 2, "score": 7}, headers=instructor)
+
+    response = client.get(f"/cohorts/{cohort_id}/gradebook", headers=instructor)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == [
+        'user_id,email,full_name,"Essay, part 1",Quiz',
+        "1,student@example.com,Student User,,7",
+        "3,admin@example.com,Admin User,,",
+    ]
+
+    response = client.get(f"/cohorts/{cohort_id}/gradebook?format=ndjson", headers=instructor)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["scores"] == {str(essay["id"]): None, str(quiz["id"]): 7}
+    assert [line["user_id"] for line in lines] == [1, 3]
+
+    assert client.get("/cohorts/9999/gradebook", headers=instructor).status_code == 404
+    assert client.get(f"/cohorts/{cohort_id}/gradebook", headers={"X-User-Email": "student@example.com"}).status_code == 403
+
+def test_event_range_and_calendar_feed(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    cohort_id = client.post("/cohorts", json={"name": "Calendar", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    events = []
+    for day, title in ((3, "Week 3; review"), (1, "Kickoff"), (2, "Week 2")):
+        events.append(client.post("/events", json={
+            "cohort_id": cohort_id, "title": title, "event_type": "class",
+            "start_time": f"2024-07-0{day}T12:00:00+02:00", "end_time": f"2024-07-0{day}T14:00:00+02:00",
+        }, headers=admin).json())
+    assert events[0]["start_time"].startswith("2024-07-03T10:00:00")
+
+    listed = client.get(f"/events/{cohort_id}").json()
+    assert [e["title"] for e in listed] == ["Kickoff", "Week 2", "Week 3; review"]
+    ranged = client.get(f"/events/{cohort_id}", params={"start": "2024-07-02T00:00:00Z", "end": "2024-07-03T10:00:00Z"}).json()
+    assert [e["title"] for e in ranged] == ["Week 2"]
+
+    response = client.get(f"/cohorts/{cohort_id}/calendar.ics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/calendar")
+    body = response.text
+    assert body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n")
+    assert body.count("BEGIN:VEVENT") == 3
+    assert "SUMMARY:Week 3\\; review\r\n" in body
+    assert "DTSTART:20240701T100000Z\r\n" in body
+    etag = response.headers["etag"]
+    revalidated = client.get(f"/cohorts/{cohort_id}/calendar.ics", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag and revalidated.headers["cache-control"] == "no-cache"
+
+    update = {**{k: events[1][k] for k in ("cohort_id", "event_type", "start_time", "end_time")}, "title": "Orientation"}
+    client.put(f"/events/{events[1]['id']}", json=update, headers=admin)
+    response = client.get(f"/cohorts/{cohort_id}/calendar.ics", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "SUMMARY:Orientation" in response.text and "Kickoff" not in response.text
+    client.delete(f"/events/{events[2]['id']}", headers=admin)
+    changed = client.get(f"/cohorts/{cohort_id}/calendar.ics", headers={"If-None-Match": response.headers["etag"]})
+    assert changed.status_code == 200 and changed.text.count("BEGIN:VEVENT") == 2
+    assert client.get("/cohorts/9999/calendar.ics").status_code == 404
+
+def test_login_code_email_is_queued_and_retried(client):
+    from app.email_outbox import outbox
+    outbox.transport.sent.clear()
+    outbox.transport.fail_next = 1
+
+    response = client.post("/auth/request_code", json={"email": "student@example.com"})
+    assert response.status_code == 200
+    code = response.json()["code"]
+
+    for _ in range(100):
+        if outbox.transport.sent:
+            break
+        time.sleep(0.05)
+    assert len(outbox.transport.sent) == 1
+    message = outbox.transport.sent[0]
+    assert message["to_email"] == "student@example.com"
+    assert code in message["html_content"]
+
+    async def outbox_row():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        row = await conn.fetchrow("SELECT status, attempts, html_content FROM email_outbox")
+        await conn.close()
+        return row
+    for _ in range(50):
+        row = asyncio.run(outbox_row())
+        if row["status"] == "sent":
+            break
+        time.sleep(0.05)
+    assert row["status"] == "sent"
+    assert row["attempts"] == 2
+    # The code does not stay in the database once delivered
+    assert row["html_content"] is None
+
+def test_migrations_are_tracked_and_checksummed(client, tmp_path):
+    from app.migrate import migrate, MigrationError, MIGRATIONS_DIR
+
+    async def run(directory):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            return await migrate(conn, directory)
+        finally:
+            await conn.close()
+
+    async def index_names():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        rows = await conn.fetch("SELECT indexname FROM pg_indexes WHERE indexname LIKE '%_idx'")
+        await conn.close()
+        return {row["indexname"] for row in rows}
+
+    # The fixture already migrated; a second run is a no-op
+    assert asyncio.run(run(MIGRATIONS_DIR)) == []
+    assert {"auth_codes_email_code_unused_idx", "grades_grader_id_idx", "submissions_user_id_idx"} <= asyncio.run(index_names())
+
+    # Editing an applied migration is refused
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        (tmp_path / path.name).write_text(path.read_text())
+    first = sorted(tmp_path.glob("*.sql"))[0]
+    first.write_text(first.read_text() + "\n-- edited\n")
+    with pytest.raises(MigrationError):
+        asyncio.run(run(tmp_path))
+
+    # A failing transactional migration leaves nothing behind
+    broken = tmp_path / "broken"
+    broken.mkdir()
+    (broken / "9999_broken.sql").write_text("CREATE TABLE half_done (id INT);\nSELECT * FROM no_such_table;\n")
+    with pytest.raises(asyncpg.UndefinedTableError):
+        asyncio.run(run(broken))
+    async def half_done_exists():
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        exists = await conn.fetchval("SELECT to_regclass('half_done') IS NOT NULL")
+        await conn.close()
+        return exists
+    assert not asyncio.run(half_done_exists())
+
+    # A failed concurrent build leaves an INVALID index; the retry replaces it
+    retry = tmp_path / "retry"
+    retry.mkdir()
+    (retry / "9998_unique_role.sql").write_text(
+        "-- migrate:no-transaction\n"
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_role_unique_idx ON users (role_id);\n"
+    )
+    async def execute(sql):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            return await conn.fetchval(sql)
+        finally:
+            await conn.close()
+    asyncio.run(execute("INSERT INTO users (id, email, full_name, role_id) VALUES (4, 'dup@example.com', 'Dup', 1)"))
+    with pytest.raises(asyncpg.UniqueViolationError):
+        asyncio.run(run(retry))
+    assert asyncio.run(execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('users_role_unique_idx')")) is False
+    asyncio.run(execute("DELETE FROM users WHERE email = 'dup@example.com'"))
+    assert asyncio.run(run(retry)) == [9998]
+    assert asyncio.run(execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('users_role_unique_idx')")) is True
+
+    # Dollar-quoted bodies cannot be split safely outside a transaction
+    dollar = tmp_path / "dollar"
+    dollar.mkdir()
+    (dollar / "9997_do_block.sql").write_text("-- migrate:no-transaction\nDO $$ BEGIN PERFORM 1; END $$;\n")
+    with pytest.raises(MigrationError):
+        asyncio.run(run(dollar))
+
+
+
+def test_query_stats(client):
+    client.get("/curriculum/1")
+    stats = client.get("/queries/stats").json()
+    assert stats["curriculum.get"]["calls"] >= 1
+    assert stats["curriculum.get"]["errors"] == 0
+
+
+def test_hot_statements_are_prepared_on_new_connections(client):
+    from app.db import db
+    from app.queries import registry
+
+    async def prepared():
+        async with db.pool.acquire() as conn:
+            return {row["statement"] for row in await conn.fetch("SELECT statement FROM pg_prepared_statements")}
+
+    statements = client.portal.call(prepared)
+    hot = [query for query in registry.queries.values() if query.hot]
+    assert hot and all(query.sql in statements for query in hot)
+    # Cold statements wait for their first use
+    assert registry.queries["cohort.list"].sql not in statements
+
+
+def test_pool_stats_and_acquire_timeout(client):
+    from app.db import db
+
+    stats = client.get("/db/pool/stats").json()
+    assert stats["max_size"] >= stats["size"] >= stats["idle"]
+    assert stats["acquires"] >= 1
+
+    # With every connection checked out, a request fails fast with 503
+    async def hold_all():
+        return [await db.pool.acquire() for _ in range(db.pool.get_max_size())]
+    async def release_all(conns):
+        for conn in conns:
+            await db.pool.release(conn)
+    held = client.portal.call(hold_all)
+    timeout, db.pool.acquire_timeout = db.pool.acquire_timeout, 0.05
+    try:
+        response = client.get("/cohorts")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        # Streams take their connection before the headers go out
+        assert client.get("/cohorts", params={"stream": "true"}).status_code == 503
+    finally:
+        db.pool.acquire_timeout = timeout
+        client.portal.call(release_all, held)
+    assert client.get("/cohorts").status_code == 200
+    idle = client.get("/db/pool/stats").json()["idle"]
+    assert client.get("/cohorts", params={"stream": "true"}).status_code == 200
+    stats = client.get("/db/pool/stats").json()
+    assert stats["idle"] == idle
+    assert stats["acquire_timeouts"] >= 2
+    assert stats["acquire_wait"]["count"] == stats["acquires"] + stats["acquire_timeouts"]
+
+
+def test_metrics_endpoint_reports_routes_and_db_time(client):
+    client.get("/cohorts")
+    client.get("/curriculum/1")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert '# TYPE lms_http_request_duration_seconds histogram' in text
+    # Routes are labelled by template, not by concrete path
+    assert 'route="/curriculum/{curriculum_id}"' in text
+    assert 'route="/curriculum/1"' not in text
+    assert 'lms_http_request_db_queries_total{method="GET",route="/cohorts",status="200"}' in text
+    assert 'lms_db_query_calls_total{query="cohort.list"}' in text
+    assert 'lms_db_pool_connections{state="idle"}' in text
+
+
+def test_request_id_header(client):
+    response = client.get("/health", headers={"X-Request-ID": "req-123"})
+    assert response.headers["X-Request-ID"] == "req-123"
+    assert len(client.get("/health").headers["X-Request-ID"]) == 32
+
+
+def test_queue_log_sink_drops_when_full(tmp_path):
+    import json
+    import threading
+    from app.app_logging import QueueSink, app_logger, render_json
+
+    gate = threading.Event()
+    def slow_render(record):
+        gate.wait()
+        return render_json(record)
+    log_path = tmp_path / "app.log"
+    sink = QueueSink(str(log_path), slow_render, maxsize=1, overflow="drop")
+    handler_id = app_logger.add(sink.write, format="{message}")
+    try:
+        with app_logger.contextualize(request_id="abc"):
+            for index in range(5):
+                app_logger.warning(f"message {index}")
+    finally:
+        app_logger.remove(handler_id)
+    gate.set()
+    sink.stop()
+    assert sink.dropped >= 3
+    lines = log_path.read_text().splitlines()
+    first = json.loads(lines[0])
+    assert first["message"] == "message 0"
+    assert first["request_id"] == "abc"
+    assert any("log records dropped" in line for line in lines)
+
+
+def test_curriculum_tree_is_nested_and_conditional(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    response = client.get("/curriculum/1/tree")
+    assert response.status_code == 200
+    tree = response.json()
+    assert tree["title"] == "Test Curriculum"
+    assert [lesson["title"] for lesson in tree["lessons"]] == ["Test Lesson"]
+    assert [a["title"] for a in tree["lessons"][0]["assignments"]] == ["Test Assignment"]
+    etag = response.headers["ETag"]
+    assert "Last-Modified" in response.headers
+
+    assert client.get("/curriculum/1/tree", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/curriculum/1/tree", headers={"If-Modified-Since": response.headers["Last-Modified"]}).status_code == 304
+
+    # Editing a lesson changes the tree and its validators
+    response = client.put("/lessons/1", json={"curriculum_id": 1, "title": "Renamed Lesson", "order_index": 1}, headers=admin)
+    assert response.status_code == 200
+    response = client.get("/curriculum/1/tree", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["lessons"][0]["title"] == "Renamed Lesson"
+    assert response.headers["ETag"] != etag
+
+    assert client.get("/curriculum/999/tree").status_code == 404
+
+
+def test_student_dashboard_tracks_enrollment_submission_and_grade(client):
+    admin = {"X-User-Email": "admin@example.com"}
+    instructor = {"X-User-Email": "instructor@example.com"}
+    cohort = client.post("/cohorts", json={"name": "Dashboard Cohort", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()
+    client.put("/curriculum/1", json={"title": "Test Curriculum", "cohort_id": cohort["id"]}, headers=admin)
+    # A second assignment due in the future
+    future = client.post("/assignments", json={"lesson_id": 1, "title": "Later", "due_date": "2999-01-01T00:00:00", "max_score": 10}, headers=admin).json()
+
+    dashboard = client.get("/student/dashboard/1").json()
+    assert dashboard["items"] == []
+
+    assert client.post("/enrollments", json={"user_id": 1, "cohort_id": cohort["id"]}).status_code == 200
+    dashboard = client.get("/student/dashboard/1").json()
+    # The seeded assignment was due at seed time, so it is already overdue
+    assert dashboard["counts"] == {"pending": 1, "overdue": 1, "submitted": 0, "graded": 0}
+
+    submission = client.post("/submissions", json={"assignment_id": future["id"], "user_id": 1, "file_url": "https://example.com/later.pdf"}).json()
+    dashboard = client.get("/student/dashboard/1").json()
+    assert dashboard["counts"] == {"pending": 0, "overdue": 1, "submitted": 1, "graded": 0}
+
+    response = client.post("/grades", json={"submission_id": submission["id"], "grader_id": 2, "score": 9, "feedback": "Good"}, headers=instructor)
+    assert response.status_code == 200
+    dashboard = client.get("/student/dashboard/1").json()
+    assert dashboard["counts"] == {"pending": 0, "overdue": 1, "submitted": 0, "graded": 1}
+    graded = [item for item in dashboard["items"] if item["status"] == "graded"][0]
+    assert graded["assignment_id"] == future["id"]
+    assert graded["score"] == 9
+
+    # Edits to an assignment flow through to the rollup
+    client.put(f"/assignments/{future['id']}", json={"lesson_id": 1, "title": "Renamed Later", "due_date": "2999-01-01T00:00:00", "max_score": 10}, headers=admin)
+    assert "Renamed Later" in [item["title"] for item in client.get("/student/dashboard/1").json()["items"]]
+
+
+def test_student_dashboard_refreshes_survive_concurrent_writes(client):
+    submission = client.post("/submissions", json={"assignment_id": 1, "user_id": 1, "file_url": "https://example.com/a.pdf"}).json()
+
+    async def race():
+        first = await asyncpg.connect(TEST_DATABASE_URL)
+        second = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            # Both writes refresh student 1's row for assignment 1
+            transaction = first.transaction()
+            await transaction.start()
+            await first.execute("UPDATE submissions SET file_url = 'https://example.com/b.pdf' WHERE id = $1", submission["id"])
+            grading = asyncio.create_task(second.execute(
+                "INSERT INTO grades (submission_id, grader_id, score, feedback) VALUES ($1, 2, 7, 'Fine')", submission["id"]
+            ))
+            await asyncio.sleep(0.3)
+            await transaction.commit()
+            await asyncio.wait_for(grading, 5)
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(race())
+    dashboard = client.get("/student/dashboard/1").json()
+    assert dashboard["counts"]["graded"] == 1
+    assert dashboard["items"][0]["score"] == 7
+
+
+def test_grading_queue_claims_are_exclusive(client):
+    from app.queries import GRADING_CLAIM
+
+    instructor = {"X-User-Email": "instructor@example.com"}
+    admin = {"X-User-Email": "admin@example.com"}
+    # Five ungraded submissions on five assignments
+    for i in range(5):
+        assignment = client.post("/assignments", json={"lesson_id": 1, "title": f"Queue {i}", "max_score": 10}, headers=admin).json()
+        client.post("/submissions", json={"assignment_id": assignment["id"], "user_id": 1, "file_url": f"https://example.com/{i}.pdf"})
+    queue = client.get("/grading/queue", headers=instructor).json()
+    assert len(queue) == 5
+    assert all(item["claimed_by"] is None for item in queue)
+
+    # Concurrent claimers never receive the same submission
+    async def claim_concurrently():
+        conns = [await asyncpg.connect(TEST_DATABASE_URL) for _ in range(3)]
+        try:
+            return await asyncio.gather(*(
+                GRADING_CLAIM.fetch(conn, None, None, 2, grader_id, 60.0)
+                for conn, grader_id in zip(conns, (2, 3, 2))
+            ))
+        finally:
+            for conn in conns:
+                await conn.close()
+    batches = asyncio.run(claim_concurrently())
+    claimed = [item.id for batch in batches for item in batch]
+    assert len(claimed) == len(set(claimed)) == 5
+    assert client.post("/grading/claims", json={"grader_id": 2}, headers=instructor).json() == []
+
+    # Only the holder can grade, and only once
+    held_by_3 = [item.id for batch, grader in zip(batches, (2, 3, 2)) if grader == 3 for item in batch]
+    held_by_2 = [item.id for batch, grader in zip(batches, (2, 3, 2)) if grader == 2 for item in batch]
+    target = held_by_3[0]
+    grade = {"grader_id": 2, "score": 7}
+    assert client.post(f"/grading/claims/{target}/grade", json=grade, headers=instructor).status_code == 409
+    assert client.post("/grades", json={"submission_id": target, **grade}, headers=instructor).status_code == 409
+    response = client.post(f"/grading/claims/{target}/grade", json={"grader_id": 3, "score": 8}, headers=instructor)
+    assert response.status_code == 200
+    assert response.json()["score"] == 8
+    assert client.post(f"/grading/claims/{target}/grade", json={"grader_id": 3, "score": 9}, headers=instructor).status_code == 409
+
+    # Released claims go back to the queue
+    released = held_by_2[0]
+    assert client.delete(f"/grading/claims/{released}", params={"grader_id": 2}, headers=instructor).status_code == 200
+    queue = client.get("/grading/queue", headers=instructor).json()
+    assert target not in [item["id"] for item in queue]
+    assert [item["claimed_by"] for item in queue if item["id"] == released] == [None]
+    reclaimed = client.post("/grading/claims", json={"grader_id": 3}, headers=instructor).json()
+    assert [item["id"] for item in reclaimed] == [released]
+
+    # Scoped by the cohort that owns the curriculum, or by assignment
+    cohort_id = client.post("/cohorts", json={"name": "Queue", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    other_cohort_id = client.post("/cohorts", json={"name": "Other", "start_date": "2024-07-01", "end_date": "2024-12-31"}, headers=admin).json()["id"]
+    client.put("/curriculum/1", json={"title": "Test Curriculum", "cohort_id": cohort_id}, headers=admin)
+    ungraded = {item["id"] for item in client.get("/grading/queue", headers=instructor).json()}
+    assert {item["id"] for item in client.get("/grading/queue", params={"cohort_id": cohort_id}, headers=instructor).json()} == ungraded
+    assert client.get("/grading/queue", params={"cohort_id": other_cohort_id}, headers=instructor).json() == []
+    one = client.get("/grading/queue", headers=instructor).json()[0]
+    scoped = client.get("/grading/queue", params={"cohort_id": cohort_id, "assignment_id": one["assignment_id"]}, headers=instructor).json()
+    assert [item["id"] for item in scoped] == [one["id"]]
+    assert client.post("/grading/claims", json={"grader_id": 2, "cohort_id": other_cohort_id}, headers=instructor).json() == []
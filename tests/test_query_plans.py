@@ -0,0 +1,200 @@
+"""
+Query-plan regression checks for every named statement the API runs.
+
+    python -m benchmarks.seed
+    PLAN_DATABASE_URL=postgresql://postgres@localhost/lms_load python -m pytest -q tests
+
+Skipped unless PLAN_DATABASE_URL names a database seeded by benchmarks.seed.
+While the rest of the suite runs (on its own small database), each query in
+app/queries.py records the arguments of its first successful run. The test
+here then runs EXPLAIN (ANALYZE, BUFFERS) of each statement with those
+arguments against the seeded database (migrated first), in a transaction
+it rolls back, and fails when a plan
+
+- seq scans a table (or partition) of PLAN_LARGE_TABLE_ROWS rows or more,
+  unless the statement and table are in ALLOWED_SEQ_SCANS;
+- costs more than PLAN_MAX_COST, or touches more than PLAN_MAX_BUFFERS
+  shared buffers, unless BUDGETS gives that statement more;
+- differs in shape (node types, join types, tables and indexes, ignoring
+  estimates) from its entry in query_plans.json.
+
+It also fails for a registered statement that nothing in the suite ran and
+that is not in NOT_PLANNED, so a new query needs a test before it gets a
+plan check. PLAN_UPDATE_BASELINE=1 rewrites query_plans.json from this run;
+review the diff like any other change.
+"""
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import asyncpg
+import pytest
+
+from app.queries import registry
+
+PLAN_DATABASE_URL = os.getenv("PLAN_DATABASE_URL")
+PLAN_LARGE_TABLE_ROWS = int(os.getenv("PLAN_LARGE_TABLE_ROWS", "10000"))
+PLAN_MAX_COST = float(os.getenv("PLAN_MAX_COST", "10000"))
+PLAN_MAX_BUFFERS = int(os.getenv("PLAN_MAX_BUFFERS", "2000"))
+PLAN_STATEMENT_TIMEOUT_MS = int(os.getenv("PLAN_STATEMENT_TIMEOUT_MS", "60000"))
+PLAN_UPDATE_BASELINE = os.getenv("PLAN_UPDATE_BASELINE", "false").lower() in ("1", "true")
+BASELINE_PATH = Path(__file__).with_name("query_plans.json")
+
+# Statements with no plan to check
+NOT_PLANNED = {
+    "enrollment.staging_create": "DDL",
+    "grade.staging_create": "DDL",
+    "lesson.sync_staging_create": "DDL",
+    "replica.lag": "only runs on read replicas",
+}
+# Statements that read a staging table, and the statement that creates it
+SETUP = {
+    "enrollment.staging_merge": "enrollment.staging_create",
+    "grade.staging_lock": "grade.staging_create",
+    "grade.staging_rejected": "grade.staging_create",
+    "grade.staging_discard": "grade.staging_create",
+    "grade.staging_merge": "grade.staging_create",
+    "lesson.sync_merge": "lesson.sync_staging_create",
+}
+# (statement, table): why reading the whole table is the plan we want
+ALLOWED_SEQ_SCANS = {
+    ("auth_code.purge", "auth_codes"): "the sweeper's batch; most of a partition is used or expired by the time it runs",
+    ("grade.staging_rejected", "users"): "the staging table has no statistics, so any import looks as big as users",
+}
+# Statement: raised budgets, with the reason
+BUDGETS = {
+    "assignment.list": {"buffers": 6000, "reason": "without ?limit the list returns every assignment"},
+    "assignment.list_json": {"cost": 30000, "buffers": 6000, "reason": "without ?limit the list returns every assignment"},
+    "auth_code.purge": {"buffers": 6000, "reason": "deletes up to AUTH_CODE_PURGE_BATCH rows"},
+    "grade.staging_rejected": {"cost": 20000, "reason": "costed at the planner's default size for a table without statistics"},
+    "gradebook.rows": {"cost": 60000, "buffers": 25000, "reason": "one submission and grade probe per student and assignment"},
+    "search": {"buffers": 15000, "reason": "ranks up to SEARCH_MAX_CANDIDATES matches of each kind"},
+    "submission.graded_by": {"cost": 15000, "reason": "unpaged; an instructor's whole grading history"},
+}
+
+if PLAN_DATABASE_URL:
+    # At collection time, before any test in the session has run a query
+    registry.start_capture()
+
+pytestmark = pytest.mark.skipif(not PLAN_DATABASE_URL, reason="PLAN_DATABASE_URL is not set")
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def plan_shape(node, roots, depth=0):
+    """Indented lines naming each node's type, join, table and index, with partitions folded into their table."""
+    label = node["Node Type"]
+    for key in ("Join Type", "Strategy", "Scan Direction"):
+        if key in node and node[key] not in ("Inner", "Plain", "Forward"):
+            label += f" {node[key]}"
+    if "Index Name" in node:
+        index = node["Index Name"]
+        for partition, root in roots.items():
+            if index.startswith(partition + "_") and partition != root:
+                index = root + index[len(partition):]
+                break
+        label += f" using {index}"
+    if "Relation Name" in node:
+        label += f" on {roots.get(node['Relation Name'], node['Relation Name'])}"
+    if node.get("Parent Relationship") in ("InitPlan", "SubPlan"):
+        label = f"{node['Parent Relationship']}: {label}"
+    lines = ["  " * depth + label]
+    seen = []
+    for child in node.get("Plans", []):
+        child_lines = plan_shape(child, roots, depth + 1)
+        # One line per distinct partition scan, however many partitions exist today
+        if node["Node Type"] in ("Append", "Merge Append") and child_lines in seen:
+            continue
+        seen.append(child_lines)
+        lines.extend(child_lines)
+    return lines
+
+
+async def table_sizes(conn):
+    """({table or partition: its table}, {table or partition: estimated rows})."""
+    rows = await conn.fetch("""
+        SELECT c.relname, COALESCE(parent.relname, c.relname) AS root, GREATEST(c.reltuples, 0) AS rows
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        LEFT JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE c.relkind IN ('r', 'p') AND c.relnamespace = current_schema()::regnamespace
+    """)
+    return {row["relname"]: row["root"] for row in rows}, {row["relname"]: row["rows"] for row in rows}
+
+
+async def explain(conn, name, args, captured):
+    """(plan, analyzed) for one statement; falls back to a plain EXPLAIN when running it with these arguments fails."""
+    for options in ("ANALYZE, BUFFERS, FORMAT JSON", "FORMAT JSON"):
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            await conn.execute(f"SET LOCAL statement_timeout = {PLAN_STATEMENT_TIMEOUT_MS}")
+            if name in SETUP:
+                await conn.execute(registry.queries[SETUP[name]].sql, *captured.get(SETUP[name], ()))
+            result = await conn.fetchval(f"EXPLAIN ({options}) {registry.queries[name].sql}", *args)
+            return json.loads(result)[0]["Plan"], options.startswith("ANALYZE")
+        except asyncpg.PostgresError:
+            if not options.startswith("ANALYZE"):
+                raise
+        finally:
+            await transaction.rollback()
+
+
+async def check_plans(captured):
+    from app.migrate import migrate
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    problems = []
+    shapes = {}
+    report = []
+    conn = await asyncpg.connect(PLAN_DATABASE_URL)
+    try:
+        await migrate(conn)
+        roots, sizes = await table_sizes(conn)
+        if sizes.get("submissions", 0) < PLAN_LARGE_TABLE_ROWS:
+            pytest.fail(f"{PLAN_DATABASE_URL} is not seeded; run python -m benchmarks.seed first")
+        for name in sorted(captured):
+            if name in NOT_PLANNED:
+                continue
+            plan, analyzed = await explain(conn, name, captured[name], captured)
+            for node in plan_nodes(plan):
+                relation = node.get("Relation Name")
+                if node["Node Type"] == "Seq Scan" and sizes.get(relation, 0) >= PLAN_LARGE_TABLE_ROWS:
+                    table = roots.get(relation, relation)
+                    problem = f"{name}: seq scan on {relation} ({sizes[relation]:,.0f} rows)"
+                    if (name, table) not in ALLOWED_SEQ_SCANS and problem not in problems:
+                        problems.append(problem)
+            budget = BUDGETS.get(name, {})
+            cost = plan["Total Cost"]
+            buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+            if cost > budget.get("cost", PLAN_MAX_COST):
+                problems.append(f"{name}: cost {cost:,.0f} over budget {budget.get('cost', PLAN_MAX_COST):,.0f}")
+            if analyzed and buffers > budget.get("buffers", PLAN_MAX_BUFFERS):
+                problems.append(f"{name}: {buffers:,} buffers over budget {budget.get('buffers', PLAN_MAX_BUFFERS):,}")
+            shapes[name] = plan_shape(plan, roots)
+            if not PLAN_UPDATE_BASELINE and shapes[name] != baseline.get(name):
+                expected = "\n".join(baseline[name]) if name in baseline else "(no baseline)"
+                problems.append(f"{name}: plan changed from\n{expected}\nto\n" + "\n".join(shapes[name]))
+            report.append(f"{name:<40} cost {cost:>12,.1f}  buffers {buffers if analyzed else '-':>8}")
+    finally:
+        await conn.close()
+    if PLAN_UPDATE_BASELINE:
+        BASELINE_PATH.write_text(json.dumps(dict(sorted(shapes.items())), indent=2) + "\n")
+    print("\n".join(report))
+    return problems
+
+
+def test_query_plans():
+    captured = registry.stop_capture()
+    if not captured:
+        pytest.fail("No statements were captured; run this file together with the rest of tests/")
+    missing = sorted(set(registry.queries) - set(captured) - set(NOT_PLANNED))
+    problems = asyncio.run(check_plans(captured))
+    if missing:
+        problems.append(f"not run by any test: {', '.join(missing)}")
+    assert not problems, "\n\n".join(problems)